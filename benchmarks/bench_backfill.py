@@ -0,0 +1,85 @@
+"""
+Benchmark find_backfill_revlist on a synthetic 200-push history.
+
+The jobs are served by a local stub query source which adds a fixed latency
+to every query to simulate a round trip to buildapi/Treeherder.
+
+Usage::
+
+    python benchmarks/bench_backfill.py [--latency 0.05] [--pushes 200]
+"""
+import time
+
+from argparse import ArgumentParser
+
+from mozci import mozci
+from mozci.query_jobs import SUCCESS, FAILURE, COALESCED
+
+BUILDERNAME = "Platform repo opt test mochitest-1"
+
+
+class StubQuerySource(object):
+    """Serve a synthetic history where only a few pushes have a successful job."""
+
+    def __init__(self, revisions, good_revisions, latency):
+        self.revisions = revisions
+        self.good_revisions = set(good_revisions)
+        self.latency = latency
+        self.queries = 0
+
+    def get_matching_jobs(self, repo_name, revision, buildername):
+        self.queries += 1
+        time.sleep(self.latency)
+        if revision in self.good_revisions:
+            return [{"status": SUCCESS}]
+        # SETA and permanent failures leave coalesced and failed jobs in between
+        return [{"status": COALESCED}, {"status": FAILURE}]
+
+    def get_job_status(self, job):
+        return job["status"]
+
+    def peek_job_status(self, job):
+        return job["status"]
+
+    def prefetch_jobs(self, repo_name, revisions):
+        pass
+
+
+def run(latency, pushes, gap, max_probes):
+    revisions = ["%012d" % i for i in range(pushes)]
+    query_source = StubQuerySource(revisions, revisions[gap::gap], latency)
+
+    mozci.QUERY_SOURCE = query_source
+    mozci.query_repo_name_from_buildername = lambda buildername: "repo"
+    mozci.query_repo_url_from_buildername = lambda buildername: "https://hg/repo"
+    mozci.pushlog.query_revisions_range_from_revision_before_and_after = \
+        lambda repo_url, revision, before, after: revisions[:before + 1]
+
+    start = time.time()
+    revlist = mozci.find_backfill_revlist(BUILDERNAME, revisions[0], max_revisions=pushes,
+                                          max_probes=max_probes)
+    return revlist, time.time() - start, query_source.queries
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Seconds added to every job query.")
+    parser.add_argument("--pushes", type=int, default=200,
+                        help="Number of pushes in the synthetic history.")
+    parser.add_argument("--max-probes", type=int, default=mozci.BACKFILL_MAX_PROBES,
+                        help="Maximum number of concurrent probes.")
+    options = parser.parse_args()
+
+    print "%6s %12s %12s %8s %8s" % ("gap", "linear (s)", "galloping (s)", "queries", "speedup")
+    for gap in (1, 5, 20, 60, options.pushes - 1):
+        linear, linear_time, _ = run(options.latency, options.pushes, gap, 1)
+        galloping, galloping_time, queries = run(options.latency, options.pushes, gap,
+                                                 options.max_probes)
+        assert linear == galloping, "The results have to match the linear scan"
+        speedup = linear_time / galloping_time
+        print "%6d %12.2f %12.2f %8d %7.1fx" % (gap, linear_time, galloping_time, queries, speedup)
+
+
+if __name__ == "__main__":
+    main()
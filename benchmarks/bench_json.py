@@ -0,0 +1,73 @@
+"""
+Benchmark the json decoders and ijson backends available on this system.
+
+A synthetic buildjson day file is generated with benchmarks/fake_services.py and
+decoded by every usable backend of mozci.utils.json_backend: whole (DECODERS)
+and streamed job by job (STREAMING_BACKENDS). The throughput is computed from
+the uncompressed size of the file and the best of --repeat runs.
+
+Usage::
+
+    python benchmarks/bench_json.py [--pushes 200] [--repeat 3]
+"""
+import json
+import time
+
+from argparse import ArgumentParser
+from StringIO import StringIO
+
+from fake_services import FakeCI
+from mozci.utils import json_backend
+
+
+def synthetic_day_file(pushes):
+    """Return the uncompressed contents of a buildjson file with the jobs of `pushes` pushes."""
+    ci = FakeCI(pushes=pushes, platforms=8, tests_per_platform=20, push_interval=60)
+    builds = [ci.buildjson_entry(job) for job in ci.jobs if job['endtime'] is not None]
+    return json.dumps({'builds': builds}), len(builds)
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--pushes", type=int, default=200,
+                        help="Number of pushes in the synthetic history.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of runs per backend; the best one is reported.")
+    options = parser.parse_args()
+
+    data, jobs = synthetic_day_file(options.pushes)
+    megabytes = len(data) / 1024.0 / 1024.0
+    print "Synthetic day file: %d jobs, %.1f MB" % (jobs, megabytes)
+    print "%-24s %10s %10s" % ("backend", "time (s)", "MB/s")
+
+    for name in json_backend.available(json_backend.DECODERS, json_backend.import_decoder):
+        decoder = json_backend.import_decoder(name)
+        elapsed = best_time(lambda: decoder.loads(data), options.repeat)
+        print "%-24s %10.3f %10.1f" % (name, elapsed, megabytes / elapsed)
+
+    for name in json_backend.available(json_backend.STREAMING_BACKENDS,
+                                       json_backend.import_streaming_backend):
+        backend = json_backend.import_streaming_backend(name)
+
+        def _stream():
+            for _ in backend.items(StringIO(data), 'builds.item'):
+                pass
+
+        elapsed = best_time(_stream, options.repeat)
+        print "%-24s %10.3f %10.1f" % ('ijson ' + name, elapsed, megabytes / elapsed)
+
+    print "Selected: %s (whole files), ijson %s (streaming)" % (
+        json_backend.DECODER, json_backend.STREAMING_BACKEND)
+
+
+if __name__ == "__main__":
+    main()
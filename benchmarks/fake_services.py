@@ -0,0 +1,582 @@
+"""
+Local stand-ins for the services mozci talks to.
+
+FakeCI generates a synthetic CI history (pushes, builders and the jobs which ran
+on them) and every service serves its own view of it:
+
+* json-pushes  - hg.mozilla.org's pushlog (/hg/<repo path>/json-pushes)
+* self-serve   - buildapi (/buildapi/self-serve/...)
+* buildjson    - builds-4hr.js.gz and builds-<day>.js.gz (/buildjson/...)
+* allthethings - allthethings.json (/allthethings.json)
+* treeherder   - resultsets, jobs and artifacts (/api/project/<repo>/...)
+* artifacts    - the packages produced by the build jobs (/artifacts/...)
+* taskcluster-queue - the jobs of every push as the tasks of a task group (/v1/...)
+* taskcluster-scheduler - accepts task graphs (/v1/task-graph/...)
+
+Every service listens on its own localhost port, sleeps `latency` seconds
+before answering and counts the requests it receives.
+"""
+import calendar
+import gzip
+import hashlib
+import json
+import threading
+import time
+import urlparse
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+
+# Self-serve statuses (see mozci.query_jobs)
+SUCCESS, FAILURE = 0, 2
+HTTP_DATE = '%a, %d %b %Y %H:%M:%S GMT'
+
+
+def _ratio(*keys):
+    """Return a deterministic number in [0, 1) for keys."""
+    digest = hashlib.sha1('-'.join(str(key) for key in keys)).hexdigest()
+    return int(digest[:8], 16) / float(0x100000000)
+
+
+def _gzip(content):
+    buf = StringIO()
+    gzipper = gzip.GzipFile(fileobj=buf, mode='wb')
+    gzipper.write(content)
+    gzipper.close()
+    return buf.getvalue()
+
+
+class FakeCI(object):
+    """
+    A synthetic CI history for a single repository.
+
+    pushes             - number of pushes in the history (one revision each)
+    platforms          - number of platforms; each one has a build builder
+    tests_per_platform - number of test builders triggered by each build builder
+    coverage           - fraction of (push, builder) pairs which have a job (the rest
+                         were skipped by SETA or coalesced away)
+    push_interval      - seconds between pushes; the newest push is `now`
+    """
+
+    def __init__(self, pushes=100, platforms=4, tests_per_platform=10, coverage=0.7,
+                 push_interval=600, repo_name='mozilla-inbound',
+                 repo_path='integration/mozilla-inbound', now=None):
+        self.repo_name = repo_name
+        self.repo_path = repo_path
+        self.now = int(now or time.time())
+        self.last_modified = time.strftime(HTTP_DATE, time.gmtime(self.now))
+        self.coverage = coverage
+        self.artifacts_url = None
+
+        self.pushes = []
+        self._pushes_by_revision = {}
+        for push_id in range(1, pushes + 1):
+            push = {
+                'pushid': push_id,
+                'revision': hashlib.sha1('push-%d' % push_id).hexdigest(),
+                'date': self.now - (pushes - push_id) * push_interval,
+                'user': 'developer%d@example.com' % (push_id % 7),
+            }
+            self.pushes.append(push)
+            self._pushes_by_revision[push['revision'][:12]] = push
+
+        self.builders = {}
+        self.schedulers = {}
+        self.build_builders = []
+        self.test_builders = []
+        for index in range(platforms):
+            platform = 'platform%d' % index
+            shortname = '%s-%s' % (repo_name, platform)
+            build = 'Platform%d %s build' % (index, repo_name)
+            self.build_builders.append(build)
+            self.builders[build] = {
+                'shortname': shortname,
+                'properties': {'platform': platform, 'branch': repo_path,
+                               'product': 'firefox', 'repo_path': repo_path},
+            }
+
+            tests = ['Platform%d %s opt test suite-%d' % (index, repo_name, number)
+                     for number in range(tests_per_platform)]
+            self.test_builders.extend(tests)
+            for test in tests:
+                self.builders[test] = {
+                    'shortname': '%s-opt-test' % shortname,
+                    'properties': {'platform': platform, 'branch': repo_path,
+                                   'product': 'firefox', 'slavebuilddir': 'test'},
+                }
+            self.schedulers['tests-%s-opt-unittest' % shortname] = {
+                'downstream': tests,
+                'triggered_by': ['%s-opt-unittest' % shortname],
+            }
+
+        self.builder_ids = dict((name, index) for index, name in enumerate(sorted(self.builders)))
+        self._generate_jobs()
+
+    def _generate_jobs(self):
+        """Decide which jobs ran on every push and how they ended."""
+        self.jobs = []
+        self.jobs_by_revision = {}
+        request_id = 1000
+        for push in self.pushes:
+            revision = push['revision']
+            jobs = self.jobs_by_revision[revision] = []
+            for buildername in sorted(self.builders):
+                if _ratio(revision, buildername, 'coverage') >= self.coverage:
+                    continue
+
+                request_id += 1
+                roll = _ratio(revision, buildername, 'status')
+                age = self.now - push['date']
+                job = {
+                    'request_id': request_id,
+                    'buildername': buildername,
+                    'revision': revision,
+                    'submitted_at': push['date'],
+                    'starttime': push['date'] + 60,
+                    'endtime': push['date'] + 1800,
+                    'state': 'completed',
+                    'status': SUCCESS,
+                    'coalesced_to': None,
+                }
+                if age < 1800:
+                    # Recent pushes still have jobs in flight
+                    job['state'] = 'running' if roll < 0.5 else 'pending'
+                    job['status'] = None
+                    job['endtime'] = None
+                elif roll < 0.12:
+                    job['status'] = FAILURE
+                elif roll < 0.2 and push['pushid'] < len(self.pushes):
+                    # The job ran on the next push instead
+                    job['coalesced_to'] = self.pushes[push['pushid']]['revision']
+
+                jobs.append(job)
+                self.jobs.append(job)
+        self.next_request_id = request_id + 1
+
+    def push_by_revision(self, revision):
+        push = self._pushes_by_revision.get(revision[:12])
+        if push and push['revision'].startswith(revision):
+            return push
+        return None
+
+    def allthethings(self):
+        return {'builders': self.builders, 'schedulers': self.schedulers}
+
+    def buildjson_entry(self, job):
+        """Return the buildjson entry of a finished job."""
+        properties = {
+            'buildername': job['buildername'],
+            'revision': job['coalesced_to'] or job['revision'],
+            'request_ids': [job['request_id']],
+            'repo_path': self.repo_path,
+            'buildid': time.strftime('%Y%m%d%H%M%S', time.gmtime(job['starttime'])),
+        }
+        if job['buildername'] in self.build_builders:
+            platform = self.builders[job['buildername']]['properties']['platform']
+            base = '%s/%s/%s' % (self.artifacts_url, job['revision'], platform)
+            properties['packageUrl'] = '%s/firefox.tar.bz2' % base
+            properties['testPackagesUrl'] = '%s/test_packages.json' % base
+        return {
+            'builder_id': self.builder_ids[job['buildername']],
+            'starttime': job['starttime'],
+            'endtime': job['endtime'],
+            'request_ids': [job['request_id']],
+            'requesttime': job['submitted_at'],
+            'result': job['status'],
+            'properties': properties,
+        }
+
+    def finished_jobs(self, start, end):
+        return [job for job in self.jobs
+                if job['endtime'] is not None and start <= job['endtime'] < end]
+
+
+class FakeService(object):
+    """Base class of the services; subclasses answer requests in handle()."""
+
+    name = None
+
+    def __init__(self, ci, latency=0.0):
+        self.ci = ci
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.url = None
+
+    def record(self):
+        with self._lock:
+            self.calls += 1
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+
+    def handle(self, method, path, query, headers):
+        """Return (status code, headers, body); body is a string or json-able data."""
+        raise NotImplementedError
+
+
+class JsonPushes(FakeService):
+    name = 'json-pushes'
+
+    def _push(self, push, full=False):
+        changesets = [push['revision']]
+        if full:
+            changesets = [{'node': push['revision'], 'desc': 'Push %d' % push['pushid']}]
+        return {'changesets': changesets, 'date': push['date'], 'user': push['user']}
+
+    def _pushes(self, pushes, version):
+        data = dict((str(p['pushid']), self._push(p)) for p in pushes)
+        if version == 2:
+            return {'lastpushid': len(self.ci.pushes), 'pushes': data}
+        return data
+
+    def handle(self, method, path, query, headers):
+        version = int(query.get('version', 1))
+        if 'changeset' in query:
+            push = self.ci.push_by_revision(query['changeset'])
+            if push is None:
+                return 404, {}, {}
+            return 200, {}, {str(push['pushid']): self._push(push, 'full' in query)}
+
+        if 'fromchange' in query:
+            start = self.ci.push_by_revision(query['fromchange'])['pushid']
+            end = self.ci.push_by_revision(query['tochange'])['pushid']
+        elif 'startID' in query:
+            start, end = int(query['startID']), int(query['endID'])
+        else:
+            end = len(self.ci.pushes)
+            start = max(0, end - 10)
+        return 200, {}, self._pushes(self.ci.pushes[max(0, start):end], version)
+
+
+class SelfServe(FakeService):
+    name = 'self-serve'
+
+    def __init__(self, ci, latency=0.0, repo_url=None):
+        super(SelfServe, self).__init__(ci, latency)
+        self.repo_url = repo_url
+
+    def _job(self, job):
+        entry = {
+            'build_id': job['request_id'],
+            'buildername': job['buildername'],
+            'revision': job['revision'],
+            'requests': [{'request_id': job['request_id'],
+                          'complete_at': job['endtime'],
+                          'revision': job['revision']}],
+        }
+        if job['state'] == 'pending':
+            # Pending jobs only have a request
+            return entry
+        entry.update({'status': job['status'], 'starttime': job['starttime'],
+                      'endtime': job['endtime']})
+        return entry
+
+    def _new_request(self):
+        with self._lock:
+            request_id = self.ci.next_request_id
+            self.ci.next_request_id += 1
+        return 202, {}, {'request_id': request_id}
+
+    def handle(self, method, path, query, headers):
+        parts = path.split('/')[3:]
+        if parts == ['branches']:
+            return 200, {}, {self.ci.repo_name: {'repo': self.repo_url,
+                                                 'graph_branches': [self.ci.repo_name],
+                                                 'repo_type': 'hg'}}
+        if method == 'DELETE':
+            # Cancelled requests and stopped builds; the history is left untouched
+            # so that every run sees the same jobs
+            return 200, {}, {'request_id': int(parts[-1])}
+        if method == 'POST':
+            return self._new_request()
+        if len(parts) == 3 and parts[1] == 'rev':
+            push = self.ci.push_by_revision(parts[2])
+            if push is None:
+                return 404, {}, []
+            return 200, {}, [self._job(job) for job in self.ci.jobs_by_revision[push['revision']]]
+        # The landing page (used to validate credentials)
+        return 200, {}, {}
+
+
+class BuildJson(FakeService):
+    name = 'buildjson'
+
+    def __init__(self, ci, latency=0.0):
+        super(BuildJson, self).__init__(ci, latency)
+        self._files = {}
+
+    def _content(self, filename):
+        if filename not in self._files:
+            if filename == 'builds-4hr.js.gz':
+                start, end = self.ci.now - 4 * 60 * 60, self.ci.now + 1
+            else:
+                day = time.strptime(filename[len('builds-'):-len('.js.gz')], '%Y-%m-%d')
+                start = calendar.timegm(day)
+                end = start + 24 * 60 * 60
+            builds = [self.ci.buildjson_entry(j) for j in self.ci.finished_jobs(start, end)]
+            self._files[filename] = _gzip(json.dumps({'builds': builds}))
+        return self._files[filename]
+
+    def handle(self, method, path, query, headers):
+        if headers.get('If-Modified-Since') == self.ci.last_modified:
+            return 304, {}, ''
+        return 200, {'Last-Modified': self.ci.last_modified}, \
+            self._content(path.split('/')[-1])
+
+
+class AllTheThings(FakeService):
+    name = 'allthethings'
+
+    def __init__(self, ci, latency=0.0):
+        super(AllTheThings, self).__init__(ci, latency)
+        self.content = json.dumps(ci.allthethings())
+
+    def handle(self, method, path, query, headers):
+        return 200, {}, self.content
+
+
+class Treeherder(FakeService):
+    name = 'treeherder'
+
+    def _job(self, job):
+        result = {None: 'unknown', SUCCESS: 'success', FAILURE: 'testfailed'}[job['status']]
+        return {
+            'id': job['request_id'],
+            'ref_data_name': job['buildername'],
+            'build_system_type': 'buildbot',
+            'job_coalesced_to_guid': 'guid-%s' % job['coalesced_to']
+            if job['coalesced_to'] else None,
+            'result': result,
+            'state': job['state'],
+            'push_id': self.ci.push_by_revision(job['revision'])['pushid'],
+            'result_set_id': self.ci.push_by_revision(job['revision'])['pushid'],
+        }
+
+    def handle(self, method, path, query, headers):
+        endpoint = path.strip('/').split('/')[-1]
+        if endpoint == 'resultset':
+            if 'fromchange' in query:
+                start = self.ci.push_by_revision(query['fromchange'])
+                end = self.ci.push_by_revision(query['tochange'])
+                pushes = self.ci.pushes[start['pushid'] - 1:end['pushid']] \
+                    if start and end else []
+            else:
+                push = self.ci.push_by_revision(query.get('revision', ''))
+                pushes = [push] if push else []
+            # Newest first
+            results = [{'id': p['pushid'], 'revision': p['revision']} for p in reversed(pushes)]
+            offset = int(query.get('offset', 0))
+            return 200, {}, {'results': results[offset:offset + int(query.get('count', 10))]}
+
+        if endpoint == 'jobs':
+            if query.get('visibility') == 'excluded':
+                return 200, {}, {'results': []}
+            if 'result_set_id__in' in query:
+                ids = map(int, query['result_set_id__in'].split(','))
+            else:
+                ids = [int(query['result_set_id'])]
+            jobs = [self._job(j) for push_id in ids
+                    for j in self.ci.jobs_by_revision[self.ci.pushes[push_id - 1]['revision']]]
+            offset = int(query.get('offset', 0))
+            count = int(query.get('count', 2000))
+            return 200, {}, {'results': jobs[offset:offset + count]}
+
+        if endpoint == 'artifact':
+            job_ids = query['job_id__in'].split(',') if 'job_id__in' in query \
+                else [query['job_id']]
+            return 200, {}, [{'name': 'buildapi', 'job_id': int(job_id),
+                              'blob': {'request_id': int(job_id)}} for job_id in job_ids]
+
+        return 404, {}, {}
+
+
+class Artifacts(FakeService):
+    name = 'artifacts'
+
+    def handle(self, method, path, query, headers):
+        return 200, {}, 'x' * 1024
+
+
+class TaskclusterQueue(FakeService):
+    """The jobs of a push are the tasks of the task group 'group-<pushid>'."""
+
+    name = 'taskcluster-queue'
+    # Tasks per page of /task-group/<id>/list
+    PAGE_SIZE = 100
+
+    def __init__(self, ci, latency=0.0):
+        super(TaskclusterQueue, self).__init__(ci, latency)
+        self._jobs = None
+
+    def _task(self, job):
+        push = self.ci.push_by_revision(job['revision'])
+        return {
+            'taskGroupId': 'group-%d' % push['pushid'],
+            'metadata': {'name': job['buildername'], 'description': job['buildername'],
+                         'owner': push['user'],
+                         'source': 'https://hg.mozilla.org/%s' % self.ci.repo_path},
+            'payload': {},
+            'extra': {'revision': job['revision']},
+        }
+
+    def _status(self, job):
+        state = job['state']
+        if state == 'completed' and job['status'] != SUCCESS:
+            state = 'failed'
+        return {'taskId': 'task-%d' % job['request_id'],
+                'taskGroupId': 'group-%d' % self.ci.push_by_revision(job['revision'])['pushid'],
+                'state': state, 'runs': []}
+
+    def _job(self, task_id):
+        if self._jobs is None:
+            self._jobs = dict(('task-%d' % job['request_id'], job) for job in self.ci.jobs)
+        return self._jobs.get(task_id)
+
+    def handle(self, method, path, query, headers):
+        parts = path.split('/')[2:]
+        if len(parts) == 3 and parts[0] == 'task-group' and parts[2] == 'list':
+            pushid = int(parts[1][len('group-'):])
+            jobs = self.ci.jobs_by_revision[self.ci.pushes[pushid - 1]['revision']]
+            start = int(query.get('continuationToken', 0))
+            end = start + int(query.get('limit', self.PAGE_SIZE))
+            response = {'taskGroupId': parts[1],
+                        'tasks': [{'status': self._status(job), 'task': self._task(job)}
+                                  for job in jobs[start:end]]}
+            if end < len(jobs):
+                response['continuationToken'] = str(end)
+            return 200, {}, response
+
+        if len(parts) < 2 or parts[0] != 'task':
+            return 404, {}, {}
+        job = self._job(parts[1])
+        if job is None:
+            return 404, {}, {'message': 'Task not found'}
+        if len(parts) == 2:
+            return 200, {}, self._task(job)
+        if parts[2] == 'status':
+            return 200, {}, {'status': self._status(job)}
+        if parts[2] == 'cancel' and method == 'POST':
+            # As with self-serve, the history is left untouched
+            return 200, {}, {'status': dict(self._status(job), state='exception')}
+        return 404, {}, {}
+
+
+class TaskclusterScheduler(FakeService):
+    name = 'taskcluster-scheduler'
+
+    def handle(self, method, path, query, headers):
+        parts = path.split('/')[2:]
+        if len(parts) < 2 or parts[0] != 'task-graph':
+            return 404, {}, {}
+        # Graphs are accepted but not kept; they run forever
+        return 200, {}, {'status': {'taskGraphId': parts[1], 'schedulerId': 'task-graph-scheduler',
+                                    'state': 'running'}}
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    """Answer requests through the FakeService attached to the server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self):
+        service = self.server.service
+        service.record()
+        if service.latency:
+            time.sleep(service.latency)
+
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query, keep_blank_values=True))
+        length = int(self.headers.getheader('content-length') or 0)
+        if length:
+            self.rfile.read(length)
+
+        status, headers, body = service.handle(self.command, url.path, query, self.headers)
+        if not isinstance(body, basestring):
+            body = json.dumps(body)
+            headers.setdefault('Content-Type', 'application/json')
+
+        self.send_response(status)
+        for key, value in headers.iteritems():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD' and status != 304:
+            self.wfile.write(body)
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_DELETE = _respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeServices(object):
+    """
+    Start every service on its own localhost port.
+
+    Usage::
+
+        with FakeServices(FakeCI(pushes=50), latency={'self-serve': 0.05}) as services:
+            services.endpoints()  # urls to point mozci to
+    """
+
+    def __init__(self, ci, latency=None, default_latency=0.0):
+        latency = latency or {}
+        self.ci = ci
+        self.services = {}
+        self._servers = []
+        classes = (JsonPushes, SelfServe, BuildJson, AllTheThings, Treeherder, Artifacts,
+                   TaskclusterQueue, TaskclusterScheduler)
+        for cls in classes:
+            self.services[cls.name] = cls(ci, latency.get(cls.name, default_latency))
+
+    def start(self):
+        for service in self.services.itervalues():
+            server = ThreadedHTTPServer(('127.0.0.1', 0), FakeServiceHandler)
+            server.service = service
+            service.url = 'http://127.0.0.1:%d' % server.server_port
+            thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+            thread.daemon = True
+            thread.start()
+            self._servers.append(server)
+
+        self.ci.artifacts_url = '%s/artifacts' % self.services['artifacts'].url
+        self.services['self-serve'].repo_url = self.endpoints()['repo_url']
+        return self
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def endpoints(self):
+        """Return the urls mozci has to use instead of the production ones."""
+        return {
+            'repo_url': '%s/hg/%s' % (self.services['json-pushes'].url, self.ci.repo_path),
+            'buildapi': '%s/buildapi/self-serve' % self.services['self-serve'].url,
+            'buildjson': '%s/buildjson' % self.services['buildjson'].url,
+            'allthethings': '%s/allthethings.json' % self.services['allthethings'].url,
+            'treeherder': self.services['treeherder'].url,
+            'taskcluster_queue': '%s/v1' % self.services['taskcluster-queue'].url,
+            'taskcluster_scheduler': '%s/v1' % self.services['taskcluster-scheduler'].url,
+        }
+
+    def calls(self):
+        return dict((name, service.calls) for name, service in self.services.iteritems())
+
+    def reset(self):
+        for service in self.services.itervalues():
+            service.reset()
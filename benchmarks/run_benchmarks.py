@@ -0,0 +1,380 @@
+"""
+Run mozci's main workflows end-to-end against local stand-in services.
+
+The services (json-pushes, self-serve, buildjson, allthethings, Treeherder, the
+build artifacts and the TaskCluster queue and scheduler) are served by
+benchmarks/fake_services.py from a synthetic history whose size and latency can
+be configured. Every workflow runs in its own
+process with an empty ~/.mozilla/mozci so that it starts cold and its peak
+memory is its own.
+
+For every workflow we report:
+
+* the wall time (median of --repeat runs)
+* the HTTP requests received by each service and the ones mozci recorded
+  (see mozci.utils.instrumentation)
+* the peak memory (maximum resident set size) of the process
+
+The results are stored as json (by default in benchmarks/results/<commit>.json)
+and can be compared with the results of another commit::
+
+    python benchmarks/run_benchmarks.py --pushes 200 --latency 0.02
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/abc1234.json
+
+--compare exits with 1 if a workflow got slower than --threshold or made more requests.
+
+A run can be recorded (see mozci.utils.cassette) and replayed later without any
+service or network access::
+
+    python benchmarks/run_benchmarks.py --record /tmp/session
+    python benchmarks/run_benchmarks.py --replay /tmp/session --latency 0.05
+"""
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser, SUPPRESS
+
+from fake_services import FakeCI, FakeServices
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+# Stored next to the cassettes of a recorded session
+SESSION_FILE = 'session.json'
+WORKFLOWS = (
+    'trigger_range',
+    'trigger_missing_jobs_for_revision',
+    'find_backfill_revlist.buildapi',
+    'find_backfill_revlist.treeherder',
+    'tc_graph',
+    'cancel_all.buildapi',
+    'cancel_all.taskcluster',
+    'retrigger_tasks',
+)
+# Workflows whose requests differ on every run (retrigger_tasks sends new task ids
+# and deadlines) so they can't be answered from a cassette
+NOT_REPLAYABLE = ('retrigger_tasks',)
+
+
+#
+# Worker side; this code runs in a fresh process for every workflow
+#
+def _point_mozci_to(endpoints):
+    """Make mozci use the stand-in services instead of the production ones."""
+    from mozci import query_jobs
+    from mozci.sources import allthethings, buildapi, buildjson, tc
+    from mozci.utils import authentication, transfer
+
+    buildapi.HOST_ROOT = endpoints['buildapi']
+    authentication.LDAP_HOST = endpoints['buildapi']
+    authentication.AUTH = ('benchmark@example.com', 'password')
+    buildjson.BUILDJSON_DATA = endpoints['buildjson']
+    allthethings.ALLTHETHINGS = endpoints['allthethings']
+    query_jobs.TREEHERDER_URL = endpoints['treeherder']
+    tc.QUEUE_OPTIONS = {'baseUrl': endpoints['taskcluster_queue']}
+    tc.SCHEDULER_OPTIONS = {'baseUrl': endpoints['taskcluster_scheduler']}
+    transfer.SHOW_PROGRESS_BAR = False
+
+
+def _run_workflow(workflow, scenario):
+    from mozci import ci_manager, mozci
+    from mozci.sources import tc
+    from mozci.sources import buildbot_bridge
+
+    if workflow == 'trigger_range':
+        mozci.trigger_range(buildername=scenario['test_buildername'],
+                            revisions=scenario['revisions'],
+                            times=2)
+
+    elif workflow == 'trigger_missing_jobs_for_revision':
+        mozci.trigger_missing_jobs_for_revision(repo_name=scenario['repo_name'],
+                                                revision=scenario['revision'])
+
+    elif workflow.startswith('find_backfill_revlist.'):
+        mozci.set_query_source(workflow.split('.')[1])
+        mozci.find_backfill_revlist(buildername=scenario['test_buildername'],
+                                    revision=scenario['tip'],
+                                    max_revisions=scenario['max_revisions'])
+
+    elif workflow == 'tc_graph':
+        buildbot_bridge.generate_builders_tc_graph(
+            repo_name=scenario['repo_name'],
+            revision=scenario['revision'],
+            builders_graph=scenario['builders_graph'])
+
+    elif workflow == 'cancel_all.buildapi':
+        ci_manager.BuildAPIManager().cancel_all(repo_name=scenario['repo_name'],
+                                                revision=scenario['tip'])
+
+    elif workflow == 'cancel_all.taskcluster':
+        ci_manager.TaskclusterManager().cancel_all(repo_name=scenario['repo_name'],
+                                                   revision=scenario['tip'],
+                                                   task_group_id=scenario['task_group_id'])
+
+    elif workflow == 'retrigger_tasks':
+        tc.retrigger_tasks(task_ids=scenario['task_ids'])
+
+    else:
+        raise ValueError("Unknown workflow %s" % workflow)
+
+
+def worker(config):
+    """Run a workflow and return its measurements."""
+    from mozci.utils import instrumentation, transport
+
+    _point_mozci_to(config['endpoints'])
+    if config.get('replay'):
+        transport.replay(config['replay'], latency=config['replay_latency'])
+    elif config.get('record'):
+        transport.record(config['record'])
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.time()
+    _run_workflow(config['workflow'], config['scenario'])
+    wall_time = time.time() - start
+    transport.stop()
+
+    metrics = instrumentation.to_json()
+    return {
+        'wall_time': round(wall_time, 4),
+        'client_requests': dict((source, stats['calls'])
+                                for source, stats in metrics['requests'].iteritems()),
+        'baseline_rss_kb': baseline_rss,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'metrics': metrics,
+    }
+
+
+#
+# Driver side
+#
+def _scenario(ci, options):
+    """Pick the builders and revisions every workflow works on."""
+    revisions = [push['revision'][:12] for push in ci.pushes]
+    # The newest pushes still have jobs running; older ones are complete
+    settled = revisions[-5]
+    build = ci.build_builders[0]
+    return {
+        'repo_name': ci.repo_name,
+        'test_buildername': ci.test_builders[0],
+        'revisions': revisions[-options.range - 4:-4],
+        'revision': settled,
+        'tip': revisions[-1],
+        # The tasks of the tip (see fake_services.TaskclusterQueue)
+        'task_group_id': 'group-%d' % ci.pushes[-1]['pushid'],
+        # Retriggering every job of the settled push
+        'task_ids': ['task-%d' % job['request_id']
+                     for job in ci.jobs_by_revision[ci.pushes[-5]['revision']]],
+        'max_revisions': len(revisions) - 1,
+        'builders_graph': {build: dict((test, None) for test in ci.test_builders
+                                       if ci.builders[test]['properties']['platform'] ==
+                                       ci.builders[build]['properties']['platform'])},
+    }
+
+
+def _run_in_subprocess(config, debug=False):
+    home = tempfile.mkdtemp(prefix='mozci-bench-')
+    env = dict(os.environ, HOME=home, PYTHONPATH=REPO_DIR,
+               TASKCLUSTER_CLIENT_ID='benchmark', TASKCLUSTER_ACCESS_TOKEN='token')
+    env.pop('MOZCI_DAEMON', None)
+    env.pop('MOZCI_METRICS', None)
+    cmd = [sys.executable, os.path.abspath(__file__), '--worker']
+    if debug:
+        cmd.append('--debug')
+    try:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        out, _ = proc.communicate(json.dumps(config))
+        if proc.returncode != 0:
+            raise RuntimeError("The %s workflow failed." % config['workflow'])
+        return json.loads(out.splitlines()[-1])
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=REPO_DIR).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _run_workflows(options, results, endpoints, scenario, services=None):
+    for workflow in options.workflows:
+        if options.replay and workflow in NOT_REPLAYABLE:
+            print "%-36s skipped; it can't be replayed" % workflow
+            continue
+
+        config = {'workflow': workflow, 'endpoints': endpoints, 'scenario': scenario}
+        if options.replay:
+            config['replay'] = os.path.join(options.replay, workflow)
+            config['replay_latency'] = options.latency
+        elif options.record:
+            config['record'] = os.path.join(options.record, workflow)
+
+        runs = []
+        for _ in range(options.repeat):
+            if services:
+                services.reset()
+            result = _run_in_subprocess(config, options.debug)
+            result['server_requests'] = services.calls() if services else {}
+            runs.append(result)
+
+        wall_times = sorted(r['wall_time'] for r in runs)
+        result = runs[-1]
+        result['wall_time'] = wall_times[len(wall_times) // 2]
+        result['wall_times'] = [r['wall_time'] for r in runs]
+        result['total_requests'] = sum((result['server_requests'] or
+                                        result['client_requests']).values())
+        results['workflows'][workflow] = result
+        print "%-36s %8.2fs %6d requests %8d KB" % (
+            workflow, result['wall_time'], result['total_requests'], result['peak_rss_kb'])
+
+
+def run(options):
+    results = {
+        'commit': _git_commit(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': sys.version.split()[0],
+        'workflows': {},
+    }
+
+    if options.replay:
+        # Every request is answered from the cassettes; no service is started
+        with open(os.path.join(options.replay, SESSION_FILE)) as fd:
+            session = json.load(fd)
+        results['config'] = dict(session['config'], replay=True, latency=options.latency)
+        _run_workflows(options, results, session['endpoints'], session['scenario'])
+        return results
+
+    latency = {}
+    for value in options.service_latency:
+        service, seconds = value.split('=')
+        latency[service] = float(seconds)
+
+    ci = FakeCI(pushes=options.pushes,
+                platforms=options.platforms,
+                tests_per_platform=options.tests_per_platform,
+                coverage=options.coverage)
+    results['config'] = {
+        'pushes': options.pushes,
+        'platforms': options.platforms,
+        'tests_per_platform': options.tests_per_platform,
+        'coverage': options.coverage,
+        'range': options.range,
+        'latency': options.latency,
+        'service_latency': latency,
+        'repeat': options.repeat,
+        'jobs': len(ci.jobs),
+    }
+
+    with FakeServices(ci, latency=latency, default_latency=options.latency) as services:
+        scenario = _scenario(ci, options)
+        if options.record:
+            if not os.path.exists(options.record):
+                os.makedirs(options.record)
+            with open(os.path.join(options.record, SESSION_FILE), 'w') as fd:
+                json.dump({'config': results['config'],
+                           'endpoints': services.endpoints(),
+                           'scenario': scenario}, fd, indent=2, sort_keys=True)
+        _run_workflows(options, results, services.endpoints(), scenario, services)
+
+    return results
+
+
+def compare(old, new, threshold):
+    """Print the differences between two result files; return the regressed workflows."""
+    regressions = []
+    print "%-36s %10s %10s %8s %10s %10s" % (
+        "workflow", "old (s)", "new (s)", "ratio", "old reqs", "new reqs")
+    for workflow, result in sorted(new['workflows'].items()):
+        previous = old['workflows'].get(workflow)
+        if previous is None:
+            continue
+        ratio = result['wall_time'] / max(previous['wall_time'], 0.0001)
+        print "%-36s %10.2f %10.2f %7.2fx %10d %10d" % (
+            workflow, previous['wall_time'], result['wall_time'], ratio,
+            previous['total_requests'], result['total_requests'])
+        if ratio > 1 + threshold or result['total_requests'] > previous['total_requests']:
+            regressions.append(workflow)
+
+    if old['config'] != new['config']:
+        print "NOTE: The results were obtained with different configurations."
+    return regressions
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--pushes", type=int, default=100,
+                        help="Number of pushes in the synthetic history.")
+    parser.add_argument("--platforms", type=int, default=4,
+                        help="Number of platforms (one build builder each).")
+    parser.add_argument("--tests-per-platform", type=int, default=10,
+                        help="Number of test builders per platform.")
+    parser.add_argument("--coverage", type=float, default=0.7,
+                        help="Fraction of (push, builder) pairs with a job.")
+    parser.add_argument("--range", type=int, default=10,
+                        help="Number of revisions used by trigger_range.")
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="Seconds every service waits before answering.")
+    parser.add_argument("--service-latency", action="append", default=[],
+                        metavar="SERVICE=SECONDS",
+                        help="Latency of a given service, e.g. self-serve=0.2")
+    parser.add_argument("--workflow", action="append", dest="workflows",
+                        choices=WORKFLOWS,
+                        help="Workflow to run (all of them by default).")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Number of times to run every workflow.")
+    parser.add_argument("--output",
+                        help="Where to store the results (benchmarks/results/<commit>.json).")
+    parser.add_argument("--compare", metavar="RESULTS",
+                        help="Compare with the results of a previous run.")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Slowdown ratio considered a regression by --compare.")
+    parser.add_argument("--record", metavar="DIR",
+                        help="Record the requests of every workflow in cassettes inside DIR.")
+    parser.add_argument("--replay", metavar="DIR",
+                        help="Replay a session recorded with --record without any service; "
+                             "--latency is added to every response ('recorded' is not "
+                             "supported through the command line).")
+    parser.add_argument("--worker", action="store_true", help=SUPPRESS)
+    parser.add_argument("--debug", action="store_true",
+                        help="Set debug for logging.")
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if options.debug else logging.WARNING,
+                        stream=sys.stderr)
+
+    if options.worker:
+        print json.dumps(worker(json.loads(sys.stdin.read())))
+        return
+
+    options.workflows = options.workflows or list(WORKFLOWS)
+    results = run(options)
+
+    output = options.output
+    if output is None:
+        if not os.path.exists(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+        output = os.path.join(RESULTS_DIR, '%s.json' % results['commit'])
+    with open(output, 'w') as fd:
+        json.dump(results, fd, indent=2, sort_keys=True)
+    print "The results have been stored in %s" % output
+
+    if options.compare:
+        with open(options.compare) as fd:
+            regressions = compare(json.load(fd), results, options.threshold)
+        if regressions:
+            print "Regressions: %s" % ', '.join(regressions)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
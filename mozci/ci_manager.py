@@ -9,13 +9,53 @@ Defined in here:
 """
 from __future__ import absolute_import
 
+import logging
+
 from abc import ABCMeta, abstractmethod
 
+from mozci.query_jobs import BuildApi, PENDING, RUNNING, invalidate_jobs, invalidate_request
 from mozci.sources import (
     buildapi,
     buildbot_bridge,
     tc
 )
+from mozci.utils.concurrency import RateLimiter, map_concurrently
+
+LOG = logging.getLogger('mozci')
+# cancel_all() makes at most this many requests per second (and at once)
+CANCEL_REQUESTS_PER_SECOND = 10
+CANCEL_MAX_WORKERS = 8
+
+
+def _cancel_jobs(cancel, jobs, requests_per_second, max_workers):
+    """
+    Call cancel(job) for every job concurrently and return a result per job.
+
+    jobs are dictionaries with the 'id', 'name' and 'state' of the jobs; cancel()
+    returns a true value once the job is cancelled (None on dry runs). The
+    results are copies of the jobs with:
+
+    * 'result': 'cancelled', 'failed' or 'dry-run'
+    * 'error': why we could not cancel the job (or None)
+    """
+    limiter = RateLimiter(requests_per_second)
+
+    def _cancel(job):
+        limiter.wait()
+        result = dict(job, result='cancelled', error=None)
+        try:
+            if cancel(job) is None:
+                result['result'] = 'dry-run'
+        except Exception, e:
+            result.update({'result': 'failed', 'error': '%s: %s' % (e.__class__.__name__, e)})
+            LOG.warning("We could not cancel %s (%s): %s" % (job['name'], job['id'],
+                                                             result['error']))
+        return result
+
+    results = map_concurrently(_cancel, jobs, max_workers=max_workers)
+    LOG.info("We have cancelled %d of %d job(s)." %
+             (len([r for r in results if r['result'] == 'cancelled']), len(results)))
+    return results
 
 
 class BaseCIManager:
@@ -53,24 +93,64 @@ class BuildAPIManager(BaseCIManager):
         pass
 
     def schedule_arbitrary_job(self, repo_name, revision, uuid, *args, **kwargs):
-        return buildapi.trigger_arbitrary_job(repo_name=repo_name,
-                                              builder=uuid,
-                                              revision=revision,
-                                              *args,
-                                              **kwargs)
+        req = buildapi.trigger_arbitrary_job(repo_name=repo_name,
+                                             builder=uuid,
+                                             revision=revision,
+                                             *args,
+                                             **kwargs)
+        invalidate_jobs(repo_name, revision)
+        return req
 
     def retrigger(self, uuid, *args, **kwargs):
-        return buildapi.make_retrigger_request(request_id=uuid, *args, **kwargs)
+        req = buildapi.make_retrigger_request(request_id=uuid, *args, **kwargs)
+        # repo_name is the first argument of make_retrigger_request
+        invalidate_request(kwargs['repo_name'] if 'repo_name' in kwargs else args[0], uuid)
+        return req
 
     def cancel(self, uuid, *args, **kwargs):
-        return buildapi.make_cancel_request(
+        req = buildapi.make_cancel_request(
             repo_name=kwargs['repo_name'],
             request_id=uuid,
             *args,
             **kwargs)
+        invalidate_request(kwargs['repo_name'], uuid)
+        return req
 
-    def cancel_all(self, repo_name, revision, *args, **kwargs):
-        pass
+    def cancel_all(self, repo_name, revision, dry_run=False,
+                   requests_per_second=CANCEL_REQUESTS_PER_SECOND,
+                   max_workers=CANCEL_MAX_WORKERS):
+        """ Cancel the pending and stop the running jobs of a revision.
+
+        The jobs are found in a single (fresh) query to self-serve and the
+        cancellations are made concurrently. See _cancel_jobs for the results.
+        """
+        query_api = BuildApi()
+        jobs = []
+        # We bypass JOBS_CACHE since we want the current state of the jobs
+        for job in buildapi.query_jobs_schedule(repo_name, revision):
+            state = query_api.peek_job_status(job)
+            if state == PENDING:
+                jobs.append({'id': query_api.get_buildapi_request_id(repo_name, job),
+                             'name': job['buildername'], 'state': 'pending'})
+            elif state == RUNNING:
+                jobs.append({'id': job['build_id'], 'name': job['buildername'],
+                             'state': 'running'})
+
+        LOG.info("We are going to cancel %d job(s) on %s." % (len(jobs), revision))
+
+        def _cancel(job):
+            if job['state'] == 'pending':
+                req = buildapi.make_cancel_request(repo_name, job['id'], dry_run=dry_run)
+            else:
+                req = buildapi.make_stop_build_request(repo_name, job['id'], dry_run=dry_run)
+            if req is not None:
+                req.raise_for_status()
+            return req
+
+        results = _cancel_jobs(_cancel, jobs, requests_per_second, max_workers)
+        if not dry_run:
+            invalidate_jobs(repo_name, revision)
+        return results
 
 # End of BuildAPIManager
 
@@ -89,11 +169,35 @@ class TaskclusterManager(BaseCIManager):
     def retrigger(self, uuid, *args, **kwargs):
         return tc.retrigger_task(task_id=uuid, *args, **kwargs)
 
+    def retrigger_many(self, uuids, *args, **kwargs):
+        return tc.retrigger_tasks(task_ids=uuids, *args, **kwargs)
+
     def cancel(self, uuid, *args, **kwargs):
-        pass
+        return tc.cancel_task(task_id=uuid, *args, **kwargs)
 
-    def cancel_all(self, repo_name, revision, *args, **kwargs):
-        pass
+    def cancel_all(self, repo_name, revision, task_group_id, dry_run=False,
+                   requests_per_second=CANCEL_REQUESTS_PER_SECOND,
+                   max_workers=CANCEL_MAX_WORKERS):
+        """ Cancel the tasks of a revision which have not finished yet.
+
+        TaskCluster can't find tasks by revision; the tasks of a push belong to the
+        task group (graph) scheduled for it. The tasks are listed once and the
+        cancellations are made concurrently. See _cancel_jobs for the results
+        (None if we don't have credentials to cancel tasks).
+        """
+        if not dry_run and not tc.credentials_available():
+            return None
+
+        jobs = [{'id': task['status']['taskId'],
+                 'name': task['task'].get('metadata', {}).get('name'),
+                 'state': task['status']['state']}
+                for task in tc.list_task_group(task_group_id)
+                if task['status']['state'] in tc.ACTIVE_STATES]
+
+        LOG.info("We are going to cancel %d task(s) of %s on %s %s." %
+                 (len(jobs), task_group_id, repo_name, revision))
+        return _cancel_jobs(lambda job: tc.cancel_task(job['id'], dry_run=dry_run),
+                            jobs, requests_per_second, max_workers)
 
 # End of TaskClusterManager
 
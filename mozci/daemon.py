@@ -0,0 +1,258 @@
+#! /usr/bin/env python
+"""
+This module allows running mozci as a long-running daemon.
+
+Every mozci script starts cold; it has to parse allthethings.json and
+repositories.txt and compute the builders' relations before it can answer
+anything. The daemon does that once and keeps the caches warm
+(allthethings data, platforms relations, JOBS_CACHE and BUILDS_CACHE).
+
+It answers queries made through a local HTTP API; it can either listen
+on a Unix socket or on a localhost TCP port. Every method is a POST request
+to /<method> with a json dictionary of keyword arguments as the body.
+The response is a json dictionary with a "result" key or an "error" key; errors
+also carry the name of the exception's class ("error_class") so the client can
+raise the same mozci.errors exception.
+
+Start it with::
+
+    $ mozci-daemon --socket ~/.mozilla/mozci/mozci.sock
+
+and point your tools to it with::
+
+    $ export MOZCI_DAEMON=unix:~/.mozilla/mozci/mozci.sock
+
+See mozci.daemon_client for the client side.
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import socket
+import traceback
+
+from argparse import ArgumentParser
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn, UnixStreamServer
+
+from mozci import mozci, platforms, query_jobs
+from mozci.query_jobs import BuildApi, TreeherderApi
+from mozci.sources import allthethings, buildapi
+from mozci.utils.log_util import setup_logging
+from mozci.utils.transfer import path_to_file
+
+LOG = logging.getLogger('mozci')
+DEFAULT_SOCKET = path_to_file('mozci.sock')
+QUERY_SOURCES = {}
+
+
+def _query_source(query_source):
+    if query_source not in QUERY_SOURCES:
+        QUERY_SOURCES[query_source] = \
+            TreeherderApi() if query_source == 'treeherder' else BuildApi()
+    return QUERY_SOURCES[query_source]
+
+
+def warm_up():
+    """Load allthethings.json, repositories.txt and the builders' relations."""
+    LOG.info("Warming up the caches.")
+    allthethings.fetch_allthethings_data()
+    buildapi.query_repositories()
+    platforms._process_data()
+    platforms.load_relations()
+    LOG.info("The caches are warm.")
+
+
+def reload_data():
+    """Drop the data coming from allthethings.json (e.g. after a reconfig) and load it again."""
+    allthethings.DATA = None
+    platforms.SHORTNAME_TO_NAME.clear()
+    platforms.BUILDERNAME_TO_TRIGGER.clear()
+    platforms.BUILD_JOBS.clear()
+    platforms.UPSTREAM_TO_DOWNSTREAM = None
+    buildapi.REPOSITORIES = {}
+    allthethings.fetch_allthethings_data(no_caching=True)
+    warm_up()
+
+
+#
+# Methods exposed by the daemon
+#
+def ping():
+    return "pong"
+
+
+def query_builders(repo_name=None):
+    return mozci.query_builders(repo_name)
+
+
+def valid_builder(buildername):
+    # The client writes builders.txt itself; we only save it from fetching every builder
+    return buildername in mozci.query_builders()
+
+
+def determine_upstream_builder(buildername):
+    return platforms.determine_upstream_builder(buildername)
+
+
+def get_downstream_jobs(upstream_job):
+    return platforms.get_downstream_jobs(upstream_job)
+
+
+def get_matching_jobs(repo_name, revision, buildername, query_source='buildapi', limit=None):
+    return _query_source(query_source).get_matching_jobs(repo_name, revision, buildername,
+                                                         limit=limit)
+
+
+def get_job_status(job, query_source='buildapi'):
+    return _query_source(query_source).get_job_status(job)
+
+
+def peek_job_status(job, query_source='buildapi'):
+    return _query_source(query_source).peek_job_status(job)
+
+
+def get_buildapi_request_id(repo_name, job, query_source='buildapi'):
+    return _query_source(query_source).get_buildapi_request_id(repo_name, job)
+
+
+def get_buildapi_request_ids(repo_name, jobs, query_source='buildapi'):
+    return _query_source(query_source).get_buildapi_request_ids(repo_name, jobs)
+
+
+def find_backfill_revlist(buildername, revision, max_revisions, max_probes=None,
+                          query_source='buildapi'):
+    return mozci.find_backfill_revlist(buildername, revision, max_revisions, max_probes,
+                                       query_api=_query_source(query_source))
+
+
+def invalidate_jobs(repo_name, revision):
+    query_jobs.invalidate_jobs(repo_name, revision)
+
+
+def invalidate_request(repo_name, request_id):
+    query_jobs.invalidate_request(repo_name, request_id)
+
+
+METHODS = dict((method.__name__, method) for method in (
+    ping,
+    reload_data,
+    query_builders,
+    valid_builder,
+    determine_upstream_builder,
+    get_downstream_jobs,
+    get_matching_jobs,
+    get_job_status,
+    peek_job_status,
+    get_buildapi_request_id,
+    get_buildapi_request_ids,
+    find_backfill_revlist,
+    invalidate_jobs,
+    invalidate_request,
+))
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """Dispatch POST /<method> requests to the methods in METHODS."""
+
+    def do_POST(self):
+        method = METHODS.get(self.path.strip('/'))
+        if method is None:
+            self._respond(404, {'error': 'Unknown method %s' % self.path})
+            return
+
+        try:
+            length = int(self.headers.getheader('content-length') or 0)
+            kwargs = json.loads(self.rfile.read(length) or '{}')
+            # json gives us unicode keys which can't be used as keyword arguments
+            kwargs = dict((str(key), value) for key, value in kwargs.iteritems())
+            result = method(**kwargs)
+        except Exception, e:
+            LOG.debug(traceback.format_exc())
+            self._respond(500, {'error': '%s: %s' % (e.__class__.__name__, str(e)),
+                                'error_class': e.__class__.__name__,
+                                'message': str(e)})
+            return
+
+        self._respond(200, {'result': result})
+
+    def _respond(self, status_code, content):
+        body = json.dumps(content)
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix sockets do not have a (host, port) client address
+        return str(self.client_address)
+
+    def log_message(self, format, *args):
+        LOG.debug("%s - %s" % (self.address_string(), format % args))
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadedUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        UnixStreamServer.server_bind(self)
+        # BaseHTTPRequestHandler expects these attributes from HTTPServer
+        self.server_name = socket.gethostname()
+        self.server_port = 0
+
+
+def create_server(socket_path=None, port=None):
+    """Return a server listening on a Unix socket (default) or on a localhost TCP port."""
+    if port is not None:
+        LOG.info("Listening on http://localhost:%d" % port)
+        return ThreadedHTTPServer(('localhost', port), DaemonRequestHandler)
+
+    socket_path = os.path.expanduser(socket_path or DEFAULT_SOCKET)
+    LOG.info("Listening on unix:%s" % socket_path)
+    return ThreadedUnixHTTPServer(socket_path, DaemonRequestHandler)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--socket",
+                        dest="socket_path",
+                        default=DEFAULT_SOCKET,
+                        help="Unix socket to listen on.")
+
+    parser.add_argument("--port",
+                        dest="port",
+                        type=int,
+                        help="Listen on this localhost TCP port instead of a Unix socket.")
+
+    parser.add_argument("--debug",
+                        action="store_true",
+                        dest="debug",
+                        help="set debug for logging.")
+
+    options = parser.parse_args()
+
+    if options.debug:
+        setup_logging(logging.DEBUG)
+    else:
+        setup_logging()
+
+    warm_up()
+    server = create_server(socket_path=options.socket_path, port=options.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        LOG.info("Shutting down.")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
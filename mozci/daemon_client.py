@@ -0,0 +1,142 @@
+#! /usr/bin/env python
+"""
+This module is the client side of mozci.daemon.
+
+The address of the daemon is taken from the MOZCI_DAEMON environment variable
+unless specified. It can either be a Unix socket (unix:/path/to/mozci.sock)
+or a localhost TCP port (localhost:8123).
+"""
+from __future__ import absolute_import
+
+import httplib
+import json
+import logging
+import os
+import socket
+
+from mozci import errors
+from mozci.errors import DaemonError
+from mozci.query_jobs import QueryApi
+
+LOG = logging.getLogger('mozci')
+DAEMON_ENV = 'MOZCI_DAEMON'
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """HTTPConnection which talks to a Unix socket."""
+
+    def __init__(self, socket_path, timeout=None):
+        httplib.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def _error(content):
+    """Return the mozci.errors exception the daemon raised or a DaemonError."""
+    cls = getattr(errors, str(content.get('error_class')), None)
+    if isinstance(cls, type) and issubclass(cls, Exception) and \
+            cls.__module__ == errors.__name__:
+        return cls(content['message'])
+    return DaemonError(content['error'])
+
+
+class DaemonClient(object):
+    """
+    Call the methods exposed by the daemon as if they were local functions.
+
+    e.g. DaemonClient().query_builders(repo_name='try')
+
+    Exceptions from mozci.errors raised by the daemon's methods (e.g. BuildjsonError)
+    are raised again by the client; any other failure raises DaemonError.
+    """
+
+    def __init__(self, address=None, timeout=600):
+        address = address or os.environ.get(DAEMON_ENV)
+        if not address:
+            raise DaemonError("No daemon address specified; set %s." % DAEMON_ENV)
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self):
+        if self.address.startswith('unix:'):
+            return UnixHTTPConnection(os.path.expanduser(self.address[len('unix:'):]),
+                                      timeout=self.timeout)
+        host, port = self.address.rsplit(':', 1)
+        return httplib.HTTPConnection(host, int(port), timeout=self.timeout)
+
+    def call(self, method, **kwargs):
+        body = json.dumps(kwargs)
+        conn = self._connection()
+        try:
+            conn.request('POST', '/%s' % method, body,
+                         {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            content = json.loads(response.read())
+        except (socket.error, httplib.HTTPException, ValueError), e:
+            raise DaemonError("We could not reach the daemon at %s: %s" % (self.address, e))
+        finally:
+            conn.close()
+
+        if 'error' in content:
+            raise _error(content)
+        return content['result']
+
+    def available(self):
+        """Return True if the daemon answers."""
+        try:
+            return self.call('ping') == 'pong'
+        except DaemonError, e:
+            LOG.debug(str(e))
+            return False
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        def _call(**kwargs):
+            return self.call(method, **kwargs)
+        return _call
+
+
+class DaemonQueryApi(QueryApi):
+    """A QueryApi which answers through the daemon's warm caches."""
+
+    def __init__(self, client, query_source='buildapi'):
+        self.client = client
+        self.query_source = query_source
+
+    def get_matching_jobs(self, repo_name, revision, buildername, limit=None):
+        return self.client.get_matching_jobs(repo_name=repo_name,
+                                             revision=revision,
+                                             buildername=buildername,
+                                             query_source=self.query_source,
+                                             limit=limit)
+
+    def get_buildapi_request_id(self, repo_name, job):
+        return self.client.get_buildapi_request_id(repo_name=repo_name,
+                                                   job=job,
+                                                   query_source=self.query_source)
+
+    def get_buildapi_request_ids(self, repo_name, jobs):
+        return self.client.get_buildapi_request_ids(repo_name=repo_name,
+                                                    jobs=jobs,
+                                                    query_source=self.query_source)
+
+    def get_job_status(self, job):
+        return self.client.get_job_status(job=job, query_source=self.query_source)
+
+    def peek_job_status(self, job):
+        return self.client.peek_job_status(job=job, query_source=self.query_source)
+
+    def find_backfill_revlist(self, buildername, revision, max_revisions, max_probes=None):
+        """ See mozci.mozci.find_backfill_revlist; it runs inside the daemon. """
+        return self.client.find_backfill_revlist(buildername=buildername,
+                                                 revision=revision,
+                                                 max_revisions=max_revisions,
+                                                 max_probes=max_probes,
+                                                 query_source=self.query_source)
@@ -28,3 +28,11 @@ class TreeherderError(Exception):
 
 class PushlogError(Exception):
     pass
+
+
+class DaemonError(Exception):
+    pass
+
+
+class CassetteError(Exception):
+    pass
@@ -0,0 +1,220 @@
+"""
+This module monitors build jobs we have triggered (or found running) and
+triggers the test jobs which were waiting on them once their files are available.
+
+Without it, triggering a test job on a revision without a build means
+triggering the build and running the script again once the build is done.
+
+The monitor keeps track of outstanding build jobs grouped by revision:
+
+* It only polls revisions with build jobs which have not finished
+* It fetches the scheduling data once per revision for all the builds of that revision
+* The polling interval of a revision doubles (up to max_interval) every time
+  nothing has changed (or the poll failed) and goes back to min_interval when
+  something changes
+
+The clock, sleep and job fetching functions can be replaced for testing.
+"""
+from __future__ import absolute_import
+
+import heapq
+import logging
+import time
+
+from mozci.errors import BuildjsonError
+from mozci.mozci import _all_urls_reachable, _find_files, trigger_job
+from mozci.query_jobs import (
+    BuildApi,
+    PENDING,
+    RUNNING,
+    UNKNOWN,
+    COALESCED,
+)
+from mozci.sources import buildapi
+
+LOG = logging.getLogger('mozci')
+MIN_INTERVAL = 60
+MAX_INTERVAL = 10 * 60
+# We stop waiting for a build job after this many seconds
+MAX_WAIT = 8 * 60 * 60
+
+
+class _RevisionWatch(object):
+    """Outstanding build jobs (and the test jobs waiting on them) for a revision."""
+
+    def __init__(self, repo_name, revision, interval, next_poll, deadline):
+        self.repo_name = repo_name
+        self.revision = revision
+        # build buildername -> {test buildername: (times, extra_properties)}
+        self.builds = {}
+        self.last_state = None
+        self.interval = interval
+        self.next_poll = next_poll
+        self.deadline = deadline
+
+
+class BuildMonitor(object):
+    """
+    Keep track of outstanding build jobs and trigger downstream jobs once they finish.
+
+    Usage::
+
+        monitor = BuildMonitor()
+        trigger_range(..., monitor=monitor)
+        monitor.run()
+    """
+
+    def __init__(self, dry_run=False, extra_properties=None,
+                 min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, max_wait=MAX_WAIT,
+                 clock=time.time, sleep=time.sleep, fetch_jobs=None, trigger=None):
+        self.dry_run = dry_run
+        self.extra_properties = extra_properties
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_wait = max_wait
+        self.clock = clock
+        self.sleep = sleep
+        # We bypass JOBS_CACHE since we want fresh scheduling data
+        self.fetch_jobs = fetch_jobs or buildapi.query_jobs_schedule
+        self.trigger = trigger or trigger_job
+        self.query_api = BuildApi()
+        self.watches = {}
+        self._queue = []
+        # Number of scheduling queries we've made
+        self.polls = 0
+
+    def add(self, repo_name, revision, build_buildername, buildername, times=1,
+            extra_properties=None):
+        """
+        Trigger buildername `times` times on revision once build_buildername has finished.
+
+        extra_properties defaults to the extra_properties of the monitor.
+        """
+        key = (repo_name, revision)
+        watch = self.watches.get(key)
+        if watch is None:
+            now = self.clock()
+            watch = _RevisionWatch(repo_name, revision,
+                                   interval=self.min_interval,
+                                   next_poll=now + self.min_interval,
+                                   deadline=now + self.max_wait)
+            self.watches[key] = watch
+            heapq.heappush(self._queue, (watch.next_poll, key))
+
+        downstream = watch.builds.setdefault(build_buildername, {})
+        if extra_properties is None:
+            extra_properties = self.extra_properties
+        previous_times = downstream.get(buildername, (0, None))[0]
+        downstream[buildername] = (max(times, previous_times), extra_properties)
+        LOG.info("We will trigger '%s' once '%s' finishes on %s." %
+                 (buildername, build_buildername, revision))
+
+    def outstanding(self):
+        """Return the number of test jobs waiting on a build job."""
+        return sum(len(downstream) for watch in self.watches.itervalues()
+                   for downstream in watch.builds.itervalues())
+
+    def _build_state(self, jobs):
+        """
+        Return (files, state) for the jobs of a build builder.
+
+        files is a list of files if a job has produced them. state is
+        'waiting' if jobs are pending/running or not visible yet, 'done' otherwise.
+        """
+        waiting = not jobs
+        for job in jobs:
+            try:
+                status = self.query_api.get_job_status(job)
+            except BuildjsonError:
+                # Bug 1159279 - the job is not in buildjson yet
+                waiting = True
+                continue
+
+            if status in (PENDING, RUNNING, UNKNOWN):
+                waiting = True
+                continue
+
+            if status == COALESCED:
+                continue
+
+            files = _find_files(job)
+            if files and _all_urls_reachable(files):
+                return files, 'done'
+
+        return None, 'waiting' if waiting else 'done'
+
+    def _poll_revision(self, watch):
+        self.polls += 1
+        all_jobs = self.fetch_jobs(watch.repo_name, watch.revision)
+        state = []
+        for build_buildername in sorted(watch.builds.keys()):
+            jobs = [j for j in all_jobs if j["buildername"] == build_buildername]
+            state.append((build_buildername, sorted(j.get("status") for j in jobs)))
+            files, build_state = self._build_state(jobs)
+
+            if files:
+                downstream = watch.builds[build_buildername]
+                for buildername, (times, extra_properties) in sorted(downstream.items()):
+                    LOG.info("'%s' has finished on %s; we will trigger '%s'." %
+                             (build_buildername, watch.revision, buildername))
+                    self.trigger(revision=watch.revision,
+                                 buildername=buildername,
+                                 times=times,
+                                 files=files,
+                                 dry_run=self.dry_run,
+                                 extra_properties=extra_properties)
+                    # If a later trigger fails, the next poll does not trigger this one again
+                    del downstream[buildername]
+                del watch.builds[build_buildername]
+
+            elif build_state == 'done' and jobs:
+                LOG.warning("'%s' finished on %s without producing the files needed "
+                            "to trigger %s." % (build_buildername, watch.revision,
+                                                sorted(watch.builds[build_buildername])))
+                del watch.builds[build_buildername]
+
+        # Back off while nothing changes
+        if state == watch.last_state:
+            watch.interval = min(watch.interval * 2, self.max_interval)
+        else:
+            watch.interval = self.min_interval
+        watch.last_state = state
+
+    def poll(self):
+        """Poll every revision which is due; return the time of the next poll or None."""
+        now = self.clock()
+        while self._queue and self._queue[0][0] <= now:
+            _, key = heapq.heappop(self._queue)
+            watch = self.watches[key]
+            try:
+                self._poll_revision(watch)
+            except Exception, e:
+                # A transient error should not stop the monitoring; we try again later
+                LOG.warning("We could not poll %s: %s" % (watch.revision, e))
+                watch.interval = min(watch.interval * 2, self.max_interval)
+
+            if watch.builds and self.clock() >= watch.deadline:
+                LOG.warning("We gave up waiting for %s on %s." %
+                            (sorted(watch.builds), watch.revision))
+                watch.builds.clear()
+
+            if not watch.builds:
+                del self.watches[key]
+                continue
+
+            watch.next_poll = now + watch.interval
+            heapq.heappush(self._queue, (watch.next_poll, key))
+
+        if self._queue:
+            return self._queue[0][0]
+        return None
+
+    def run(self):
+        """Poll until there are no outstanding build jobs."""
+        LOG.info("We are monitoring %d build job(s) on %d revision(s)." %
+                 (sum(len(w.builds) for w in self.watches.itervalues()), len(self.watches)))
+        while True:
+            next_poll = self.poll()
+            if next_poll is None:
+                break
+            self.sleep(max(0, next_poll - self.clock()))
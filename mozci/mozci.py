@@ -13,7 +13,10 @@ interactions with distinct modules to meet your needs.
 from __future__ import absolute_import
 
 import logging
+import os
 
+from mozci.daemon_client import DAEMON_ENV, DaemonClient, DaemonQueryApi
+from mozci import query_jobs
 from mozci.errors import MozciError
 from mozci.platforms import (
     build_talos_buildernames_for_repo,
@@ -33,10 +36,13 @@ from mozci.query_jobs import (
     EXCEPTION,
     RETRY,
     BuildApi,
-    TreeherderApi
+    TreeherderApi,
+    invalidate_jobs
 )
+from mozci.utils.concurrency import RateLimiter, map_concurrently
 from mozci.utils.misc import _all_urls_reachable
-from mozci.utils.transfer import path_to_file, clean_directory
+from mozci.utils import cache_manager, instrumentation, scheduling_ledger
+from mozci.utils.transfer import path_to_file
 
 LOG = logging.getLogger('mozci')
 SCHEDULING_MANAGER = {}
@@ -47,6 +53,17 @@ QUERY_SOURCE = BuildApi()
 # Set this value to False in your tool to prevent any sort of validation
 VALIDATE = True
 
+# Set through use_daemon() to answer queries through a mozci daemon
+DAEMON = None
+
+# Maximum number of revisions we probe concurrently when looking for the last good job
+BACKFILL_MAX_PROBES = 8
+# Number of requests per second (and concurrent requests) execute_plan() makes to self-serve
+PLAN_REQUESTS_PER_SECOND = 5
+PLAN_MAX_WORKERS = 4
+# Types of the actions of a trigger plan (see make_plan())
+RETRIGGER, TRIGGER, TRIGGER_BUILD = 'retrigger', 'trigger', 'trigger_build'
+
 
 def disable_validations():
     global VALIDATE
@@ -59,6 +76,10 @@ def disable_validations():
 def set_query_source(query_source="buildapi"):
     """ Function to set the global QUERY_SOURCE """
     global QUERY_SOURCE
+    if DAEMON:
+        QUERY_SOURCE = DaemonQueryApi(DAEMON, query_source)
+        return
+
     if query_source == "treeherder":
         source_class = TreeherderApi
     else:
@@ -66,10 +87,40 @@ def set_query_source(query_source="buildapi"):
     QUERY_SOURCE = source_class()
 
 
+def use_daemon(address=None):
+    """
+    Answer queries through a mozci daemon (see mozci.daemon) with warm caches.
+
+    The address defaults to the MOZCI_DAEMON environment variable. If no address
+    is set or the daemon does not answer we keep on working without it.
+
+    Returns True if the daemon is going to be used.
+    """
+    global DAEMON, QUERY_SOURCE
+    if not address and not os.environ.get(DAEMON_ENV):
+        return False
+
+    client = DaemonClient(address)
+    if not client.available():
+        LOG.warning("The mozci daemon at %s is not available; we will not use it." %
+                    client.address)
+        return False
+
+    LOG.debug("We will answer queries through the mozci daemon at %s." % client.address)
+    DAEMON = client
+    # The jobs we trigger have to be forgotten by the daemon's caches too
+    query_jobs.DAEMON = client
+    if isinstance(QUERY_SOURCE, TreeherderApi):
+        set_query_source("treeherder")
+    else:
+        set_query_source("buildapi")
+    return True
+
+
 def _unique_build_request(buildername, revision):
     """
     We want to prevent requesting a build job too many times
-    in the same session.
+    in the same session or by other mozci processes (see mozci.utils.scheduling_ledger).
     """
     global SCHEDULING_MANAGER
     sch_mgr = SCHEDULING_MANAGER
@@ -82,6 +133,12 @@ def _unique_build_request(buildername, revision):
                       "revision %s during this session. We don't allow "
                       "multiple requests." % (buildername, revision))
             return False
+        repo_name = query_repo_name_from_buildername(buildername)
+        if scheduling_ledger.is_claimed(repo_name, revision, buildername):
+            LOG.debug("Another process has recently scheduled the build '%s' for "
+                      "revision %s. We don't allow multiple requests." %
+                      (buildername, revision))
+            return False
         return True
 
 
@@ -110,31 +167,65 @@ def _status_summary(jobs):
     return (successful, pending, running, coalesced, failed)
 
 
-def _determine_trigger_objective(revision, buildername, trigger_build_if_missing=True):
-    """
-    Determine if we need to trigger any jobs and which job.
+# Jobs which are (or will be) useful to us; this matches the sum of _status_summary's values
+# except coalesced jobs
+POTENTIAL_STATUSES = (PENDING, RUNNING, UNKNOWN, SUCCESS, FAILURE, WARNING, EXCEPTION, RETRY)
 
-    Returns:
 
-    * The name of the builder we need to trigger
-    * Files, if needed, to trigger such builder
-    """
-    builder_to_trigger = None
-    files = None
-    repo_name = query_repo_name_from_buildername(buildername)
-
-    build_buildername = determine_upstream_builder(buildername)
+def _count_jobs(jobs, statuses, needed=None, query_api=None):
+    """Return the number of jobs whose status is in statuses.
 
-    if VALIDATE and not valid_builder(build_buildername):
-        raise MozciError("Our platforms mapping system has failed.")
+    The statuses which can be read straight from the scheduling data are counted
+    first; the others (e.g. successful vs coalesced jobs in buildapi, which needs
+    buildjson) are only resolved while we have less than needed matching jobs.
+    If needed is passed the result is min(needed, number of matching jobs).
+    query_api defaults to QUERY_SOURCE.
+    """
+    query_api = query_api or QUERY_SOURCE
+    count = 0
+    deferred = []
+    for job in jobs:
+        if needed is not None and count >= needed:
+            return count
+        status = query_api.peek_job_status(job)
+        if status is None:
+            deferred.append(job)
+        elif status in statuses:
+            count += 1
+
+    for index, job in enumerate(deferred):
+        if needed is not None and count >= needed:
+            LOG.debug("We did not need the status of %d job(s)." % (len(deferred) - index))
+            instrumentation.record_event('job_status.deferred', 'skipped')
+            return count
+        instrumentation.record_event('job_status.deferred', 'resolved')
+        if query_api.get_job_status(job) in statuses:
+            count += 1
+
+    return count
+
+
+def _upstream_builder(buildername):
+    """Return the build job which buildername depends on (buildername itself for builds)."""
+    if DAEMON:
+        return DAEMON.determine_upstream_builder(buildername=buildername)
+    return determine_upstream_builder(buildername)
+
+
+def _find_build_jobs(repo_name, revision, build_buildername):
+    """
+    Look at the jobs of build_buildername on revision.
 
-    if build_buildername == buildername:
-        # For a build job we know that we don't need files to
-        # trigger it and it's the build job we want to trigger
-        return build_buildername, None
+    Returns a tuple with:
 
+    * A finished build job whose files we can reach (or None)
+    * A pending or running build job (or None)
+    * A finished build job without usable files (or None)
+    * The files of the working build job, if any
+    """
+    files = None
     # Let's figure out which jobs are associated to such revision
-    query_api = BuildApi()
+    query_api = DaemonQueryApi(DAEMON) if DAEMON else BuildApi()
     # Let's only look at jobs that match such build_buildername
     build_jobs = query_api.get_matching_jobs(repo_name, revision, build_buildername)
 
@@ -181,6 +272,44 @@ def _determine_trigger_objective(revision, buildername, trigger_build_if_missing
         failed_job = job
     # End of for loop
 
+    return working_job, running_job, failed_job, files
+
+
+def _determine_trigger_objective(revision, buildername, trigger_build_if_missing=True,
+                                 builds=None):
+    """
+    Determine if we need to trigger any jobs and which job.
+
+    If builds (a dictionary) is passed, what we find about the build jobs of a
+    revision is kept in it; calls sharing it look at each build job once.
+
+    Returns:
+
+    * The name of the builder we need to trigger
+    * Files, if needed, to trigger such builder
+    """
+    builder_to_trigger = None
+    repo_name = query_repo_name_from_buildername(buildername)
+    build_buildername = _upstream_builder(buildername)
+
+    if VALIDATE and not valid_builder(build_buildername):
+        raise MozciError("Our platforms mapping system has failed.")
+
+    if build_buildername == buildername:
+        # For a build job we know that we don't need files to
+        # trigger it and it's the build job we want to trigger
+        return build_buildername, None
+
+    key = (repo_name, revision, build_buildername)
+    if builds is not None and key in builds:
+        LOG.debug("We already know the state of '%s' on %s." % (build_buildername, revision))
+        working_job, running_job, failed_job, files = builds[key]
+    else:
+        working_job, running_job, failed_job, files = \
+            _find_build_jobs(repo_name, revision, build_buildername)
+        if builds is not None:
+            builds[key] = (working_job, running_job, failed_job, files)
+
     if working_job:
         # We found a build job with the necessary files. It could be a
         # successful job, a running job that already emitted files or a
@@ -278,6 +407,8 @@ def _find_files(job_schedule_info):
 #
 def query_builders(repo_name=None):
     """Return list of all builders or the builders associated to a repo."""
+    if DAEMON:
+        return DAEMON.query_builders(repo_name=repo_name)
     return list_builders(repo_name)
 
 
@@ -327,6 +458,10 @@ def query_revisions_range(repo_name, from_revision, to_revision):
 #
 def valid_builder(buildername):
     """Determine if the builder you're trying to trigger is valid."""
+    if DAEMON and DAEMON.valid_builder(buildername=buildername):
+        LOG.debug("Buildername %s is valid." % buildername)
+        return True
+
     builders = query_builders()
     if buildername in builders:
         LOG.debug("Buildername %s is valid." % buildername)
@@ -346,9 +481,15 @@ def valid_builder(buildername):
 # Trigger functionality
 #
 def trigger_job(revision, buildername, times=1, files=None, dry_run=False,
-                extra_properties=None, trigger_build_if_missing=True):
+                extra_properties=None, trigger_build_if_missing=True, monitor=None,
+                builds=None):
     """Trigger a job through self-serve.
 
+    If a monitor (see mozci.monitor) is passed and we need to wait for a build job,
+    the monitor will trigger the job once the build job is done.
+
+    See _determine_trigger_objective for the meaning of builds.
+
     We return a list of all requests made.
     """
     repo_name = query_repo_name_from_buildername(buildername)
@@ -372,12 +513,28 @@ def trigger_job(revision, buildername, times=1, files=None, dry_run=False,
         builder_to_trigger = buildername
         _all_urls_reachable(files)
     else:
+        # We need to know if there is a running build job to monitor
+        builds = {} if builds is None else builds
         builder_to_trigger, files = _determine_trigger_objective(
             revision=revision,
             buildername=buildername,
-            trigger_build_if_missing=trigger_build_if_missing
+            trigger_build_if_missing=trigger_build_if_missing,
+            builds=builds
         )
 
+        build_buildername = _upstream_builder(buildername)
+        running_job = builds.get((repo_name, revision, build_buildername), (None,) * 4)[1]
+        if monitor is not None and not dry_run and build_buildername != buildername and \
+                (builder_to_trigger == build_buildername or
+                 (builder_to_trigger is None and running_job is not None)):
+            # The build job we trigger (or found running) will be monitored
+            monitor.add(repo_name=repo_name,
+                        revision=revision,
+                        build_buildername=build_buildername,
+                        buildername=buildername,
+                        times=times,
+                        extra_properties=extra_properties)
+
         if builder_to_trigger != buildername and times != 1:
             # The user wants to trigger a downstream job,
             # however, we need a build job instead.
@@ -409,21 +566,27 @@ def trigger_job(revision, buildername, times=1, files=None, dry_run=False,
     else:
         LOG.debug("Nothing needs to be triggered")
 
-    # Cleanup old buildjson files.
-    clean_directory()
+    # Evict the least recently used cached files if we are over budget; this
+    # happens in the background and at most every few minutes.
+    cache_manager.maybe_evict()
 
     return list_of_requests
 
 
-def trigger_range(buildername, revisions, times=1, dry_run=False,
-                  files=None, extra_properties=None, trigger_build_if_missing=True):
-    """Schedule the job named "buildername" ("times" times) in every revision on 'revisions'."""
+def trigger_range(buildername, revisions, times=1, dry_run=False, files=None,
+                  extra_properties=None, trigger_build_if_missing=True, monitor=None,
+                  builds=None):
+    """Schedule the job named "buildername" ("times" times) in every revision on 'revisions'.
+
+    See trigger_job for the meaning of monitor and builds.
+    """
     repo_name = query_repo_name_from_buildername(buildername)
     repo_url = buildapi.query_repo_url(repo_name)
 
     if revisions != []:
         LOG.info("We want to have %s job(s) of %s on revisions %s" %
                  (times, buildername, str(revisions)))
+        QUERY_SOURCE.prefetch_jobs(repo_name, revisions)
 
     for rev in revisions:
         LOG.info("")
@@ -437,13 +600,10 @@ def trigger_range(buildername, revisions, times=1, dry_run=False,
 
         # 1) How many potentially completed jobs can we get for this buildername?
         matching_jobs = QUERY_SOURCE.get_matching_jobs(repo_name, rev, buildername)
-        successful_jobs, pending_jobs, running_jobs, _, failed_jobs = \
-            _status_summary(matching_jobs)
-
-        potential_jobs = pending_jobs + running_jobs + successful_jobs + failed_jobs
-        # TODO: change this debug message when we have a less hardcoded _status_summary
-        LOG.debug("We found %d pending/running jobs, %d successful jobs and "
-                  "%d failed jobs" % (pending_jobs + running_jobs, successful_jobs, failed_jobs))
+        # We stop looking at the jobs' statuses once we know we have enough of them
+        potential_jobs = _count_jobs(matching_jobs, POTENTIAL_STATUSES, needed=times)
+        LOG.debug("We found %d pending, running, successful or failed job(s) out of %d." %
+                  (potential_jobs, len(matching_jobs)))
 
         if potential_jobs >= times:
             LOG.info("We have %d job(s) for '%s' which is enough for the %d job(s) we want." %
@@ -465,6 +625,8 @@ def trigger_range(buildername, revisions, times=1, dry_run=False,
                     request_id,
                     count=(times - potential_jobs),
                     dry_run=dry_run)
+                if not dry_run:
+                    invalidate_jobs(repo_name, rev)
 
             # If no matching job exists, we have to trigger a new arbitrary job
             else:
@@ -475,55 +637,298 @@ def trigger_range(buildername, revisions, times=1, dry_run=False,
                     dry_run=dry_run,
                     files=files,
                     extra_properties=extra_properties,
-                    trigger_build_if_missing=trigger_build_if_missing)
+                    trigger_build_if_missing=trigger_build_if_missing,
+                    monitor=monitor,
+                    builds=builds)
 
                 if list_of_requests and any(req.status_code != 202 for req in list_of_requests):
                     LOG.warning("Not all requests succeeded.")
 
-        # TODO:
         # 3) Once we trigger a build job, we have to monitor it to make sure that it finishes;
-        #    at that point we have to trigger as many test jobs as we originally intended
-        #    If a build job does not finish, we have to notify the user... what should it then
-        #    happen?
+        #    at that point we have to trigger as many test jobs as we originally intended.
+        #    This is done by the monitor (if any) passed to trigger_job; see mozci.monitor.
 
 
 def trigger(builder, revision, files=[], dry_run=False, extra_properties=None):
     """Helper to trigger a job.
 
-    Returns a request.
+    Build jobs are recorded in the scheduling ledger first; if another mozci
+    process has just requested the same build job we don't request it again.
+
+    Returns a request (or None if nothing was requested).
     """
     global SCHEDULING_MANAGER
     sch_mgr = SCHEDULING_MANAGER
+    repo_name = query_repo_name_from_buildername(builder)
 
-    if revision not in sch_mgr:
-        sch_mgr[revision] = []
+    build_job = not dry_run and not is_downstream(builder)
+    if build_job and not scheduling_ledger.claim(repo_name, revision, builder):
+        return None
 
-    sch_mgr[revision].append(builder)
+    # setdefault() keeps this safe when execute_plan() triggers from many threads
+    sch_mgr.setdefault(revision, []).append(builder)
 
-    repo_name = query_repo_name_from_buildername(builder)
-    return buildapi.trigger_arbitrary_job(repo_name, builder, revision, files, dry_run,
-                                          extra_properties)
+    req = None
+    try:
+        req = buildapi.trigger_arbitrary_job(repo_name, builder, revision, files, dry_run,
+                                             extra_properties)
+        if not dry_run:
+            invalidate_jobs(repo_name, revision)
+        return req
+    finally:
+        if build_job and (req is None or req.status_code != 202):
+            # Let other processes try again
+            scheduling_ledger.release(repo_name, revision, builder)
+
+
+#
+# Plan and execute
+#
+def _plan_job(buildername, revision, times, files):
+    """Return the actions needed to have `times` jobs of buildername on revision.
+
+    This is what trigger_range() and trigger_job() do without making any request.
+    An action without a type has to be triggered; make_plan() decides which job
+    to trigger once it knows about the build jobs (see _plan_trigger).
+    """
+    repo_name = query_repo_name_from_buildername(buildername)
+    if VALIDATE and not pushlog.valid_revision(buildapi.query_repo_url(repo_name), revision):
+        LOG.info("We can't trigger anything on pushes without a valid revision.")
+        return []
+
+    matching_jobs = QUERY_SOURCE.get_matching_jobs(repo_name, revision, buildername)
+    potential_jobs = _count_jobs(matching_jobs, POTENTIAL_STATUSES, needed=times)
+    if potential_jobs >= times:
+        LOG.debug("We have %d job(s) of '%s' on %s." % (potential_jobs, buildername, revision))
+        return []
+
+    action = {'repo_name': repo_name, 'revision': revision, 'buildername': buildername,
+              'count': times - potential_jobs}
+    if matching_jobs and files is None:
+        # The request_id of the job is resolved in bulk by make_plan()
+        action.update({'type': RETRIGGER, 'job': matching_jobs[0]})
+    return [action]
+
+
+def _plan_trigger(action, files, extra_properties, trigger_build_if_missing, builds):
+    """Return the actions needed to trigger (rather than retrigger) the job of an action."""
+    buildername, revision = action['buildername'], action['revision']
+    if files:
+        builder_to_trigger = buildername
+    else:
+        builder_to_trigger, files = _determine_trigger_objective(
+            revision, buildername, trigger_build_if_missing, builds=builds)
+
+    if builder_to_trigger is None:
+        return []
+
+    action.update({'files': files, 'properties': extra_properties})
+    if builder_to_trigger == buildername:
+        action['type'] = TRIGGER
+    else:
+        # The build job is triggered once; buildername has to be triggered once it is done
+        action.update({'type': TRIGGER_BUILD, 'buildername': builder_to_trigger,
+                       'count': 1, 'waiting': [buildername]})
+    return [action]
+
+
+def _find_builds(actions):
+    """Look at the build jobs which the jobs to trigger of actions depend on.
+
+    Every build job is looked at once; returns the dictionary to pass as
+    `builds` to _determine_trigger_objective().
+    """
+    keys = set()
+    for action in actions:
+        build_buildername = _upstream_builder(action['buildername'])
+        if build_buildername != action['buildername']:
+            keys.add((action['repo_name'], action['revision'], build_buildername))
+
+    def _find(key):
+        return _find_build_jobs(*key)
+
+    keys = sorted(keys)
+    return dict(zip(keys, map_concurrently(_find, keys)))
+
+
+def _merge_actions(actions):
+    """Deduplicate the actions of a plan.
+
+    Actions on the same builder and revision keep the highest count and a build
+    job needed by many test jobs is only requested once.
+    """
+    merged = {}
+    for action in actions:
+        key = (action['repo_name'], action['revision'], action['buildername'])
+        known = merged.get(key)
+        if known is None:
+            merged[key] = action
+            continue
+
+        waiting = sorted(set(known.get('waiting', []) + action.get('waiting', [])))
+        if known['type'] == TRIGGER_BUILD and action['type'] != TRIGGER_BUILD:
+            known, action = action, known
+        known['count'] = max(known['count'], action['count'])
+        if waiting:
+            known['waiting'] = waiting
+        merged[key] = known
+
+    return sorted(merged.values(),
+                  key=lambda a: (a['repo_name'], a['revision'], a['buildername']))
+
+
+def make_plan(goals, files=None, extra_properties=None, trigger_build_if_missing=True):
+    """Decide which requests we need to reach goals without making any of them.
+
+    goals is a list of (buildername, revisions, times) tuples; we want `times`
+    jobs of buildername on each revision.
+
+    Returns a list of actions (dictionaries which can be serialized with json):
+
+    * retrigger: retrigger the existing job 'request_id' 'count' times
+    * trigger: trigger 'buildername' 'count' times with 'files'
+    * trigger_build: trigger the build job 'buildername' once; the test jobs
+      'waiting' for it can be triggered once it is done
+
+    The jobs of the revisions are fetched in bulk when the query source allows it
+    and the revisions are looked at concurrently. Run the plan with execute_plan().
+    """
+    pairs = []
+    for buildername, revisions, times in goals:
+        if VALIDATE and not valid_builder(buildername):
+            raise MozciError("The builder %s requested is invalid" % buildername)
+        QUERY_SOURCE.prefetch_jobs(query_repo_name_from_buildername(buildername), revisions)
+        pairs.extend((buildername, revision, times) for revision in revisions)
+
+    if files and not _all_urls_reachable(files):
+        raise MozciError("Some of the files to trigger with are not reachable: %s" % files)
+
+    def _plan(pair):
+        buildername, revision, times = pair
+        return _plan_job(buildername, revision, times, files)
+
+    actions = [action for result in map_concurrently(_plan, pairs) for action in result]
+
+    retriggers = [action for action in actions if action.get('type') == RETRIGGER]
+    for repo_name in set(action['repo_name'] for action in retriggers):
+        repo_retriggers = [action for action in retriggers if action['repo_name'] == repo_name]
+        request_ids = QUERY_SOURCE.get_buildapi_request_ids(
+            repo_name, [action['job'] for action in repo_retriggers])
+        for action, request_id in zip(repo_retriggers, request_ids):
+            del action['job']
+            action['request_id'] = request_id
+
+    for action in retriggers:
+        if action['request_id'] is None:
+            # e.g. a job without a buildapi artifact on Treeherder; we can't retrigger it
+            LOG.debug("We can't retrigger '%s' on %s; we will trigger it instead." %
+                      (action['buildername'], action['revision']))
+            del action['type']
+            del action['request_id']
+
+    triggers = [action for action in actions if 'type' not in action]
+    actions = [action for action in actions if 'type' in action]
+
+    # What we learn about build jobs is shared by all the test jobs depending on them;
+    # we look at each of them once before the threads below read it
+    builds = {} if files else _find_builds(triggers)
+
+    def _trigger(action):
+        return _plan_trigger(action, files, extra_properties, trigger_build_if_missing, builds)
+
+    actions.extend(action for result in map_concurrently(_trigger, triggers) for action in result)
+
+    plan = _merge_actions(actions)
+    LOG.info("Our plan has %d action(s) for %d builder(s) on %d revision(s)." %
+             (len(plan), len(set(p[0] for p in pairs)), len(set(p[1] for p in pairs))))
+    return plan
+
+
+def describe_plan(plan):
+    """Return a line of text per action of a plan."""
+    lines = []
+    for action in plan:
+        if action['type'] == RETRIGGER:
+            line = "Retrigger '%s' (request %s) %d time(s) on %s" % (
+                action['buildername'], action['request_id'], action['count'],
+                action['revision'])
+        elif action['type'] == TRIGGER:
+            line = "Trigger '%s' %d time(s) on %s" % (
+                action['buildername'], action['count'], action['revision'])
+        else:
+            line = "Trigger the build '%s' on %s for %s" % (
+                action['buildername'], action['revision'], ', '.join(action['waiting']))
+        lines.append(line)
+    return lines
+
+
+def execute_plan(plan, dry_run=False, requests_per_second=PLAN_REQUESTS_PER_SECOND,
+                 max_workers=PLAN_MAX_WORKERS):
+    """Make the requests of a plan made by make_plan().
+
+    The requests are made concurrently (max_workers at a time) and at most
+    requests_per_second are started every second.
+
+    Returns a list of all requests made.
+    """
+    limiter = RateLimiter(requests_per_second)
+    # Retriggers pass their count to self-serve; other jobs need a request each
+    calls = []
+    for action in plan:
+        calls.extend([action] * (1 if action['type'] == RETRIGGER else action['count']))
+
+    def _execute(action):
+        limiter.wait()
+        if action['type'] == RETRIGGER:
+            req = buildapi.make_retrigger_request(action['repo_name'], action['request_id'],
+                                                  count=action['count'], dry_run=dry_run)
+            if not dry_run:
+                invalidate_jobs(action['repo_name'], action['revision'])
+            return req
+        return trigger(action['buildername'], action['revision'], action.get('files'),
+                       dry_run, action.get('properties'))
+
+    LOG.info("We are going to make %d request(s)." % len(calls))
+    requests = [req for req in map_concurrently(_execute, calls, max_workers=max_workers)
+                if req is not None]
+    if any(req.status_code not in (200, 202) for req in requests):
+        LOG.warning("Not all requests succeeded.")
+
+    cache_manager.maybe_evict()
+    return requests
 
 
 def trigger_missing_jobs_for_revision(repo_name, revision, dry_run=False):
     """
     Trigger missing jobs for a given revision.
     Jobs containing 'b2g' or 'pgo' in their buildername will not be triggered.
+
+    Most builders are test jobs sharing a few build jobs; the builders are grouped
+    by build job and the jobs of each build job are only looked at once.
     """
     builders_for_repo = list_builders(repo_name=repo_name)
 
+    groups = {}
     for buildername in builders_for_repo:
-        trigger_range(
-            buildername=buildername,
-            revisions=[revision],
-            times=1,
-            dry_run=dry_run,
-            extra_properties={
-                'mozci_request': {
-                    'type': 'trigger_missing_jobs_for_revision'
-                }
-            }
-        )
+        groups.setdefault(_upstream_builder(buildername), []).append(buildername)
+    LOG.info("We are going to look at %d builders depending on %d build jobs." %
+             (len(builders_for_repo), len(groups)))
+
+    builds = {}
+    for build_buildername in sorted(groups):
+        for buildername in groups[build_buildername]:
+            trigger_range(
+                buildername=buildername,
+                revisions=[revision],
+                times=1,
+                dry_run=dry_run,
+                extra_properties={
+                    'mozci_request': {
+                        'type': 'trigger_missing_jobs_for_revision'
+                    }
+                },
+                builds=builds
+            )
 
 
 def trigger_all_talos_jobs(repo_name, revision, times, dry_run=False):
@@ -574,7 +979,21 @@ def manual_backfill(revision, buildername, max_revisions, dry_run=False):
     )
 
 
-def _filter_backfill_revlist(buildername, revisions, only_successful=False):
+def _good_job_on_revision(repo_name, buildername, revision, only_successful=False,
+                          query_api=None):
+    """Determine if there is a good job for buildername on revision.
+
+    A good job is a successful, pending, running or failed one; if only_successful
+    is passed only a successful job is good.
+    """
+    query_api = query_api or QUERY_SOURCE
+    matching_jobs = query_api.get_matching_jobs(repo_name, revision, buildername)
+    statuses = (SUCCESS,) if only_successful else POTENTIAL_STATUSES
+    return _count_jobs(matching_jobs, statuses, needed=1, query_api=query_api) > 0
+
+
+def _filter_backfill_revlist(buildername, revisions, only_successful=False, max_probes=None,
+                             query_api=None):
     """ Return list of revisions without good jobs for a given buildername based on an initial list.
 
     If a job is found (many states), we return a revision list up to the revision of
@@ -583,38 +1002,58 @@ def _filter_backfill_revlist(buildername, revisions, only_successful=False):
 
     If a job is **not** found, we will simply run trigger_range() of the complete list
     of revisions and notify the user.
+
+    Instead of probing one revision at a time we probe windows of revisions
+    concurrently. The windows grow exponentially (1, 2, 4, ...) up to max_probes
+    (defaults to BACKFILL_MAX_PROBES); a good job on the newest revision costs a single
+    probe while a long gap costs a logarithmic number of round trips.
+    Since every revision of a window is probed, the result is the same as
+    the one of a linear scan.
+
+    query_api defaults to QUERY_SOURCE.
     """
+    if max_probes is None:
+        max_probes = BACKFILL_MAX_PROBES
+    query_api = query_api or QUERY_SOURCE
+
     new_revisions_list = []
     repo_name = query_repo_name_from_buildername(buildername)
     # XXX: We're asssuming that the list is ordered by the push_id
     LOG.info("We want to find a job for '%s' in this range: [%s:%s] (%d revisions)" %
              (buildername, revisions[0], revisions[-1], len(revisions)))
-    for rev in revisions:
-        matching_jobs = QUERY_SOURCE.get_matching_jobs(repo_name, rev, buildername)
-        if not only_successful:
-            successful, pending, running, _, failed = _status_summary(matching_jobs)
-            if matching_jobs and (successful or pending or running or failed):
-                LOG.info("We found a job for buildername '%s' on %s" %
-                         (buildername, rev))
-                # We don't need to look any further in the list of revisions
-                break
-            else:
-                new_revisions_list.append(rev)
-        else:
-            successful_jobs = _status_summary(matching_jobs)[0]
-            if successful_jobs > 0:
-                LOG.info("The last successful job for buildername '%s' is on %s" %
-                         (buildername, rev))
+    # Query sources which can fetch many revisions at once (Treeherder) do it now
+    query_api.prefetch_jobs(repo_name, revisions)
+
+    def _probe(rev):
+        return _good_job_on_revision(repo_name, buildername, rev, only_successful, query_api)
+
+    index = 0
+    window = 1
+    while index < len(revisions):
+        probed_revisions = revisions[index:index + window]
+        results = map_concurrently(_probe, probed_revisions, max_workers=window)
+        for rev, good in zip(probed_revisions, results):
+            if good:
+                if only_successful:
+                    LOG.info("The last successful job for buildername '%s' is on %s" %
+                             (buildername, rev))
+                else:
+                    LOG.info("We found a job for buildername '%s' on %s" %
+                             (buildername, rev))
                 # We don't need to look any further in the list of revisions
-                break
-            else:
-                new_revisions_list.append(rev)
+                LOG.debug("We only need to backfill %s" % new_revisions_list)
+                return new_revisions_list
+            new_revisions_list.append(rev)
+
+        index += window
+        window = max(1, min(window * 2, max_probes))
 
     LOG.debug("We only need to backfill %s" % new_revisions_list)
     return new_revisions_list
 
 
-def find_backfill_revlist(buildername, revision, max_revisions):
+def find_backfill_revlist(buildername, revision, max_revisions, max_probes=None,
+                          query_api=None):
     """Determine which revisions we need to trigger in order to backfill.
 
     This function is generally called by automatic backfilling on pulse_actions.
@@ -635,7 +1074,18 @@ def find_backfill_revlist(buildername, revision, max_revisions):
     If the list of revision we need to trigger is larger than max_revisions
     it means that we either have not had that job scheduled beyond max_revisions
     or it has been failing forever.
+
+    max_probes limits how many revisions we query concurrently (see _filter_backfill_revlist).
+    query_api defaults to QUERY_SOURCE.
     """
+    query_api = query_api or QUERY_SOURCE
+    if isinstance(query_api, DaemonQueryApi):
+        # The daemon answers with the query source we have chosen
+        return query_api.find_backfill_revlist(buildername=buildername,
+                                               revision=revision,
+                                               max_revisions=max_revisions,
+                                               max_probes=max_probes)
+
     # XXX: There is a chance that a green job has run in a newer push (the priority was higher),
     # however, this is unlikely.
 
@@ -648,7 +1098,8 @@ def find_backfill_revlist(buildername, revision, max_revisions):
         before=max_revisions - 1,
         after=0
     )
-    new_revlist = _filter_backfill_revlist(buildername, revlist, only_successful=True)
+    new_revlist = _filter_backfill_revlist(buildername, revlist, only_successful=True,
+                                           max_probes=max_probes, query_api=query_api)
 
     if len(new_revlist) >= max_revisions:
         # It is likely that we are facing a long lived permanent failure
@@ -1,13 +1,18 @@
 from __future__ import absolute_import
 
+import itertools
 import logging
+import time
 
 from abc import ABCMeta, abstractmethod
 from thclient import TreeherderClient
 
-from mozci.errors import TreeherderError, BuildapiError, BuildjsonError
+from mozci.errors import TreeherderError, BuildapiError, BuildjsonError, DaemonError
 from mozci.sources import buildapi
 from mozci.sources.buildjson import query_job_data
+from mozci.utils import instrumentation, transport
+from mozci.utils.concurrency import map_concurrently
+from mozci.utils.ttl_cache import StateAwareCache
 
 
 LOG = logging.getLogger('mozci')
@@ -15,7 +20,87 @@ LOG = logging.getLogger('mozci')
 # http://hg.mozilla.org/build/buildbot/file/0e02f6f310b4/master/buildbot/status/builder.py#l25
 PENDING, RUNNING, COALESCED, UNKNOWN = range(-4, 0)
 SUCCESS, WARNING, FAILURE, SKIPPED, EXCEPTION, RETRY, CANCELLED = range(7)
-JOBS_CACHE = {}
+# Seconds during which the jobs of a revision with pending or running jobs are used;
+# after that they are refreshed in the background and served for JOBS_CACHE_MAX_STALE
+# more seconds. Revisions whose jobs have all finished are kept until evicted.
+JOBS_CACHE_TTL = 60
+JOBS_CACHE_MAX_STALE = 600
+# Number of jobs (of all revisions) kept in JOBS_CACHE before evicting the least recently used
+JOBS_CACHE_MAX_JOBS = 200000
+TREEHERDER_URL = 'https://treeherder.mozilla.org'
+# (repo_name, Treeherder job id) -> buildapi request_id; it never changes once known
+REQUEST_ID_CACHE = {}
+# Number of jobs whose buildapi artifacts we ask for in a single request
+ARTIFACTS_BATCH = 100
+# Number of Treeherder jobs per page (the maximum Treeherder allows) and number of
+# pages fetched concurrently once a push has more than one page of jobs
+JOBS_PAGE_SIZE = 2000
+JOBS_PAGES_AHEAD = 3
+# The fields of Treeherder jobs mozci reads; the others are dropped as soon as a page arrives
+JOB_FIELDS = ('id', 'job_guid', 'ref_data_name', 'build_system_type', 'job_coalesced_to_guid',
+              'result', 'state', 'result_set_id')
+# (repo_name, revision[:12]) -> (time, jobs with JOB_FIELDS) filled by TreeherderApi.prefetch_jobs
+REVISION_JOBS_CACHE = {}
+# Seconds during which the prefetched jobs of a revision are used; older ones are
+# removed whenever prefetch_jobs() stores new ones
+PREFETCH_TTL = 60
+# Number of result sets per page (the maximum Treeherder allows) when prefetching a range
+RESULTSETS_PAGE_SIZE = 1000
+# The mozci daemon answering our queries (see mozci.use_daemon); its caches are
+# invalidated along with ours
+DAEMON = None
+
+
+def _all_finished(jobs):
+    """ Return True if every job of a self-serve list has finished (with whatever result). """
+    # A revision without jobs might have jobs scheduled later on
+    return bool(jobs) and all(job.get("status") is not None for job in jobs)
+
+
+# (repo_name, revision) -> self-serve jobs of that revision
+JOBS_CACHE = StateAwareCache('JOBS_CACHE', is_final=_all_finished, ttl=JOBS_CACHE_TTL,
+                             max_stale=JOBS_CACHE_MAX_STALE, max_weight=JOBS_CACHE_MAX_JOBS)
+
+
+def invalidate_jobs(repo_name, revision):
+    """
+    Forget the cached jobs of a revision.
+
+    Call it after requesting to trigger, retrigger or cancel jobs on that revision;
+    otherwise a revision whose jobs had all finished would look finished forever.
+    """
+    for key, _ in JOBS_CACHE.items():
+        # The revision might have been queried with 12 or 40 characters
+        if key[0] == repo_name and key[1][:12] == revision[:12]:
+            JOBS_CACHE.invalidate(key)
+    REVISION_JOBS_CACHE.pop((repo_name, revision[:12]), None)
+    _invalidate_in_daemon('invalidate_jobs', repo_name=repo_name, revision=revision)
+
+
+def invalidate_request(repo_name, request_id):
+    """ Forget the cached jobs of the revision of a buildapi request (see invalidate_jobs). """
+    for (repo, revision), jobs in JOBS_CACHE.items():
+        if repo == repo_name and \
+                any(request_id in _request_ids(job) for job in jobs):
+            JOBS_CACHE.invalidate((repo, revision))
+            REVISION_JOBS_CACHE.pop((repo_name, revision[:12]), None)
+    _invalidate_in_daemon('invalidate_request', repo_name=repo_name, request_id=request_id)
+
+
+def _invalidate_in_daemon(method, **kwargs):
+    if DAEMON:
+        try:
+            DAEMON.call(method, **kwargs)
+        except DaemonError, e:
+            # The request has been made already; the daemon's jobs expire or get evicted
+            LOG.warning("The mozci daemon could not forget the jobs we requested: %s" % e)
+
+
+def _request_ids(job):
+    # Most jobs have a "requests" key, but pending ones just have a "request_id" key
+    if "requests" in job:
+        return [request["request_id"] for request in job["requests"]]
+    return [job.get("request_id")]
 
 
 class QueryApi(object):
@@ -31,10 +116,22 @@ class QueryApi(object):
     def get_buildapi_request_id(self, repo_name, job):
         pass
 
+    def get_buildapi_request_ids(self, repo_name, jobs):
+        """ Return the buildapi request_ids of a list of jobs (in the same order). """
+        return [self.get_buildapi_request_id(repo_name, job) for job in jobs]
+
+    def prefetch_jobs(self, repo_name, revisions):
+        """ Let the query source fetch in bulk the jobs of revisions we are about to query. """
+        pass
+
     @abstractmethod
     def get_job_status(self, job):
         pass
 
+    def peek_job_status(self, job):
+        """ Return the status of a job if it is known without querying anything else or None. """
+        return self.get_job_status(job)
+
 
 class BuildApi(QueryApi):
 
@@ -43,12 +140,11 @@ class BuildApi(QueryApi):
         Return a list with all jobs for that revision.
 
         If we can't query about this revision in buildapi we return an empty list.
+        The jobs of a revision with unfinished jobs can be up to JOBS_CACHE_TTL seconds old
+        (JOBS_CACHE_TTL + JOBS_CACHE_MAX_STALE while they are refreshed).
         """
-        if (repo_name, revision) not in JOBS_CACHE:
-            JOBS_CACHE[(repo_name, revision)] = \
-                buildapi.query_jobs_schedule(repo_name, revision)
-
-        return JOBS_CACHE[(repo_name, revision)]
+        return JOBS_CACHE.lookup((repo_name, revision),
+                                 buildapi.query_jobs_schedule, repo_name, revision)
 
     def get_buildapi_request_id(self, repo_name, job):
         """ Method to return buildapi's request_id for a job. """
@@ -58,14 +154,16 @@ class BuildApi(QueryApi):
             return job["requests"][0]["request_id"]
         return job["request_id"]
 
-    def get_matching_jobs(self, repo_name, revision, buildername):
-        """Return all jobs that matched the criteria."""
+    def get_matching_jobs(self, repo_name, revision, buildername, limit=None):
+        """
+        Return all jobs that matched the criteria.
+
+        If limit is specified we return at most that many jobs.
+        """
         LOG.debug("Find jobs matching '%s'" % buildername)
         all_jobs = self._get_all_jobs(repo_name, revision)
-        matching_jobs = []
-        for j in all_jobs:
-            if j["buildername"] == buildername:
-                matching_jobs.append(j)
+        matching_jobs = list(itertools.islice(
+            (j for j in all_jobs if j["buildername"] == buildername), limit))
 
         LOG.debug("We have found %d job(s) of '%s'." %
                   (len(matching_jobs), buildername))
@@ -96,6 +194,16 @@ class BuildApi(QueryApi):
         LOG.debug(job)
         raise BuildapiError("Unexpected status")
 
+    def peek_job_status(self, job):
+        """
+        Return the status of a job from self-serve or None if it says SUCCESS.
+
+        Telling apart successful and coalesced jobs needs buildjson (see _is_coalesced).
+        """
+        if job.get("status") == SUCCESS:
+            return None
+        return self.get_job_status(job)
+
     def _is_coalesced(self, job):
         """Helper method to determine if a job with status 'SUCCESS' is coalesced.
            Bug: https://bugzilla.mozilla.org/show_bug.cgi?id=1175611
@@ -143,48 +251,209 @@ class BuildApi(QueryApi):
 class TreeherderApi(QueryApi):
 
     def __init__(self):
-        self.treeherder_client = TreeherderClient()
+        self.treeherder_client = TreeherderClient(server_url=TREEHERDER_URL)
+        # Let the requests be recorded or replayed (see mozci.utils.transport)
+        transport.mount(self.treeherder_client.session)
 
-    def _get_all_jobs(self, repo_name, revision, **params):
+    def _iter_pages(self, repo_name, fields=None, **params):
         """
-        Return all jobs for a given revision.
-        If we can't query about this revision in treeherder api, we return an empty list.
+        Yield the jobs matching params page by page.
+
+        The first page is fetched alone (most queries fit in it); if there are more,
+        JOBS_PAGES_AHEAD pages are fetched concurrently at a time. No more pages are
+        fetched once the caller stops iterating.
+
+        If fields is specified, the jobs only keep those fields.
         """
+        def _fetch_page(offset):
+            with instrumentation.timed_request('treeherder'):
+                jobs = self.treeherder_client.get_jobs(repo_name, count=JOBS_PAGE_SIZE,
+                                                       offset=offset, **params)
+            if fields:
+                jobs = [dict((field, job.get(field)) for field in fields) for job in jobs]
+            return jobs
+
+        # Jobs can move between pages if new ones are scheduled while we fetch them
+        seen = set()
+        offset = 0
+        pages = 1
+        while True:
+            offsets = [offset + i * JOBS_PAGE_SIZE for i in range(pages)]
+            for jobs in map_concurrently(_fetch_page, offsets):
+                for job in jobs:
+                    if job["id"] not in seen:
+                        seen.add(job["id"])
+                        yield job
+                if len(jobs) < JOBS_PAGE_SIZE:
+                    return
+            offset += pages * JOBS_PAGE_SIZE
+            pages = JOBS_PAGES_AHEAD
+
+    def _prefetched_jobs(self, repo_name, revision):
+        """Return the jobs of revision fetched by prefetch_jobs() or None if they are too old."""
+        entry = REVISION_JOBS_CACHE.get((repo_name, revision[:12]))
+        if entry is not None and time.time() - entry[0] < PREFETCH_TTL:
+            return entry[1]
+        return None
+
+    def _iter_jobs(self, repo_name, revision, fields=None, **params):
+        """
+        Yield the jobs of a revision page by page (see _iter_pages).
+
+        If fields is specified, the jobs only keep those fields.
+        """
+        if not params and fields and set(fields) <= set(JOB_FIELDS):
+            jobs = self._prefetched_jobs(repo_name, revision)
+            if jobs is not None:
+                instrumentation.cache_hit('REVISION_JOBS_CACHE')
+                for job in jobs:
+                    yield dict((field, job[field]) for field in fields)
+                return
+            instrumentation.cache_miss('REVISION_JOBS_CACHE')
+
         # We query treeherder for its internal revision_id, and then get the jobs from them.
         # We cannot get jobs directly from revision and repo_name in TH api.
         # See: https://bugzilla.mozilla.org/show_bug.cgi?id=1165401
-        results = self.treeherder_client.get_resultsets(repo_name, revision=revision, **params)
-        all_jobs = []
-        if results:
-            revision_id = results[0]["id"]
-            all_jobs = self.treeherder_client.get_jobs(repo_name, count=2000,
-                                                       result_set_id=revision_id, **params)
-        return all_jobs
+        with instrumentation.timed_request('treeherder'):
+            results = self.treeherder_client.get_resultsets(repo_name, revision=revision,
+                                                            **params)
+        if not results:
+            return
+
+        for job in self._iter_pages(repo_name, fields=fields, result_set_id=results[0]["id"],
+                                    **params):
+            yield job
+
+    def prefetch_jobs(self, repo_name, revisions):
+        """
+        Fetch in bulk the jobs of a list of pushes (newest or oldest first).
+
+        The result sets of all the revisions are found by querying the range they
+        span (fromchange/tochange; usually a single page) and their jobs are fetched
+        together (result_set_id__in).
+        The jobs of every revision are kept in REVISION_JOBS_CACHE for PREFETCH_TTL
+        seconds; get_matching_jobs() and friends use them instead of querying
+        Treeherder once per revision.
+        """
+        revisions = [rev[:12] for rev in revisions
+                     if self._prefetched_jobs(repo_name, rev) is None]
+        if len(revisions) < 2:
+            return
+
+        LOG.debug("We are fetching the jobs of %d revisions from treeherder." % len(revisions))
+        wanted = set(revisions)
+        revision_by_id = {}
+        # We don't know if the revisions are ordered from the newest or from the oldest
+        for oldest, newest in ((revisions[-1], revisions[0]), (revisions[0], revisions[-1])):
+            revision_by_id = self._find_resultsets(repo_name, oldest, newest, wanted)
+            if revision_by_id:
+                break
+
+        if not revision_by_id:
+            return
+
+        jobs_by_revision = dict((rev, []) for rev in revision_by_id.itervalues())
+        jobs = self._iter_pages(repo_name, fields=JOB_FIELDS,
+                                result_set_id__in=','.join(map(str, sorted(revision_by_id))))
+        for job in jobs:
+            revision = revision_by_id.get(job["result_set_id"])
+            if revision is not None:
+                jobs_by_revision[revision].append(job)
+
+        now = time.time()
+        # Drop what has expired so the cache does not grow in long-running processes
+        for key, entry in REVISION_JOBS_CACHE.items():
+            if now - entry[0] >= PREFETCH_TTL:
+                REVISION_JOBS_CACHE.pop(key, None)
+        for revision, jobs in jobs_by_revision.iteritems():
+            REVISION_JOBS_CACHE[(repo_name, revision)] = (now, jobs)
+
+    def _find_resultsets(self, repo_name, oldest, newest, wanted):
+        """
+        Return {result set id: revision} for the wanted revisions between oldest and newest.
+
+        The range can have many more pushes than the revisions we want (they might not
+        be consecutive); we go through it page by page until we have found all of them.
+        """
+        revision_by_id = {}
+        offset = 0
+        while True:
+            with instrumentation.timed_request('treeherder'):
+                results = self.treeherder_client.get_resultsets(
+                    repo_name, fromchange=oldest, tochange=newest,
+                    count=RESULTSETS_PAGE_SIZE, offset=offset)
+            for result in results:
+                if result["revision"][:12] in wanted:
+                    revision_by_id[result["id"]] = result["revision"][:12]
+            if len(results) < RESULTSETS_PAGE_SIZE or len(revision_by_id) == len(wanted):
+                return revision_by_id
+            offset += RESULTSETS_PAGE_SIZE
+
+    def _get_all_jobs(self, repo_name, revision, **params):
+        """
+        Return all jobs for a given revision.
+        If we can't query about this revision in treeherder api, we return an empty list.
+        """
+        return list(self._iter_jobs(repo_name, revision, **params))
 
     def get_buildapi_request_id(self, repo_name, job):
         """ Method to return buildapi's request_id. """
-        job_id = job["id"]
-        query_params = {'job_id': job_id,
-                        'name': 'buildapi'}
-        LOG.debug("We are fetching request_id from treeherder artifacts api")
-        artifact_content = self.treeherder_client.get_artifacts(repo_name,
-                                                                **query_params)
-        return artifact_content[0]["blob"]["request_id"]
-
-    def get_hidden_jobs(self, repo_name, revision):
-        """ Return all hidden jobs on Treeherder """
-        return self._get_all_jobs(repo_name, revision=revision, visibility='excluded')
+        request_id = self.get_buildapi_request_ids(repo_name, [job])[0]
+        if request_id is None:
+            raise TreeherderError("Job %s does not have a buildapi artifact." % job["id"])
+        return request_id
 
-    def get_matching_jobs(self, repo_name, revision, buildername):
+    def get_buildapi_request_ids(self, repo_name, jobs):
         """
-        Return all jobs that matched the criteria.
+        Return the buildapi request_ids of a list of jobs (in the same order).
+
+        The buildapi artifacts of the jobs we have not seen yet are fetched in
+        batches of ARTIFACTS_BATCH jobs. The request_id of a job without a
+        buildapi artifact (e.g. a TaskCluster job) is None.
+        """
+        missing = sorted(set(job["id"] for job in jobs
+                             if (repo_name, job["id"]) not in REQUEST_ID_CACHE))
+        if missing:
+            LOG.debug("We are fetching the request_ids of %d job(s) from treeherder artifacts "
+                      "api" % len(missing))
+            instrumentation.cache_miss('REQUEST_ID_CACHE')
+
+            def _fetch_artifacts(job_ids):
+                with instrumentation.timed_request('treeherder'):
+                    return self.treeherder_client.get_artifacts(
+                        repo_name, job_id__in=','.join(str(job_id) for job_id in job_ids),
+                        name='buildapi')
+
+            batches = [missing[i:i + ARTIFACTS_BATCH]
+                       for i in range(0, len(missing), ARTIFACTS_BATCH)]
+            for artifacts in map_concurrently(_fetch_artifacts, batches):
+                for artifact in artifacts:
+                    REQUEST_ID_CACHE[(repo_name, artifact["job_id"])] = \
+                        artifact["blob"]["request_id"]
+        else:
+            instrumentation.cache_hit('REQUEST_ID_CACHE')
+
+        return [REQUEST_ID_CACHE.get((repo_name, job["id"])) for job in jobs]
+
+    def get_hidden_jobs(self, repo_name, revision, limit=None):
+        """
+        Return the hidden jobs on Treeherder (JOB_FIELDS only).
+
+        If limit is specified we stop fetching jobs once we have that many.
+        """
+        jobs = self._iter_jobs(repo_name, revision, fields=JOB_FIELDS, visibility='excluded')
+        return list(itertools.islice(jobs, limit))
+
+    def get_matching_jobs(self, repo_name, revision, buildername, limit=None):
+        """
+        Return all jobs that matched the criteria (JOB_FIELDS only).
+
+        If limit is specified we stop fetching jobs once we have found that many.
         """
         LOG.debug("Find jobs matching '%s'" % buildername)
-        all_jobs = self._get_all_jobs(repo_name, revision)
-        matching_jobs = []
-        for j in all_jobs:
-            if j["ref_data_name"] == buildername:
-                matching_jobs.append(j)
+        jobs = self._iter_jobs(repo_name, revision, fields=JOB_FIELDS)
+        matching_jobs = list(itertools.islice(
+            (j for j in jobs if j["ref_data_name"] == buildername), limit))
 
         LOG.debug("We have found %d job(s) of '%s'." %
                   (len(matching_jobs), buildername))
@@ -224,3 +493,26 @@ class TreeherderApi(QueryApi):
 
         LOG.debug(job)
         raise TreeherderError("Unexpected status")
+
+    def find_all_jobs_by_status(self, repo_name, revision, status):
+        """
+        Find all jobs with status 'status' in a given branch and revision.
+
+        Returns a list with the request_ids of the jobs whose only status is 'status'.
+        Their request_ids are resolved with a single batch of artifact requests.
+        """
+        job_by_buildername = {}
+        wrong_status_buildernames = set()
+        for job in self._iter_jobs(repo_name, revision, fields=JOB_FIELDS):
+            if (job["build_system_type"] or "buildbot") != "buildbot":
+                continue
+            buildername = job["ref_data_name"]
+            if self.get_job_status(job) == status:
+                job_by_buildername[buildername] = job
+            else:
+                wrong_status_buildernames.add(buildername)
+
+        jobs = [job_by_buildername[b] for b in
+                set(job_by_buildername) - wrong_status_buildernames]
+        request_ids = self.get_buildapi_request_ids(repo_name, jobs)
+        return sorted(request_id for request_id in request_ids if request_id is not None)
@@ -1,7 +1,11 @@
 from mozci.sources.buildjson import _fetch_data, BUILDS_DAY_FILE
+from mozci.utils import transfer
 from mozci.utils.tzone import pacific_time as pt
 from mozci.utils.tzone import utc_time as ut
 
+# We read the endtime of jobs; not only the fields mozci needs
+transfer.MEMORY_SAVING_MODE = False
+
 builds = _fetch_data(BUILDS_DAY_FILE % "2015-02-23")
 
 endtimes_list = []
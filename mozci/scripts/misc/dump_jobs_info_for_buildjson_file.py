@@ -1,5 +1,8 @@
 from mozci.sources.buildjson import _fetch_data, BUILDS_DAY_FILE
+from mozci.utils import transfer
 
+# We read the reason of jobs; not only the fields mozci needs
+transfer.MEMORY_SAVING_MODE = False
 
 jobs = _fetch_data(BUILDS_DAY_FILE % "2015-03-03")
 
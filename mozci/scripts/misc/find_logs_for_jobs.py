@@ -3,6 +3,7 @@ import logging
 
 from mozci.query_jobs import BuildApi
 from mozci.mozci import query_repo_name_from_buildername, _status_info
+from mozci.sources import buildjson
 
 logging.basicConfig(format='%(asctime)s %(levelname)s:\t %(message)s',
                     datefmt='%m/%d/%Y %I:%M:%S')
@@ -38,7 +39,19 @@ if __name__ == "__main__":
                         required=True,
                         help='The 12 character representing a revision (most recent).')
 
+    parser.add_argument("--use-db",
+                        action="store_true",
+                        dest="use_db",
+                        help="Answer from the local job history database (see job_history.py).")
+
+    parser.add_argument("--use-store",
+                        action="store_true",
+                        dest="use_store",
+                        help="Answer from memory-mapped stores of the buildjson files.")
+
     options = parser.parse_args()
+    buildjson.USE_DB = options.use_db
+    buildjson.USE_STORE = options.use_store
 
     jobs = query_jobs_buildername(options.buildername, options.rev)
     for schedule_info in jobs:
@@ -7,6 +7,7 @@ from mozci.mozci import query_repo_name_from_buildername, _matching_jobs, \
     _status_info, _status_summary
 from mozci.sources.buildapi import HOST_ROOT, RESULTS, COALESCED, \
     query_job_status, query_jobs_schedule
+from mozci.utils import transfer
 
 logging.basicConfig(format='%(asctime)s %(levelname)s:\t %(message)s',
                     datefmt='%m/%d/%Y %I:%M:%S')
@@ -41,6 +42,8 @@ if __name__ == "__main__":
 
     # requests is too noisy and adds no value
     logging.getLogger("requests").setLevel(logging.WARNING)
+    # We print whole jobs; not only the fields mozci needs
+    transfer.MEMORY_SAVING_MODE = False
 
     repo_name = query_repo_name_from_buildername(options.buildername)
     all_jobs = query_jobs_schedule(repo_name, options.rev)
@@ -0,0 +1,47 @@
+"""
+This script ingests the buildjson day files of the last N days into the local
+job history database and optionally prints the jobs matching a buildername and/or revision.
+"""
+import datetime
+import logging
+
+from argparse import ArgumentParser
+
+from mozci.sources import buildjson, buildjson_db
+from mozci.utils.tzone import utc_dt
+
+logging.basicConfig(format='%(asctime)s %(levelname)s:\t %(message)s',
+                    datefmt='%m/%d/%Y %I:%M:%S')
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--days",
+                        dest="days",
+                        type=int,
+                        default=1,
+                        help="Number of days to ingest (today is not included).")
+
+    parser.add_argument('-b', "--buildername",
+                        dest="buildername",
+                        type=str,
+                        help="The buildername used in Treeherder.")
+
+    parser.add_argument("-r", "--revision",
+                        dest="rev",
+                        help='The 12 character representing a revision.')
+
+    options = parser.parse_args()
+
+    today = utc_dt().date()
+    days = [(today - datetime.timedelta(days=i)).strftime('%Y-%m-%d')
+            for i in range(options.days, 0, -1)]
+    LOG.info("We have ingested %d new jobs." % buildjson.ingest_days(days))
+
+    if options.buildername or options.rev:
+        for job in buildjson_db.query_jobs(buildername=options.buildername,
+                                           revision=options.rev):
+            print "%s %s %s %s" % (job["endtime"], job["result"],
+                                   job["properties"].get("revision"),
+                                   job["properties"].get("buildername"))
@@ -1,8 +1,9 @@
 '''
-taskcluster_retrigger.py allows you to retrigger a task from TaskCluster
-past its deadline.
+taskcluster_retrigger.py allows you to retrigger tasks from TaskCluster
+past their deadline.
 '''
 import logging
+import sys
 
 from argparse import ArgumentParser
 
@@ -22,6 +23,12 @@ def main():
                         dest="dry_run",
                         help="Dry run. No real actions are taken.")
 
+    parser.add_argument("--graph-per-task",
+                        action="store_true",
+                        dest="graph_per_task",
+                        help="Schedule every task in its own graph instead of a "
+                             "single graph with all of them.")
+
     parser.add_argument('task_ids',
                         metavar='task_id',
                         type=str,
@@ -36,10 +43,22 @@ def main():
         LOG = setup_logging()
 
     sch = TaskClusterBuildbotManager()
-    for t_id in options.task_ids:
-        ret_code = sch.retrigger(uuid=t_id, dry_run=options.dry_run)
-        if ret_code < 0:
+    results = sch.retrigger_many(uuids=options.task_ids,
+                                 dry_run=options.dry_run,
+                                 single_graph=not options.graph_per_task)
+    if results is None:
+        sys.exit(1)
+
+    if options.dry_run:
+        LOG.info("Dry-run: Nothing was retriggered.")
+        return
+
+    for t_id, new_task_id in sorted(results.iteritems()):
+        if new_task_id is None:
             LOG.warning("We could not retrigger task %s" % t_id)
+        else:
+            LOG.info("Task %s has been retriggered as %s" % (t_id, new_task_id))
+
 
 if __name__ == "__main__":
     main()
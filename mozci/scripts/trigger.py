@@ -1,3 +1,4 @@
+import json
 import logging
 import sys
 import urllib
@@ -5,14 +6,19 @@ import urllib
 from argparse import ArgumentParser
 
 from mozci.mozci import (
+    describe_plan,
+    execute_plan,
     find_backfill_revlist,
+    make_plan,
     query_builders,
     query_repo_name_from_buildername,
     query_repo_url_from_buildername,
     set_query_source,
+    use_daemon,
     trigger_missing_jobs_for_revision,
     trigger_range,
 )
+from mozci.monitor import BuildMonitor
 from mozci.query_jobs import BuildApi, COALESCED
 from mozci.sources.buildapi import (
     make_retrigger_request,
@@ -93,6 +99,21 @@ def parse_args(argv=None):
                         dest="repo_name",
                         help="Branch name")
 
+    parser.add_argument("--monitor",
+                        action="store_true",
+                        dest="monitor",
+                        help="Wait for the build jobs we need and trigger the test jobs "
+                        "once they are done.")
+
+    parser.add_argument("--save-plan",
+                        dest="save_plan",
+                        help="Save the plan of the jobs we would trigger (json) to this file "
+                        "instead of triggering them.")
+
+    parser.add_argument("--load-plan",
+                        dest="load_plan",
+                        help="Trigger the jobs of a plan saved with --save-plan.")
+
     parser.add_argument("--existing-only",
                         action="store_false",
                         dest="trigger_build_if_missing",
@@ -137,9 +158,13 @@ def validate_options(options):
     Raises an exception if options are missing or conflicting.
     """
     error_message = ""
-    if not options.buildernames and (not options.coalesced and not options.fill_revision):
-        error_message = "A buildername is mandatory for all modes except --coalesced and " \
-                        "--fill-revision. Use --buildername."
+    if options.load_plan:
+        if options.buildernames or options.save_plan:
+            error_message = "You should not pass --buildername or --save-plan " \
+                            "when you use --load-plan."
+    elif not options.buildernames and (not options.coalesced and not options.fill_revision):
+        error_message = "A buildername is mandatory for all modes except --coalesced, " \
+                        "--fill-revision and --load-plan. Use --buildername."
 
     if options.coalesced and not options.repo_name:
         error_message = "A branch name is mandatory with --coalesced. Use --repo-name."
@@ -230,6 +255,21 @@ def main():
 
     # Setting the QUERY_SOURCE global variable in mozci.py
     set_query_source(options.query_source)
+    # Use the warm caches of a mozci daemon if MOZCI_DAEMON is set
+    use_daemon()
+
+    # A plan saved with --save-plan knows everything we need to trigger
+    if options.load_plan:
+        with open(options.load_plan) as fd:
+            plan = json.load(fd)
+        for line in describe_plan(plan):
+            LOG.info(line)
+
+        if options.dry_run:
+            LOG.info("Dry-run: We did not trigger anything.")
+        else:
+            execute_plan(plan)
+        return
 
     if options.buildernames:
         options.buildernames = sanitize_buildernames(options.buildernames)
@@ -267,6 +307,7 @@ def main():
         return
 
     # Mode #3: Trigger jobs based on revision list modifiers
+    goals = []
     for buildername in options.buildernames:
         revlist = determine_revlist(
             repo_url=repo_url,
@@ -278,20 +319,42 @@ def main():
             backfill=options.backfill,
             skips=options.skips,
             max_revisions=options.max_revisions)
-
-        try:
-            trigger_range(
-                buildername=buildername,
-                revisions=revlist,
-                times=options.times,
-                dry_run=options.dry_run,
-                files=options.files,
-                trigger_build_if_missing=options.trigger_build_if_missing
-            )
-        except Exception, e:
-            LOG.exception(e)
-            exit(1)
-
+        goals.append((buildername, revlist, options.times))
+
+    try:
+        if options.monitor:
+            # The monitor triggers the test jobs once the build jobs we need are done
+            monitor = BuildMonitor(dry_run=options.dry_run)
+            for buildername, revlist, times in goals:
+                trigger_range(
+                    buildername=buildername,
+                    revisions=revlist,
+                    times=times,
+                    dry_run=options.dry_run,
+                    files=options.files,
+                    trigger_build_if_missing=options.trigger_build_if_missing,
+                    monitor=monitor
+                )
+        else:
+            # We decide what to do for every job before making any request
+            plan = make_plan(goals, files=options.files,
+                             trigger_build_if_missing=options.trigger_build_if_missing)
+            for line in describe_plan(plan):
+                LOG.info(line)
+
+            if options.save_plan:
+                with open(options.save_plan, 'w') as fd:
+                    json.dump(plan, fd, indent=2, sort_keys=True)
+                LOG.info("The plan has been saved to %s." % options.save_plan)
+            elif options.dry_run:
+                LOG.info("Dry-run: We did not trigger anything.")
+            else:
+                execute_plan(plan)
+    except Exception, e:
+        LOG.exception(e)
+        exit(1)
+
+    for buildername, revlist, _ in goals:
         if revlist:
             LOG.info('https://treeherder.mozilla.org/#/jobs?%s' %
                      urllib.urlencode({'repo': options.repo_name,
@@ -299,6 +362,9 @@ def main():
                                        'tochange': revlist[0],
                                        'filter-searchStr': buildername}))
 
+    if options.monitor:
+        monitor.run()
+
 
 if __name__ == "__main__":
     main()
@@ -12,7 +12,7 @@ from argparse import ArgumentParser
 
 from mozci.mozci import (
     query_repo_name_from_buildername,
-    query_builders, set_query_source,
+    query_builders, set_query_source, use_daemon,
     trigger_range
 )
 from mozci.platforms import filter_buildernames
@@ -114,6 +114,8 @@ def main():
 
     # Setting the QUERY_SOURCE global variable in mozci.py
     set_query_source(options.query_source)
+    # Use the warm caches of a mozci daemon if MOZCI_DAEMON is set
+    use_daemon()
 
     for buildername in buildernames:
         trigger_range(
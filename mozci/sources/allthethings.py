@@ -46,12 +46,11 @@ It contains a dictionary with 4 keys:
 * **master_builders**
 * **slavepools**
 """
-import json
 import logging
 import os
 
-import requests
-
+from mozci.utils import cache_manager, instrumentation, json_backend, locking, transport
+from mozci.utils.concurrency import SingleFlight
 from mozci.utils.transfer import path_to_file
 
 LOG = logging.getLogger('mozci')
@@ -61,6 +60,8 @@ ALLTHETHINGS = \
     "https://secure.pub.build.mozilla.org/builddata/reports/allthethings.json"
 
 DATA = None
+# Threads asking for the data while it is being loaded wait for it instead of loading it again
+_LOADING = SingleFlight('allthethings')
 
 
 def fetch_allthethings_data(no_caching=False, verify=True):
@@ -70,55 +71,80 @@ def fetch_allthethings_data(no_caching=False, verify=True):
     If no_caching is True, we fetch it every time without creating a file.
     If verify is False, we load from disk without checking. This should only be used if
     allthethings.json exists and it's trusted.
+
+    Threads calling this function at the same time share one download and parse.
     """
     def _fetch():
-        LOG.debug("Fetching allthethings.json %s" % ALLTHETHINGS)
-        req = requests.get(ALLTHETHINGS, stream=True)
-
-        # This automatically erases the previous cached file.
-        with open(FILENAME, "wb") as fd:
-            for chunk in req.iter_content(chunk_size=1024):
-                if chunk:  # filter out keep-alive new chunks
-                    fd.write(chunk)
-                    fd.flush()
+        previous_signature = locking.signature(FILENAME)
+        # Only one process downloads the file; the others wait and use its copy
+        with locking.FileLock(FILENAME):
+            if locking.changed_since(FILENAME, previous_signature):
+                LOG.debug("allthethings.json has just been downloaded by another process.")
+            else:
+                _download()
 
         if _verify_file_integrity():
             fd = open(FILENAME, "r")
-            data = json.load(fd)
+            with instrumentation.timer('parse.allthethings'):
+                data = json_backend.load(fd)
             return data
         else:
             LOG.debug('File integrity failed. Retrying fetching the file.')
             return _fetch()
 
+    def _download():
+        LOG.debug("Fetching allthethings.json %s" % ALLTHETHINGS)
+        req = transport.get(ALLTHETHINGS, source='allthethings', stream=True)
+
+        # We replace the previous cached file once the new one is complete
+        tmp_path = locking.temp_path(FILENAME)
+        try:
+            with open(tmp_path, "wb") as fd:
+                for chunk in req.iter_content(chunk_size=1024):
+                    if chunk:  # filter out keep-alive new chunks
+                        fd.write(chunk)
+                        instrumentation.record_bytes('allthethings', len(chunk))
+            locking.publish(tmp_path, FILENAME)
+        finally:
+            locking.discard(tmp_path)
+
     def _verify_file_integrity():
         if not os.path.exists(FILENAME):
             return False
 
         statinfo = os.stat(FILENAME)
         file_size = statinfo.st_size
-        response = requests.head(ALLTHETHINGS)
+        response = transport.head(ALLTHETHINGS, source='allthethings')
         content_length = int(response.headers['content-length'])
         if file_size != content_length:
             return False
         else:
             return True
 
-    global DATA
-
-    if no_caching:
-        DATA = _fetch()
-    # If we do not have an in-memory cache, try to use the file cache.
-    elif DATA is None:
-        # Only use the file cache if it is up-to-date and not corrupted.
-        if not verify or _verify_file_integrity():
-            assert os.path.exists(FILENAME), \
-                "verify=False should only be used if allthethings.json exists."
-            fd = open(FILENAME)
-            DATA = json.load(fd)
-        else:
-            DATA = _fetch()
+    def _load():
+        global DATA
 
-    return DATA
+        if no_caching:
+            DATA = _fetch()
+        # If we do not have an in-memory cache, try to use the file cache.
+        elif DATA is None:
+            cache_manager.touch(FILENAME)
+            # Only use the file cache if it is up-to-date and not corrupted.
+            if not verify or _verify_file_integrity():
+                assert os.path.exists(FILENAME), \
+                    "verify=False should only be used if allthethings.json exists."
+                fd = open(FILENAME)
+                with instrumentation.timer('parse.allthethings'):
+                    DATA = json_backend.load(fd)
+            else:
+                DATA = _fetch()
+
+        return DATA
+
+    if not no_caching and DATA is not None:
+        return DATA
+
+    return _LOADING.do('fetch' if no_caching else 'load', _load)
 
 
 def _list_builders():
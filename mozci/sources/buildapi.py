@@ -14,9 +14,8 @@ import json
 import logging
 import os
 
-import requests
-
 from mozci.errors import BuildapiError, AuthenticationError
+from mozci.utils import cache_manager, instrumentation, json_backend, locking, transport
 from mozci.utils.authentication import get_credentials, remove_credentials
 from mozci.utils.transfer import path_to_file
 from mozci.sources import pushlog
@@ -46,8 +45,9 @@ def trigger_arbitrary_job(repo_name, builder, revision, files=[], dry_run=False,
         return None
 
     # NOTE: A good response returns json with request_id as one of the keys
-    req = requests.post(
+    req = transport.post(
         url,
+        source='buildapi',
         headers={'Accept': 'application/json'},
         data=payload,
         auth=get_credentials()
@@ -90,8 +90,9 @@ def make_retrigger_request(repo_name, request_id, count=1, priority=0, dry_run=T
 
     LOG.info("We're going to re-trigger an existing completed job with request_id: %s %i time(s)."
              % (request_id, count))
-    req = requests.post(
+    req = transport.post(
         url,
+        source='buildapi',
         headers={'Accept': 'application/json'},
         data=payload,
         auth=get_credentials()
@@ -113,12 +114,28 @@ def make_cancel_request(repo_name, request_id, dry_run=True):
         return None
 
     LOG.info("We're going to cancel the job at %s" % url)
-    req = requests.delete(url, auth=get_credentials())
+    req = transport.delete(url, source='buildapi', auth=get_credentials())
     # TODO: add debug message with the canceled job_id URL. Find a way
     # to do that without doing an additional request.
     return req
 
 
+def make_stop_build_request(repo_name, build_id, dry_run=True):
+    """
+    Stop a running build using buildapi self-serve. Returns a request.
+
+    Buildapi documentation:
+    DELETE /self-serve/{branch}/build/{build_id} Stop the given build
+    """
+    url = '{}/{}/build/{}'.format(HOST_ROOT, repo_name, build_id)
+    if dry_run:
+        LOG.info('We would make a DELETE request to %s.' % url)
+        return None
+
+    LOG.info("We're going to stop the build at %s" % url)
+    return transport.delete(url, source='buildapi', auth=get_credentials())
+
+
 def _builders_api_url(repo_name, builder, revision):
     return r'''%s/%s/builders/%s/%s''' % (
         HOST_ROOT,
@@ -168,7 +185,7 @@ def query_jobs_schedule(repo_name, revision):
 
     url = "%s/%s/rev/%s?format=json" % (HOST_ROOT, repo_name, revision)
     LOG.debug("About to fetch %s" % url)
-    req = requests.get(url, auth=get_credentials())
+    req = transport.get(url, source='buildapi', auth=get_credentials())
 
     # If the revision doesn't exist on buildapi, that means there are
     # no builapi jobs for this revision
@@ -227,22 +244,29 @@ def query_repositories(clobber=False):
             os.remove(REPOSITORIES_FILE)
 
     if REPOSITORIES:
+        instrumentation.cache_hit('REPOSITORIES')
         return REPOSITORIES
 
+    instrumentation.cache_miss('REPOSITORIES')
+    cache_manager.touch(REPOSITORIES_FILE)
     if os.path.exists(REPOSITORIES_FILE):
         LOG.debug("Loading %s" % REPOSITORIES_FILE)
         fd = open(REPOSITORIES_FILE)
-        REPOSITORIES = json.load(fd)
+        with instrumentation.timer('parse.repositories'):
+            REPOSITORIES = json_backend.load(fd)
     else:
         url = "%s/branches?format=json" % HOST_ROOT
         LOG.debug("About to fetch %s" % url)
-        req = requests.get(url, auth=get_credentials())
+        req = transport.get(url, source='buildapi', auth=get_credentials())
         if req.status_code == 401:
             remove_credentials()
             raise AuthenticationError("Your credentials were invalid. Please try again.")
 
         REPOSITORIES = req.json()
-        with open(REPOSITORIES_FILE, "wb") as fd:
+        # Other processes might be reading the file
+        tmp_path = locking.temp_path(REPOSITORIES_FILE)
+        with open(tmp_path, "wb") as fd:
             json.dump(REPOSITORIES, fd)
+        locking.publish(tmp_path, REPOSITORIES_FILE)
 
     return REPOSITORIES
@@ -3,20 +3,39 @@
 This module helps with the buildjson data generated by the Release Engineering
 systems: http://builddata.pub.build.mozilla.org/builddata/buildjson
 """
+import collections
+import itertools
 import logging
+import multiprocessing
 import os
+import time
 
+from mozci.sources import buildjson_db, buildjson_store
+from mozci.utils import instrumentation
+from mozci.utils.concurrency import SingleFlight
+from mozci.utils.misc import buildjson_request_ids
 from mozci.utils.tzone import utc_dt, utc_time, utc_day
-from mozci.utils.transfer import load_file, path_to_file
+from mozci.utils.transfer import fetch_file, iter_json_items, load_file, path_to_file
 
 LOG = logging.getLogger('mozci')
 
 BUILDJSON_DATA = "http://builddata.pub.build.mozilla.org/builddata/buildjson"
 BUILDS_4HR_FILE = "builds-4hr.js"
 BUILDS_DAY_FILE = "builds-%s.js"
+DAY = 24 * 60 * 60
+# builds-4hr.js covers the jobs which ended in the last 4 hours
+FOUR_HOURS = 4 * 60 * 60
 
 # This helps us read into memory and load less from disk
 BUILDS_CACHE = {}
+# Threads asking for a file which is being loaded wait for it instead of loading it again
+_LOADING = SingleFlight('BUILDS_CACHE')
+# Set this value to True in your tool to answer queries from the local
+# job history database (see buildjson_db) instead of loading whole files
+USE_DB = False
+# Set this value to True in your tool to answer queries from memory-mapped
+# stores of the buildjson files (see buildjson_store) instead of parsing them
+USE_STORE = False
 
 
 def _fetch_data(filename):
@@ -24,12 +43,25 @@ def _fetch_data(filename):
     Helper method to fetch the buildjson data we need.
 
     This function caches the uncompressed gzip files requested in the past.
+    Threads asking for the same file at the same time share one download and parse.
 
     Returns all jobs inside of this buildjson file.
     """
-    global BUILDS_CACHE
-    if filename in BUILDS_CACHE:
-        return BUILDS_CACHE[filename]
+    jobs = BUILDS_CACHE.get(filename)
+    if jobs is not None:
+        instrumentation.cache_hit('BUILDS_CACHE')
+        return jobs
+
+    instrumentation.cache_miss('BUILDS_CACHE')
+    return _LOADING.do(filename, _load_data, filename)
+
+
+def _load_data(filename):
+    # The file might have been loaded since we looked at the cache
+    jobs = BUILDS_CACHE.get(filename)
+    if jobs is not None:
+        return jobs
+
     url = "%s/%s.gz" % (BUILDJSON_DATA, filename)
 
     if not os.path.isabs(filename):
@@ -38,11 +70,59 @@ def _fetch_data(filename):
         filepath = filename
 
     # If the file exists and is valid we won't download it again
-    json_contents = load_file(filepath, url)
+    json_contents = load_file(filepath, url, source='buildjson')
     BUILDS_CACHE[filename] = json_contents["builds"]
     return json_contents["builds"]
 
 
+def ingest(filename):
+    """
+    Fetch a buildjson file (if needed) and store its jobs in the job history database.
+
+    Returns the number of jobs ingested (0 if the database was already up-to-date).
+    """
+    url = "%s/%s.gz" % (BUILDJSON_DATA, filename)
+    filepath = fetch_file(path_to_file(filename), url, source='buildjson')
+    return buildjson_db.ingest_file(filepath, filename)
+
+
+def ingest_days(days):
+    """Ingest the day files for a list of UTC days (e.g. ['2015-02-23'])."""
+    count = 0
+    for day in days:
+        count += ingest(BUILDS_DAY_FILE % day)
+    return count
+
+
+def _find_job_in_db(request_id, filename):
+    """Look for request_id in the job history database; ingest filename if needed."""
+    job = buildjson_db.query_job(request_id, filename)
+    if job:
+        return job
+
+    # The file might not have been ingested yet or it might have changed since
+    ingest(filename)
+    return buildjson_db.query_job(request_id, filename)
+
+
+def _open_store(filename):
+    """Fetch a buildjson file (if needed) and return its store."""
+    url = "%s/%s.gz" % (BUILDJSON_DATA, filename)
+    filepath = fetch_file(path_to_file(filename), url, source='buildjson')
+    return buildjson_store.open_store(filepath)
+
+
+def _find_job_in_store(request_id, filename):
+    """Look for request_id in the store of filename; fetch the file if needed."""
+    store = buildjson_store.STORES.get(buildjson_store.store_path(path_to_file(filename)))
+    job = store.find_request(request_id) if store is not None else None
+    if job:
+        return job
+
+    # We might not have the file yet or it might have changed since
+    return _open_store(filename).find_request(request_id)
+
+
 def _find_job(request_id, jobs, loaded_from):
     """
     Look for request_id in a list of jobs.
@@ -140,6 +220,21 @@ def query_job_data(complete_at, request_id):
         filename = BUILDS_4HR_FILE
     else:
         filename = BUILDS_DAY_FILE % date
+
+    if USE_DB:
+        job = _find_job_in_db(request_id, filename)
+        if job is None:
+            LOG.info("We have not found the job with request_id %s in %s" %
+                     (request_id, filename))
+        return job
+
+    if USE_STORE:
+        job = _find_job_in_store(request_id, filename)
+        if job is None:
+            LOG.info("We have not found the job with request_id %s in %s" %
+                     (request_id, filename))
+        return job
+
     job = _find_job(request_id, _fetch_data(filename), filename)
 
     if job:
@@ -150,7 +245,7 @@ def query_job_data(complete_at, request_id):
     # it fails, we will raise an Exception
     LOG.debug("We did not find %d in %s, we'll clear our cache and try again."
               % (request_id, filename))
-    del BUILDS_CACHE[filename]
+    BUILDS_CACHE.pop(filename, None)
 
     job = _find_job(request_id, _fetch_data(filename), filename)
     if job:
@@ -158,3 +253,124 @@ def query_job_data(complete_at, request_id):
 
     LOG.info("We have not found the job with request_id %s in %s" % (request_id, filename))
     return None
+
+
+def files_for_range(start, end=None):
+    """
+    Return the buildjson files containing the jobs which ended between start and end.
+
+    start and end are timestamps; end defaults to now.
+    """
+    now = time.time()
+    end = now if end is None else min(end, now)
+
+    filenames = []
+    # UTC days start on multiples of DAY
+    day = start - start % DAY
+    while day <= end:
+        filenames.append(BUILDS_DAY_FILE % utc_day(day))
+        day += DAY
+
+    # The day files might not have the jobs of the last few hours yet
+    if end > now - FOUR_HOURS:
+        filenames.append(BUILDS_4HR_FILE)
+
+    return filenames
+
+
+def _matches(job, buildername, revision, start, end):
+    properties = job.get("properties", {})
+    endtime = job.get("endtime")
+    if endtime is None or endtime < start or (end is not None and endtime > end):
+        return False
+    if buildername and properties.get("buildername") != buildername:
+        return False
+    if revision and (properties.get("revision") or "")[0:12] != revision[0:12]:
+        return False
+    return True
+
+
+def _matching_jobs(args):
+    """
+    Fetch a buildjson file (if needed) and return its jobs matching the criteria.
+
+    It runs in the worker processes of query_jobs(), hence the single argument.
+    """
+    filename, buildername, revision, start, end, use_store = args
+    url = "%s/%s.gz" % (BUILDJSON_DATA, filename)
+    filepath = fetch_file(path_to_file(filename), url, source='buildjson')
+
+    if use_store:
+        return list(buildjson_store.open_store(filepath).iter_jobs(
+            buildername=buildername, revision=revision, start=start, end=end))
+
+    # Only the matching jobs are kept in memory
+    return [job for job in iter_json_items(filepath, 'builds.item')
+            if _matches(job, buildername, revision, start, end)]
+
+
+def _job_key(job):
+    return (job.get("builder_id"), job.get("starttime"),
+            tuple(sorted(buildjson_request_ids(job))))
+
+
+def _imap_bounded(pool, func, args, window):
+    """
+    Like pool.imap() but with no more than `window` results in flight.
+
+    pool.imap() queues every argument at once and keeps the results which have
+    not been consumed yet; a slow consumer would hold all of them in memory.
+    """
+    args = iter(args)
+    pending = collections.deque(pool.apply_async(func, (arg,))
+                                for arg in itertools.islice(args, window))
+    while pending:
+        result = pending.popleft().get()
+        # Keep the workers busy while the caller consumes this result
+        arg = next(args, None)
+        if arg is not None:
+            pending.append(pool.apply_async(func, (arg,)))
+        yield result
+
+
+def query_jobs(start, end=None, buildername=None, revision=None, processes=None):
+    """
+    Yield the jobs which ended between start and end (both inclusive timestamps).
+
+    The jobs can also be filtered by buildername and revision.
+
+    The buildjson files covering the range are fetched and scanned concurrently
+    by a pool of `processes` processes (one per CPU by default). The jobs are
+    yielded one file at a time (oldest day first) as soon as each file has been
+    scanned; no more than `processes` files are scanned ahead of the caller, so
+    only the matching jobs of those files are kept in memory.
+    """
+    args = [(filename, buildername, revision, start, end, USE_STORE)
+            for filename in files_for_range(start, end)]
+    processes = min(processes or multiprocessing.cpu_count(), len(args))
+    LOG.debug("Looking for jobs in %d buildjson files with %d processes." %
+              (len(args), processes))
+
+    pool = None
+    if processes <= 1:
+        results = itertools.imap(_matching_jobs, args)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = _imap_bounded(pool, _matching_jobs, args, processes)
+
+    # builds-4hr.js overlaps with the day files; only recent jobs can be duplicated
+    recent = time.time() - 2 * FOUR_HOURS
+    seen = set()
+    try:
+        for jobs in results:
+            for job in jobs:
+                if job["endtime"] >= recent:
+                    key = _job_key(job)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                yield job
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
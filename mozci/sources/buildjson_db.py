@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+This module keeps a local history of the jobs found in buildjson files.
+
+Every buildjson file is streamed into an indexed SQLite database
+(~/.mozilla/mozci/buildjson.db) so we can answer questions like
+"all jobs of builder X over the last 14 days" without loading 14 day files
+into memory.
+
+The jobs are indexed by request_id, buildername, revision and endtime.
+
+Ingestion is incremental and resumable per buildjson file:
+
+* A file which has not changed on disk since it was ingested is skipped
+* A file which has changed (e.g. today's file or builds-4hr.js) replaces its old jobs
+* Each file is ingested inside of a single transaction; if we are interrupted
+  the file will be ingested from scratch the next time
+"""
+from __future__ import absolute_import
+
+import decimal
+import json
+import logging
+import os
+import sqlite3
+
+from mozci.utils.misc import buildjson_request_ids
+from mozci.utils.transfer import iter_json_items, path_to_file
+
+LOG = logging.getLogger('mozci')
+DB_FILE = path_to_file("buildjson.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    jobs INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL,
+    buildername TEXT,
+    revision TEXT,
+    starttime INTEGER,
+    endtime INTEGER,
+    result INTEGER,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS requests (
+    request_id INTEGER NOT NULL,
+    job_id INTEGER NOT NULL,
+    filename TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_filename ON jobs (filename);
+CREATE INDEX IF NOT EXISTS jobs_buildername ON jobs (buildername, endtime);
+CREATE INDEX IF NOT EXISTS jobs_revision ON jobs (revision);
+CREATE INDEX IF NOT EXISTS jobs_endtime ON jobs (endtime);
+CREATE INDEX IF NOT EXISTS requests_request_id ON requests (request_id);
+CREATE INDEX IF NOT EXISTS requests_filename ON requests (filename);
+"""
+
+
+def _connect():
+    """Return a connection to the database; the schema is created if needed."""
+    conn = sqlite3.connect(DB_FILE, timeout=60)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _json_default(value):
+    # The pure python ijson backend returns Decimal for non-integer numbers
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError("%r is not JSON serializable" % value)
+
+
+def is_ingested(filepath, filename=None):
+    """Return True if the current version of the file on disk is in the database."""
+    filename = filename or os.path.basename(filepath)
+    statinfo = os.stat(filepath)
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT mtime, size FROM files WHERE filename = ?",
+                           (filename,)).fetchone()
+    finally:
+        conn.close()
+
+    return row is not None and row == (int(statinfo.st_mtime), statinfo.st_size)
+
+
+def ingest_file(filepath, filename=None):
+    """
+    Stream the jobs of a buildjson file (gzipped or not) into the database.
+
+    filename is the name under which the jobs are recorded (defaults to the
+    basename of filepath), e.g. builds-2015-02-23.js
+
+    Returns the number of jobs ingested (0 if the file was already up-to-date).
+    """
+    filename = filename or os.path.basename(filepath)
+    if is_ingested(filepath, filename):
+        LOG.debug("%s is already in the job history database." % filename)
+        return 0
+
+    statinfo = os.stat(filepath)
+    LOG.debug("Ingesting %s into %s." % (filepath, DB_FILE))
+    conn = _connect()
+    count = 0
+    try:
+        # Everything in this block is one transaction
+        with conn:
+            conn.execute("DELETE FROM requests WHERE filename = ?", (filename,))
+            conn.execute("DELETE FROM jobs WHERE filename = ?", (filename,))
+
+            for job in iter_json_items(filepath, 'builds.item'):
+                properties = job.get("properties", {})
+                cursor = conn.execute(
+                    "INSERT INTO jobs (filename, buildername, revision, starttime, "
+                    "endtime, result, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (filename,
+                     properties.get("buildername"),
+                     (properties.get("revision") or "")[0:12],
+                     job.get("starttime"),
+                     job.get("endtime"),
+                     job.get("result"),
+                     json.dumps(job, default=_json_default)))
+                conn.executemany(
+                    "INSERT INTO requests (request_id, job_id, filename) VALUES (?, ?, ?)",
+                    [(request_id, cursor.lastrowid, filename)
+                     for request_id in buildjson_request_ids(job)])
+                count += 1
+
+            conn.execute(
+                "INSERT OR REPLACE INTO files (filename, mtime, size, jobs) VALUES (?, ?, ?, ?)",
+                (filename, int(statinfo.st_mtime), statinfo.st_size, count))
+    finally:
+        conn.close()
+
+    LOG.debug("We have ingested %d jobs from %s." % (count, filename))
+    return count
+
+
+def query_job(request_id, filename=None):
+    """
+    Return the job associated to request_id or None if we don't know about it.
+
+    If filename is specified we only look at the jobs coming from that buildjson file.
+    """
+    query = "SELECT jobs.data FROM requests JOIN jobs ON requests.job_id = jobs.id " \
+            "WHERE requests.request_id = ?"
+    params = [request_id]
+    if filename:
+        query += " AND requests.filename = ?"
+        params.append(filename)
+
+    conn = _connect()
+    try:
+        row = conn.execute(query, params).fetchone()
+    finally:
+        conn.close()
+
+    if row is None:
+        return None
+    return json.loads(row[0])
+
+
+def query_jobs(buildername=None, revision=None, start=None, end=None, filename=None):
+    """
+    Yield all jobs matching the criteria ordered by endtime.
+
+    start and end are timestamps (seconds since the epoch) compared against
+    the endtime of the jobs; both are inclusive.
+
+    NOTE: builds-4hr.js overlaps with the day files; if both have been ingested
+    the same job can be returned twice unless filename is specified.
+    """
+    conditions = []
+    params = []
+    if buildername:
+        conditions.append("buildername = ?")
+        params.append(buildername)
+    if revision:
+        conditions.append("revision = ?")
+        params.append(revision[0:12])
+    if start is not None:
+        conditions.append("endtime >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("endtime <= ?")
+        params.append(end)
+    if filename:
+        conditions.append("filename = ?")
+        params.append(filename)
+
+    query = "SELECT data FROM jobs"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY endtime"
+
+    conn = _connect()
+    try:
+        for row in conn.execute(query, params):
+            yield json.loads(row[0])
+    finally:
+        conn.close()
+
+
+def ingested_files():
+    """Return a dictionary mapping every ingested filename to its number of jobs."""
+    conn = _connect()
+    try:
+        return dict(conn.execute("SELECT filename, jobs FROM files").fetchall())
+    finally:
+        conn.close()
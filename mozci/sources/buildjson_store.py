@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+"""
+This module keeps buildjson files in a read-only format which can be memory-mapped.
+
+Parsing a buildjson day file takes a lot of time and memory, and every process
+using mozci (e.g. the workers of a pool) used to keep its own parsed copy of the
+same files. Instead, a buildjson file can be compiled once into a store file
+(builds-2015-02-23.js.store) which all processes map into memory; the operating
+system keeps a single copy of it in its page cache.
+
+A store file is made of:
+
+* A header (HEADER) with the size and mtime of the buildjson file it comes from
+* One fixed-width record per job (RECORD) with the fields we filter on
+  (starttime, endtime, result, buildername and revision) and where to find
+  the json representation of the job
+* An index of request ids sorted by request_id (REQUEST) to find jobs with a
+  binary search
+* A string table with the buildernames, the revisions and the json of the jobs
+
+Lookups read the records straight from the mapping; only the jobs returned
+are deserialized.
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+
+from mozci.sources.buildjson_db import _json_default
+from mozci.utils import instrumentation, json_backend, locking
+from mozci.utils.concurrency import SingleFlight
+from mozci.utils.misc import buildjson_request_ids
+from mozci.utils.transfer import iter_json_items
+
+LOG = logging.getLogger('mozci')
+MAGIC = 'MOZCIBJS'
+VERSION = 1
+# magic, version, source mtime, source size, jobs, requests, strings offset, strings length
+HEADER = struct.Struct('<8sHdQQQQQ')
+# starttime, endtime, result, buildername (offset, length), revision (offset, length),
+# json (offset, length); missing numbers are stored as -1
+RECORD = struct.Struct('<qqiQHQHQI')
+# request_id, index of the job
+REQUEST = struct.Struct('<qI')
+
+# store path -> BuildjsonStore opened by this process
+STORES = {}
+_LOCK = threading.Lock()
+# Threads asking for a store which is being opened (or compiled) wait for it
+_OPENING = SingleFlight('BUILDJSON_STORES')
+
+
+def store_path(filepath):
+    return filepath + '.store'
+
+
+def _number(value):
+    return -1 if value is None else int(value)
+
+
+def compile_file(filepath, path=None):
+    """
+    Compile a buildjson file (gzipped or not) into a store file.
+
+    The jobs are streamed from the buildjson file, so only their records are
+    kept in memory. The store file is published atomically.
+
+    Returns the path to the store file.
+    """
+    path = path or store_path(filepath)
+    statinfo = os.stat(filepath)
+    LOG.debug("Compiling %s into %s." % (filepath, path))
+
+    records = []
+    requests = []
+    # Strings which appear many times (buildernames, revisions) are stored once
+    known_strings = {}
+    strings = tempfile.TemporaryFile()
+    strings_length = [0]
+
+    def _add_string(value, dedup=False):
+        if dedup and value in known_strings:
+            return known_strings[value]
+        offset = strings_length[0]
+        strings.write(value)
+        strings_length[0] += len(value)
+        if dedup:
+            known_strings[value] = (offset, len(value))
+        return offset, len(value)
+
+    with instrumentation.timer('compile.buildjson_store'):
+        for job in iter_json_items(filepath, 'builds.item'):
+            properties = job.get("properties", {})
+            buildername = (properties.get("buildername") or "").encode('utf-8')
+            revision = (properties.get("revision") or "")[0:12].encode('utf-8')
+            data = json.dumps(job, default=_json_default)
+
+            for request_id in buildjson_request_ids(job):
+                requests.append((request_id, len(records)))
+
+            records.append(
+                (_number(job.get("starttime")), _number(job.get("endtime")),
+                 _number(job.get("result"))) +
+                _add_string(buildername, dedup=True) +
+                _add_string(revision, dedup=True) +
+                _add_string(data))
+
+        requests.sort()
+        strings_offset = HEADER.size + RECORD.size * len(records) + REQUEST.size * len(requests)
+
+        tmp_path = locking.temp_path(path)
+        try:
+            with open(tmp_path, 'wb') as fd:
+                fd.write(HEADER.pack(MAGIC, VERSION, statinfo.st_mtime, statinfo.st_size,
+                                     len(records), len(requests), strings_offset,
+                                     strings_length[0]))
+                for record in records:
+                    fd.write(RECORD.pack(*record))
+                for request in requests:
+                    fd.write(REQUEST.pack(*request))
+                strings.seek(0)
+                shutil.copyfileobj(strings, fd)
+            locking.publish(tmp_path, path)
+        finally:
+            locking.discard(tmp_path)
+            strings.close()
+
+    LOG.debug("We have compiled %d jobs from %s." % (len(records), filepath))
+    return path
+
+
+class BuildjsonStore(object):
+    """
+    Read-only view of a store file.
+
+    Usage::
+
+        store = BuildjsonStore(path)
+        job = store.find_request(request_id)
+        for job in store.iter_jobs(buildername=buildername, start=start, end=end):
+            ...
+        store.close()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fd:
+            # The mapping stays valid after closing the file (or after the file
+            # is replaced by a newer version)
+            self._map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.source_mtime, self.source_size, self.jobs, self.requests,
+         self._strings_offset, _) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("%s is not a buildjson store (version %d)." % (path, VERSION))
+        self._requests_offset = HEADER.size + RECORD.size * self.jobs
+
+    def __len__(self):
+        return self.jobs
+
+    def close(self):
+        self._map.close()
+
+    def is_current(self, filepath):
+        """Return True if the store has been compiled from the current version of filepath."""
+        statinfo = os.stat(filepath)
+        return (self.source_mtime, self.source_size) == (statinfo.st_mtime, statinfo.st_size)
+
+    def _record(self, index):
+        return RECORD.unpack_from(self._map, HEADER.size + RECORD.size * index)
+
+    def _string(self, offset, length):
+        start = self._strings_offset + offset
+        return self._map[start:start + length]
+
+    def job(self, index):
+        """Return the job stored at index."""
+        record = self._record(index)
+        return json_backend.loads(self._string(record[7], record[8]))
+
+    def find_request(self, request_id):
+        """Return the job associated to request_id or None."""
+        low, high = 0, self.requests
+        while low < high:
+            middle = (low + high) // 2
+            value, _ = REQUEST.unpack_from(self._map,
+                                           self._requests_offset + REQUEST.size * middle)
+            if value < request_id:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self.requests:
+            value, index = REQUEST.unpack_from(self._map,
+                                               self._requests_offset + REQUEST.size * low)
+            if value == request_id:
+                return self.job(index)
+        return None
+
+    def iter_jobs(self, buildername=None, revision=None, start=None, end=None):
+        """
+        Yield the jobs matching the criteria in the order of the buildjson file.
+
+        start and end are timestamps compared against the endtime of the jobs;
+        both are inclusive.
+        """
+        buildername = buildername.encode('utf-8') if buildername else None
+        revision = revision[0:12].encode('utf-8') if revision else None
+
+        for index in xrange(self.jobs):
+            (_, endtime, _, builder_offset, builder_length, revision_offset,
+             revision_length, data_offset, data_length) = self._record(index)
+            if start is not None and endtime < start:
+                continue
+            if end is not None and endtime > end:
+                continue
+            if buildername is not None and (
+                    builder_length != len(buildername) or
+                    self._string(builder_offset, builder_length) != buildername):
+                continue
+            if revision is not None and (
+                    revision_length != len(revision) or
+                    self._string(revision_offset, revision_length) != revision):
+                continue
+            yield json_backend.loads(self._string(data_offset, data_length))
+
+
+def open_store(filepath):
+    """
+    Return the store of a buildjson file; it is compiled if needed.
+
+    The store is shared by all the threads of this process, and its pages with
+    all the processes which have it open. Threads asking for a store which is
+    being compiled wait for it; the others are not held up.
+    """
+    path = store_path(filepath)
+    with _LOCK:
+        store = STORES.get(path)
+    if store is not None and store.is_current(filepath):
+        instrumentation.cache_hit('BUILDJSON_STORES')
+        return store
+
+    instrumentation.cache_miss('BUILDJSON_STORES')
+    return _OPENING.do(path, _open_store, path, filepath)
+
+
+def _open_store(path, filepath):
+    # The store might have been opened since we looked at STORES
+    with _LOCK:
+        store = STORES.get(path)
+    if store is not None and store.is_current(filepath):
+        return store
+
+    # An outdated store is not closed since other threads might be reading it;
+    # its mapping goes away with the last reference to it
+
+    # Only one process compiles the file; the others use its store
+    with locking.FileLock(path):
+        store = _open_current(path, filepath)
+        if store is None:
+            compile_file(filepath, path)
+            store = BuildjsonStore(path)
+
+    with _LOCK:
+        STORES[path] = store
+    return store
+
+
+def _open_current(path, filepath):
+    """Return the store at path if it has been compiled from the current filepath."""
+    if not os.path.exists(path):
+        return None
+
+    try:
+        store = BuildjsonStore(path)
+    except (ValueError, struct.error, EnvironmentError), e:
+        LOG.debug("We are going to compile %s again: %s" % (path, e))
+        return None
+
+    if store.is_current(filepath):
+        return store
+
+    store.close()
+    return None
@@ -19,14 +19,30 @@ Important notes from the pushlog documentation::
 """
 import logging
 
-import requests
-
 from mozci.errors import PushlogError
+from mozci.utils import instrumentation, transport
+from mozci.utils.concurrency import SingleFlight
 
 
 LOG = logging.getLogger('mozci')
 JSON_PUSHES = "%(repo_url)s/json-pushes"
 VALID_CACHE = {}
+# Threads making the same query at the same time share its result
+_QUERYING = SingleFlight('pushlog')
+
+
+def _query(url):
+    """
+    Return the json data of a json-pushes query.
+
+    Concurrent identical queries make a single request; the data returned is shared
+    between them and must not be modified.
+    """
+    def _get_json():
+        LOG.debug("About to fetch %s" % url)
+        return transport.get(url, source='pushlog').json()
+
+    return _QUERYING.do(url, _get_json)
 
 
 def query_revisions_range(repo_url, from_revision, to_revision, version=2, tipsonly=1):
@@ -46,9 +62,7 @@ def query_revisions_range(repo_url, from_revision, to_revision, version=2, tipso
         version,
         tipsonly
     )
-    LOG.debug("About to fetch %s" % url)
-    req = requests.get(url)
-    pushes = req.json()["pushes"]
+    pushes = _query(url)["pushes"]
     # json-pushes does not include the starting revision
     revisions.append(from_revision)
     for push_id in sorted(pushes.keys()):
@@ -76,9 +90,7 @@ def query_pushid_range(repo_url, start_id, end_id, version=2):
         end_id,
         version
     )
-    LOG.debug("About to fetch %s" % url)
-    req = requests.get(url)
-    pushes = req.json()["pushes"]
+    pushes = _query(url)["pushes"]
     # pushes.keys() is a list of strings which we need to map to integers
     # We use reverse in order to return list sorted from newest to oldest push id
     for push_id in sorted(map(int, pushes.keys()), reverse=True):
@@ -120,12 +132,11 @@ def query_revision_info(repo_url, revision, full=False):
     url = "%s?changeset=%s&tipsonly=1" % (JSON_PUSHES % {"repo_url": repo_url}, revision)
     if full:
         url += "&full=1"
-    LOG.debug("About to fetch %s" % url)
-    req = requests.get(url)
-    data = req.json()
+    data = _query(url)
     assert len(data) == 1, "We should only have information about one push"
-    push_id, push_info = data.popitem()
-    push_info["pushid"] = push_id
+    push_id, push_info = data.items()[0]
+    # The data might be shared with other threads
+    push_info = dict(push_info, pushid=push_id)
     if not full:
         LOG.debug("Push info: %s" % str(push_info))
     else:
@@ -137,7 +148,7 @@ def query_revision_info(repo_url, revision, full=False):
 def query_repo_tip(repo_url):
     """Return the tip of a branch."""
     url = "%s?tipsonly=1" % (JSON_PUSHES % {"repo_url": repo_url})
-    recent_commits = requests.get(url).json()
+    recent_commits = _query(url)
     tip_id = sorted(map(int, recent_commits.keys()))[-1]
     return recent_commits[str(tip_id)]["changesets"][0][:12]
 
@@ -147,14 +158,17 @@ def valid_revision(repo_url, revision):
 
     global VALID_CACHE
     if (repo_url, revision) in VALID_CACHE:
+        instrumentation.cache_hit('VALID_CACHE')
         return VALID_CACHE[(repo_url, revision)]
 
+    instrumentation.cache_miss('VALID_CACHE')
+
     LOG.debug("Determine if the revision is valid.")
     url = "%s?changeset=%s&tipsonly=1" % (
         JSON_PUSHES % {"repo_url": repo_url},
         revision
     )
-    data = requests.get(url).json()
+    data = _query(url)
     ret = True
 
     # A valid revision will return a dictionary with information about exactly one revision
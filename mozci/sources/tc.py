@@ -10,12 +10,17 @@ import logging
 import os
 import traceback
 
+import requests
 import taskcluster as taskcluster_client
+from taskcluster import utils as taskcluster_utils
+from taskcluster.exceptions import TaskclusterConnectionError
 from taskcluster.utils import slugId, fromNow
 
 from mozci.errors import TaskClusterError
 from mozci.sources.buildapi import query_repo_url
 from mozci.sources.pushlog import query_revision_info
+from mozci.utils import instrumentation, transport
+from mozci.utils.concurrency import map_concurrently
 
 
 LOG = logging.getLogger('mozci')
@@ -23,6 +28,15 @@ METADATA = None
 TC_TOOLS_HOST = 'https://tools.taskcluster.net'
 TC_TASK_INSPECTOR = "%s/task-inspector/#" % TC_TOOLS_HOST
 TC_TASK_GRAPH_INSPECTOR = "%s/task-graph-inspector/#" % TC_TOOLS_HOST
+# Options of the Queue and Scheduler clients (e.g. {'baseUrl': ...} to talk to other services)
+QUEUE_OPTIONS = {}
+SCHEDULER_OPTIONS = {}
+_QUEUE = None
+_SCHEDULER = None
+# retrigger_tasks() fetches and schedules this many tasks at once
+RETRIGGER_MAX_WORKERS = 8
+# Task states which can still be cancelled
+ACTIVE_STATES = ('unscheduled', 'pending', 'running')
 
 
 def credentials_available():
@@ -54,6 +68,69 @@ def handle_auth_failure(e):
                   "TASKCLUSTER_ACCESS_TOKEN")
 
 
+class _SessionClientMixin(object):
+    """
+    Make the requests of a taskcluster client through its requests session.
+
+    The clients create a session but make their requests without it (see
+    taskcluster.sync.syncclient); we use it so the requests go through the
+    cassettes of mozci.utils.transport (see transport.mount()).
+    """
+
+    def _makeHttpRequest(self, method, url, payload, headers):
+        try:
+            response = taskcluster_utils.makeSingleHttpRequest(method, url, payload, headers,
+                                                               session=self.session)
+        except requests.exceptions.RequestException as e:
+            raise TaskclusterConnectionError("Failed to establish connection", superExc=e)
+
+        try:
+            response.raise_for_status()
+            if response.status_code == 204:
+                return None
+        except requests.exceptions.RequestException as e:
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+            self._raiseHttpError(response.status_code, data, e)
+
+        try:
+            return response.json()
+        except ValueError:
+            return {"response": response}
+
+
+class _Queue(_SessionClientMixin, taskcluster_client.Queue):
+    pass
+
+
+class _Scheduler(_SessionClientMixin, taskcluster_client.Scheduler):
+    pass
+
+
+def _create_client(cls, options):
+    client = cls(options)
+    client.session = transport.mount(getattr(client, 'session', None) or requests.Session())
+    return client
+
+
+def get_queue():
+    """Return the Queue client shared by this process (it keeps its connections open)."""
+    global _QUEUE
+    if _QUEUE is None:
+        _QUEUE = _create_client(_Queue, QUEUE_OPTIONS)
+    return _QUEUE
+
+
+def get_scheduler():
+    """Return the Scheduler client shared by this process."""
+    global _SCHEDULER
+    if _SCHEDULER is None:
+        _SCHEDULER = _create_client(_Scheduler, SCHEDULER_OPTIONS)
+    return _SCHEDULER
+
+
 def _query_metadata(repo_name, revision, name, description=None):
     global METADATA
 
@@ -79,18 +156,46 @@ def _query_metadata(repo_name, revision, name, description=None):
 def get_task(task_id):
     """ Returns task information for given task id.
     """
-    queue = taskcluster_client.Queue()
-    task = queue.task(task_id)
+    with instrumentation.timed_request('taskcluster'):
+        task = get_queue().task(task_id)
     LOG.debug("Original task: (Limit 1024 char)")
     LOG.debug(str(json.dumps(task))[:1024])
     return task
 
 
+def list_task_group(task_group_id):
+    """Return the tasks of a task group; each one is a dictionary with 'status' and 'task'."""
+    queue = get_queue()
+    tasks = []
+    options = {}
+    while True:
+        with instrumentation.timed_request('taskcluster'):
+            response = queue.listTaskGroup(task_group_id, options=options)
+        tasks.extend(response['tasks'])
+        if not response.get('continuationToken'):
+            return tasks
+        options = {'continuationToken': response['continuationToken']}
+
+
+def cancel_task(task_id, dry_run=False):
+    """Cancel a task which has not finished yet; returns its new status (None on dry_run)."""
+    if dry_run:
+        LOG.info("DRY-RUN: We would cancel %s%s" % (TC_TASK_INSPECTOR, task_id))
+        return None
+
+    try:
+        with instrumentation.timed_request('taskcluster'):
+            return get_queue().cancelTask(task_id)['status']
+    except taskcluster_client.exceptions.TaskclusterAuthFailure as e:
+        handle_auth_failure(e)
+        raise
+
+
 def get_task_graph_status(task_graph_id):
     """ Returns state of a Task-Graph Status Response
     """
-    scheduler = taskcluster_client.Scheduler()
-    response = scheduler.status(task_graph_id)
+    with instrumentation.timed_request('taskcluster'):
+        response = get_scheduler().status(task_graph_id)
     return response['status']['state']
 
 
@@ -136,13 +241,11 @@ def create_task(repo_name, revision, **kwargs):
     return task_definition
 
 
-def _recreate_task(task_id):
+def _recreate_task(task_id, task=None):
+    """Return a copy of a task (fetched unless given) with a new id and fresh timestamps."""
     one_year = 365
-    queue = taskcluster_client.Queue()
-    task = queue.task(task_id)
-
-    LOG.debug("Original task: (Limit 1024 char)")
-    LOG.debug(str(json.dumps(task))[:1024])
+    if task is None:
+        task = get_task(task_id)
 
     # Start updating the task
     task['taskId'] = taskcluster_client.slugId()
@@ -215,6 +318,73 @@ def retrigger_task(task_id, dry_run=False):
     return results
 
 
+def _fetch_task(task_id):
+    try:
+        return get_task(task_id)
+    except taskcluster_client.exceptions.TaskclusterRestFailure, e:
+        LOG.warning("We could not fetch task %s: %s" % (task_id, e))
+    except taskcluster_client.exceptions.TaskclusterAuthFailure, e:
+        handle_auth_failure(e)
+    return None
+
+
+def retrigger_tasks(task_ids, dry_run=False, single_graph=True,
+                    max_workers=RETRIGGER_MAX_WORKERS):
+    """ Retrigger many tasks; see retrigger_task.
+
+    The tasks are fetched concurrently through the shared Queue client. With
+    single_graph, the new tasks are scheduled in a single graph; otherwise
+    every task gets its own graph (as retrigger_task does) and the graphs are
+    scheduled concurrently.
+
+    returns - None if there are no credentials, otherwise a dictionary which
+              maps every task id to the id of its new task (None if we could
+              not fetch or schedule it). Nothing is scheduled on dry_run, so
+              every task maps to None.
+    """
+    if not credentials_available():
+        return None
+
+    task_ids = sorted(set(task_ids))
+    tasks = map_concurrently(_fetch_task, task_ids, max_workers=max_workers)
+    new_tasks = {}
+    for task_id, task in zip(task_ids, tasks):
+        if task is not None:
+            new_tasks[task_id] = _recreate_task(task_id, task)
+    LOG.info("We are going to retrigger %d of %d task(s)." % (len(new_tasks), len(task_ids)))
+
+    results = dict((task_id, None) for task_id in task_ids)
+    if not new_tasks:
+        return results
+
+    def _schedule(tasks, metadata):
+        task_graph = generate_task_graph(scopes=[], tasks=tasks, metadata=metadata)
+        try:
+            # schedule_graph() returns None on dry_run or if we are not allowed to schedule it
+            return schedule_graph(task_graph, dry_run=dry_run) is not None
+        except taskcluster_client.exceptions.TaskclusterRestFailure, e:
+            LOG.warning("We could not schedule the graph of %d task(s): %s" % (len(tasks), e))
+        except taskcluster_client.exceptions.TaskclusterAuthFailure, e:
+            handle_auth_failure(e)
+        return False
+
+    if single_graph:
+        tasks = [new_tasks[task_id] for task_id in sorted(new_tasks)]
+        metadata = dict(tasks[0]['metadata'],
+                        name='Retrigger of %d task(s)' % len(tasks),
+                        description='Retrigger of %s' % ', '.join(sorted(new_tasks)))
+        scheduled = [_schedule(tasks, metadata)] * len(tasks)
+    else:
+        scheduled = map_concurrently(
+            lambda task_id: _schedule([new_tasks[task_id]], new_tasks[task_id]['metadata']),
+            sorted(new_tasks), max_workers=max_workers)
+
+    for task_id, ok in zip(sorted(new_tasks), scheduled):
+        if ok:
+            results[task_id] = new_tasks[task_id]['taskId']
+    return results
+
+
 def schedule_graph(task_graph, task_graph_id=None, dry_run=False):
     """ It schedules a TaskCluster graph and returns its id.
 
@@ -231,7 +401,7 @@ def schedule_graph(task_graph, task_graph_id=None, dry_run=False):
     """
     if not task_graph_id:
         task_graph_id = taskcluster_client.slugId()
-    scheduler = taskcluster_client.Scheduler()
+    scheduler = get_scheduler()
 
     # We print to stdout instead of using the standard logging with dates and info levels
     # XXX: Use a different formatter for other tools to work better with this code
@@ -243,7 +413,8 @@ def schedule_graph(task_graph, task_graph_id=None, dry_run=False):
             return None
 
         try:
-            result = scheduler.createTaskGraph(task_graph_id, task_graph)
+            with instrumentation.timed_request('taskcluster'):
+                result = scheduler.createTaskGraph(task_graph_id, task_graph)
             LOG.info("See the graph in %s%s" % (TC_TASK_GRAPH_INSPECTOR, task_graph_id))
             return result
         except taskcluster_client.exceptions.TaskclusterAuthFailure as e:
@@ -264,7 +435,7 @@ def extend_task_graph(task_graph_id, task_graph, dry_run=False):
     returns Task-Graph Status Response
     """
     # XXX: handle the case when the task-graph is not running
-    scheduler = taskcluster_client.Scheduler()
+    scheduler = get_scheduler()
     if dry_run:
         LOG.info("DRY-RUN: We have not extended the graph.")
     else:
@@ -272,7 +443,8 @@ def extend_task_graph(task_graph_id, task_graph, dry_run=False):
         del task_graph['metadata']
         del task_graph['scopes']
         print(json.dumps(task_graph, indent=4))
-        return scheduler.extendTaskGraph(task_graph_id, task_graph)
+        with instrumentation.timed_request('taskcluster'):
+            return scheduler.extendTaskGraph(task_graph_id, task_graph)
 
 
 def generate_task_graph(scopes, tasks, repo_name=None, revision=None,
@@ -0,0 +1,210 @@
+#! /usr/bin/env python
+"""
+This module keeps the size of the files cached in ~/.mozilla/mozci under a budget.
+
+The cached files (buildjson day files, allthethings.json, repositories.txt) are
+tracked in a small metadata file (cache_metadata.json) with their size and the
+last time we used them. Once the cache goes over MAX_SIZE bytes the least recently
+used files are removed until it is back under LOW_WATERMARK of the budget.
+
+Recording that a file was used (touch()) only updates a dictionary in memory;
+it is merged into the metadata file when the process exits (or evicts). The
+directory is only scanned by evict(), which maybe_evict() runs in a background
+thread at most once every EVICTION_INTERVAL seconds.
+"""
+from __future__ import absolute_import
+
+import atexit
+import fnmatch
+import json
+import logging
+import os
+import threading
+import time
+
+from mozci.utils.locking import FileLock
+
+LOG = logging.getLogger('mozci')
+METADATA_FILE = 'cache_metadata.json'
+# Total size (in bytes) the cached files can use
+MAX_SIZE = 4 * 1024 ** 3
+# When evicting, we go down to this fraction of MAX_SIZE so we don't evict on every run
+LOW_WATERMARK = 0.8
+EVICTION_INTERVAL = 10 * 60
+# Files we are allowed to evict; anything else (credentials, databases, logs) is left alone
+MANAGED_FILES = ('builds-*', 'allthethings.json', 'repositories.txt')
+
+_LOCK = threading.Lock()
+# filename -> last time it was used (not yet written to the metadata file)
+ACCESSES = {}
+_FLUSH_REGISTERED = False
+_EVICTION_THREAD = None
+# Last time this process looked at the metadata file from maybe_evict()
+_LAST_CHECK = 0
+
+
+def _cache_dir():
+    return os.path.expanduser('~/.mozilla/mozci/')
+
+
+def is_managed(filename):
+    # Downloads in progress and lock files (see mozci.utils.locking) are not cached data
+    if filename.endswith('.tmp') or filename.endswith('.lock'):
+        return False
+    return any(fnmatch.fnmatch(filename, pattern) for pattern in MANAGED_FILES)
+
+
+def touch(filepath):
+    """Record that a cached file has been used."""
+    global _FLUSH_REGISTERED
+
+    filename = os.path.basename(filepath)
+    if is_managed(filename):
+        with _LOCK:
+            ACCESSES[filename] = time.time()
+            if not _FLUSH_REGISTERED:
+                atexit.register(_flush_quietly)
+                _FLUSH_REGISTERED = True
+
+
+def _metadata_path():
+    return os.path.join(_cache_dir(), METADATA_FILE)
+
+
+def _take_accesses():
+    with _LOCK:
+        accesses = dict(ACCESSES)
+        ACCESSES.clear()
+    return accesses
+
+
+def _merge_accesses(metadata, accesses):
+    for filename, last_access in accesses.iteritems():
+        entry = metadata['files'].setdefault(filename, {})
+        entry['last_access'] = max(last_access, entry.get('last_access', 0))
+
+
+def flush_accesses():
+    """Merge the files used by this process into the metadata file."""
+    accesses = _take_accesses()
+    if not accesses:
+        return
+
+    with FileLock(_metadata_path()):
+        metadata = load_metadata()
+        _merge_accesses(metadata, accesses)
+        _save_metadata(metadata)
+
+
+def _flush_quietly():
+    try:
+        flush_accesses()
+    except Exception, e:
+        LOG.debug("We could not record the use of the cached files: %s" % e)
+
+
+def load_metadata():
+    filepath = _metadata_path()
+    try:
+        with open(filepath) as fd:
+            return json.load(fd)
+    except (IOError, ValueError):
+        # The metadata is only a hint; we rebuild it from the directory
+        return {'last_eviction': 0, 'files': {}}
+
+
+def _save_metadata(metadata):
+    filepath = _metadata_path()
+    tmp_path = '%s.%d.tmp' % (filepath, os.getpid())
+    with open(tmp_path, 'w') as fd:
+        json.dump(metadata, fd)
+    os.rename(tmp_path, filepath)
+
+
+def evict(max_size=None):
+    """
+    Remove the least recently used files until the cache fits in max_size (MAX_SIZE).
+
+    Returns the list of files removed.
+    """
+    max_size = MAX_SIZE if max_size is None else max_size
+    # Other processes merge their accesses into the metadata file at exit
+    with FileLock(_metadata_path()):
+        return _evict(max_size)
+
+
+def _evict(max_size):
+    path = _cache_dir()
+    metadata = load_metadata()
+    _merge_accesses(metadata, _take_accesses())
+
+    files = {}
+    for filename in os.listdir(path):
+        if not is_managed(filename):
+            continue
+        try:
+            statinfo = os.stat(os.path.join(path, filename))
+        except OSError:
+            # Removed by another process
+            continue
+        known = metadata['files'].get(filename, {})
+        files[filename] = {
+            'size': statinfo.st_size,
+            'last_access': known.get('last_access', statinfo.st_mtime),
+        }
+
+    removed = []
+    total = sum(entry['size'] for entry in files.itervalues())
+    if total > max_size:
+        target = max_size * LOW_WATERMARK
+        for filename in sorted(files, key=lambda f: files[f]['last_access']):
+            if total <= target:
+                break
+            LOG.debug("Evicting %s from the cache (%d bytes)." %
+                      (filename, files[filename]['size']))
+            try:
+                os.remove(os.path.join(path, filename))
+            except OSError:
+                pass
+            total -= files.pop(filename)['size']
+            removed.append(filename)
+        LOG.info("We have evicted %d file(s) from %s; it now uses %d MB." %
+                 (len(removed), path, total / 1024 ** 2))
+
+    _save_metadata({'last_eviction': time.time(), 'files': files})
+    return removed
+
+
+def maybe_evict(background=True):
+    """
+    Run evict() if it has not run in the last EVICTION_INTERVAL seconds.
+
+    By default it runs in a background thread so it does not delay the caller.
+    """
+    global _EVICTION_THREAD, _LAST_CHECK
+
+    now = time.time()
+    if now - _LAST_CHECK < EVICTION_INTERVAL:
+        return None
+    _LAST_CHECK = now
+
+    if now - load_metadata().get('last_eviction', 0) < EVICTION_INTERVAL:
+        return None
+
+    if not background:
+        return evict()
+
+    with _LOCK:
+        if _EVICTION_THREAD is not None and _EVICTION_THREAD.is_alive():
+            return None
+        _EVICTION_THREAD = threading.Thread(target=_evict_quietly, name='mozci-cache-eviction')
+        _EVICTION_THREAD.daemon = True
+        _EVICTION_THREAD.start()
+    return _EVICTION_THREAD
+
+
+def _evict_quietly():
+    try:
+        evict()
+    except Exception, e:
+        LOG.debug("We could not evict files from the cache: %s" % e)
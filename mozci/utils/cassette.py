@@ -0,0 +1,213 @@
+#! /usr/bin/env python
+"""
+This module stores HTTP sessions on disk so they can be replayed offline.
+
+A cassette is a directory with:
+
+* index.json.gz - every interaction (method, url, request body hash, status code,
+  headers, latency and either the body or a reference to it)
+* bodies/<sha1> - bodies larger than INLINE_LIMIT stored by content; a body fetched
+  many times (e.g. builds-4hr.js.gz) is only stored once. Bodies which are not
+  gzipped already are stored gzipped (bodies/<sha1>.gz)
+
+When replaying, the interactions of a request are returned in the order they were
+recorded (the last one is repeated if the request is made more often).
+Replaying can add latency to every response: either a fixed number of seconds or
+the latency observed while recording ('recorded').
+
+See mozci.utils.transport to record or replay the requests made by mozci.
+"""
+from __future__ import absolute_import
+
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from requests.structures import CaseInsensitiveDict
+
+from mozci.errors import CassetteError
+
+LOG = logging.getLogger('mozci')
+INDEX_FILE = 'index.json.gz'
+BODIES_DIR = 'bodies'
+# Bodies larger than this many bytes are stored in their own file
+INLINE_LIMIT = 16 * 1024
+# We do not want to store cookies; the body we store is already decoded
+SKIPPED_HEADERS = ('set-cookie', 'www-authenticate', 'content-encoding', 'transfer-encoding')
+
+
+def _sha1(content):
+    return hashlib.sha1(content or '').hexdigest()
+
+
+def request_key(method, url, body=None):
+    """Return the key identifying a request inside of a cassette."""
+    return _key(method, url, _sha1(body))
+
+
+def _key(method, url, body_sha1):
+    return '%s %s %s' % (method.upper(), url, body_sha1)
+
+
+class Cassette(object):
+    """Interactions recorded (or to be replayed) from a directory on disk."""
+
+    def __init__(self, path, latency=None):
+        self.path = os.path.expanduser(path)
+        self.latency = latency
+        self.interactions = {}
+        self._replayed = {}
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.path, INDEX_FILE)
+
+    def load(self):
+        """Load the index of the cassette; raises CassetteError if it does not exist."""
+        if not os.path.exists(self.index_path):
+            raise CassetteError("There is no cassette in %s." % self.path)
+
+        fd = gzip.open(self.index_path, 'rb')
+        try:
+            data = json.load(fd)
+        finally:
+            fd.close()
+
+        self.interactions = {}
+        for interaction in data['interactions']:
+            key = _key(interaction['method'], interaction['url'], interaction['request_sha1'])
+            self.interactions.setdefault(key, []).append(interaction)
+        LOG.debug("Loaded %d interactions from %s." % (len(data['interactions']), self.path))
+        return self
+
+    def save(self):
+        """Write the index of the cassette (the bodies are written as we record)."""
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        with self._lock:
+            interactions = [i for key in sorted(self.interactions)
+                            for i in self.interactions[key]]
+        tmp_path = self.index_path + '.tmp'
+        fd = gzip.open(tmp_path, 'wb')
+        try:
+            json.dump({'version': 1, 'interactions': interactions}, fd)
+        finally:
+            fd.close()
+        os.rename(tmp_path, self.index_path)
+        LOG.info("We have stored %d interactions in %s." % (len(interactions), self.path))
+
+    def _store_body(self, content):
+        """Return the fields describing content inside of an interaction."""
+        if len(content) <= INLINE_LIMIT:
+            try:
+                return {'body': content.decode('utf-8')}
+            except UnicodeDecodeError:
+                return {'body_base64': base64.b64encode(content)}
+
+        digest = _sha1(content)
+        bodies_dir = os.path.join(self.path, BODIES_DIR)
+        if not os.path.exists(bodies_dir):
+            os.makedirs(bodies_dir)
+
+        if content[:2] == '\037\213':  # Already gzipped
+            filename = digest
+        else:
+            filename = digest + '.gz'
+        filepath = os.path.join(bodies_dir, filename)
+
+        if not os.path.exists(filepath):
+            tmp_path = '%s.%d.tmp' % (filepath, threading.current_thread().ident)
+            if filename.endswith('.gz'):
+                fd = gzip.open(tmp_path, 'wb')
+            else:
+                fd = open(tmp_path, 'wb')
+            try:
+                fd.write(content)
+            finally:
+                fd.close()
+            os.rename(tmp_path, filepath)
+
+        return {'body_file': filename}
+
+    def _load_body(self, interaction):
+        if 'body' in interaction:
+            return interaction['body'].encode('utf-8')
+        if 'body_base64' in interaction:
+            return base64.b64decode(interaction['body_base64'])
+
+        filepath = os.path.join(self.path, BODIES_DIR, interaction['body_file'])
+        fd = gzip.open(filepath, 'rb') if filepath.endswith('.gz') else open(filepath, 'rb')
+        try:
+            return fd.read()
+        finally:
+            fd.close()
+
+    def record(self, method, url, body, response, elapsed):
+        """Store the response received for a request."""
+        content = response.content or ''
+        interaction = {
+            'method': method.upper(),
+            'url': url,
+            'request_sha1': _sha1(body),
+            'status_code': response.status_code,
+            'reason': response.reason,
+            'headers': dict((k, v) for k, v in response.headers.items()
+                            if k.lower() not in SKIPPED_HEADERS),
+            'elapsed': round(elapsed, 4),
+        }
+        if method.upper() != 'HEAD':
+            interaction['headers']['Content-Length'] = str(len(content))
+        interaction.update(self._store_body(content))
+
+        with self._lock:
+            self.interactions.setdefault(request_key(method, url, body), []).append(interaction)
+
+    def play(self, method, url, body=None, conditional=False):
+        """
+        Return a requests.Response with the recorded response to a request.
+
+        conditional should be True if the request has an If-Modified-Since header;
+        only conditional requests can be answered with a 304.
+
+        Raises CassetteError if the request was never recorded.
+        """
+        key = request_key(method, url, body)
+        interactions = self.interactions.get(key, [])
+        if not conditional:
+            interactions = [i for i in interactions if i['status_code'] != 304]
+        if not interactions:
+            raise CassetteError("%s %s was not recorded in %s." % (method.upper(), url, self.path))
+
+        with self._lock:
+            index = self._replayed.get((key, conditional), 0)
+            self._replayed[(key, conditional)] = index + 1
+        interaction = interactions[min(index, len(interactions) - 1)]
+
+        if self.latency == 'recorded':
+            time.sleep(interaction['elapsed'])
+        elif self.latency:
+            time.sleep(self.latency)
+
+        return self._response(interaction, url)
+
+    def _response(self, interaction, url):
+        content = self._load_body(interaction)
+        response = requests.Response()
+        response.status_code = interaction['status_code']
+        response.reason = interaction.get('reason')
+        response.headers = CaseInsensitiveDict(interaction['headers'])
+        response.url = url
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        # The whole body is available; iter_content() will slice it
+        response._content = content
+        response._content_consumed = True
+        return response
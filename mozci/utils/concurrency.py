@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+"""This module helps the main modules run independent pieces of work concurrently."""
+from __future__ import absolute_import
+
+import logging
+import sys
+import threading
+import time
+
+from mozci.utils import instrumentation
+
+LOG = logging.getLogger('mozci')
+MAX_WORKERS = 8
+
+
+def map_concurrently(func, items, max_workers=MAX_WORKERS):
+    """
+    Return [func(item) for item in items] computing the values with a pool of threads.
+
+    The order of the results matches the order of items.
+    If any call raises an exception, the first one is raised again in the caller
+    once all the threads are done.
+    """
+    items = list(items)
+    workers = min(max_workers, len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    LOG.debug("Running %d calls of %s with %d threads." % (len(items), func.__name__, workers))
+    results = [None] * len(items)
+    errors = []
+    pending = iter(range(len(items)))
+    lock = threading.Lock()
+
+    def _worker():
+        while True:
+            with lock:
+                index = next(pending, None)
+            if index is None:
+                return
+            try:
+                results[index] = func(items[index])
+            except Exception:
+                errors.append((index, sys.exc_info()))
+
+    threads = [threading.Thread(target=_worker) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        _, (exc_type, exc_value, exc_tb) = min(errors, key=lambda error: error[0])
+        raise exc_type, exc_value, exc_tb
+
+    return results
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Coalesce concurrent calls for the same key into a single call.
+
+    While a call for a key is in flight, other threads asking for the same key
+    wait for it and receive its result (or its exception) instead of doing the
+    same work again. Callers sharing a result must not modify it.
+
+    Usage::
+
+        IN_FLIGHT = SingleFlight('BUILDS_CACHE')
+        jobs = IN_FLIGHT.do(filename, _load, filename)
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            instrumentation.record_event('singleflight', self.name)
+            LOG.debug("Waiting for the call in flight for %s in %s." % (str(key), self.name))
+            call.done.wait()
+            if call.exc_info is not None:
+                exc_type, exc_value, exc_tb = call.exc_info
+                raise exc_type, exc_value, exc_tb
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+
+class RateLimiter(object):
+    """
+    Let at most `rate` calls per second go through wait(); the others sleep.
+
+    The calls are spread evenly (one every 1 / rate seconds) across all the threads
+    sharing the limiter. A rate of None (or 0) means no limit.
+
+    Usage::
+
+        limiter = RateLimiter(5)
+        for request in requests:
+            limiter.wait()
+            ...
+    """
+
+    def __init__(self, rate, clock=time.time, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate else 0
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+
+        with self._lock:
+            now = self.clock()
+            start = max(now, self._next)
+            self._next = start + self.interval
+
+        if start > now:
+            self.sleep(start - now)
@@ -0,0 +1,232 @@
+#! /usr/bin/env python
+"""
+This module collects metrics about where mozci spends its time.
+
+It keeps track of:
+
+* Outbound requests per data source (pushlog, buildapi, buildjson, allthethings,
+  treeherder, taskcluster, artifacts): number of calls, errors, bytes received and
+  a latency histogram
+* Hits and misses of the in-memory caches (VALID_CACHE, JOBS_CACHE, BUILDS_CACHE,
+  REPOSITORIES...)
+* Timers (e.g. how long it takes to parse a buildjson file)
+* Events (e.g. decisions taken by the code)
+
+The metrics can be exported on demand (to_json(), to_statsd()) or at the
+end of the process (report_at_exit()). Setting the MOZCI_METRICS environment
+variable to a file path writes them at exit (statsd lines if the path ends
+with .statsd, json otherwise).
+"""
+from __future__ import absolute_import
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+LOG = logging.getLogger('mozci')
+# Upper bounds (in milliseconds) of the buckets of the latency histograms
+BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_LOCK = threading.Lock()
+REQUESTS = {}
+CACHES = {}
+TIMERS = {}
+EVENTS = {}
+
+
+class Histogram(object):
+    """Keep count, sum, min, max and bucket counts of values expressed in milliseconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for index, upper_bound in enumerate(BUCKETS):
+            if value <= upper_bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def to_dict(self):
+        labels = ['le_%d' % b for b in BUCKETS] + ['inf']
+        return {
+            'count': self.count,
+            'sum_ms': round(self.sum, 3),
+            'min_ms': self.min,
+            'max_ms': self.max,
+            'mean_ms': round(self.sum / self.count, 3) if self.count else None,
+            'buckets': dict(zip(labels, self.buckets)),
+        }
+
+
+def _request_stats(source):
+    if source not in REQUESTS:
+        REQUESTS[source] = {'calls': 0, 'errors': 0, 'bytes': 0, 'latency': Histogram()}
+    return REQUESTS[source]
+
+
+def record_request(source, elapsed, status_code=None, nbytes=0):
+    """Record an outbound request to source which took elapsed seconds."""
+    with _LOCK:
+        stats = _request_stats(source)
+        stats['calls'] += 1
+        stats['bytes'] += nbytes
+        stats['latency'].add(elapsed * 1000)
+        if status_code is not None and status_code >= 400:
+            stats['errors'] += 1
+
+
+def record_bytes(source, nbytes):
+    """Record bytes received from source (e.g. while streaming a download)."""
+    with _LOCK:
+        _request_stats(source)['bytes'] += nbytes
+
+
+@contextmanager
+def timed_request(source):
+    """Record a request made through a third party client (e.g. Treeherder's or TaskCluster's)."""
+    start = time.time()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        record_request(source, time.time() - start, status_code=500 if failed else None)
+
+
+def cache_hit(name):
+    with _LOCK:
+        CACHES.setdefault(name, {'hits': 0, 'misses': 0})['hits'] += 1
+
+
+def cache_miss(name):
+    with _LOCK:
+        CACHES.setdefault(name, {'hits': 0, 'misses': 0})['misses'] += 1
+
+
+def record_time(name, elapsed):
+    with _LOCK:
+        TIMERS.setdefault(name, Histogram()).add(elapsed * 1000)
+
+
+@contextmanager
+def timer(name):
+    """Record how long the block takes, e.g. with timer('parse.buildjson'): ..."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_time(name, time.time() - start)
+
+
+def record_event(name, value):
+    """Count how many times name took a given value, e.g. record_event('load_file.mode', 'full')."""
+    with _LOCK:
+        values = EVENTS.setdefault(name, {})
+        values[value] = values.get(value, 0) + 1
+
+
+def reset():
+    with _LOCK:
+        REQUESTS.clear()
+        CACHES.clear()
+        TIMERS.clear()
+        EVENTS.clear()
+
+
+def to_json():
+    """Return a dictionary with all metrics collected so far."""
+    with _LOCK:
+        caches = {}
+        for name, stats in CACHES.iteritems():
+            total = stats['hits'] + stats['misses']
+            caches[name] = dict(stats, hit_rate=round(float(stats['hits']) / total, 3))
+
+        return {
+            'requests': dict(
+                (source, {'calls': stats['calls'],
+                          'errors': stats['errors'],
+                          'bytes': stats['bytes'],
+                          'latency': stats['latency'].to_dict()})
+                for source, stats in REQUESTS.iteritems()),
+            'caches': caches,
+            'timers': dict((name, h.to_dict()) for name, h in TIMERS.iteritems()),
+            'events': dict((name, dict(values)) for name, values in EVENTS.iteritems()),
+        }
+
+
+def to_statsd(prefix='mozci'):
+    """Return the metrics as a list of statsd lines (counters and gauges)."""
+    metrics = to_json()
+    lines = []
+    for source, stats in sorted(metrics['requests'].items()):
+        key = '%s.requests.%s' % (prefix, source)
+        lines.append('%s.calls:%d|c' % (key, stats['calls']))
+        lines.append('%s.errors:%d|c' % (key, stats['errors']))
+        lines.append('%s.bytes:%d|c' % (key, stats['bytes']))
+        lines.extend(_histogram_lines('%s.latency_ms' % key, stats['latency']))
+
+    for name, stats in sorted(metrics['caches'].items()):
+        key = '%s.caches.%s' % (prefix, name)
+        lines.append('%s.hits:%d|c' % (key, stats['hits']))
+        lines.append('%s.misses:%d|c' % (key, stats['misses']))
+
+    for name, histogram in sorted(metrics['timers'].items()):
+        lines.extend(_histogram_lines('%s.timers.%s_ms' % (prefix, name), histogram))
+
+    for name, values in sorted(metrics['events'].items()):
+        for value, count in sorted(values.items()):
+            lines.append('%s.events.%s.%s:%d|c' % (prefix, name, value, count))
+
+    return lines
+
+
+def _histogram_lines(key, histogram):
+    lines = ['%s.count:%d|c' % (key, histogram['count'])]
+    if histogram['count']:
+        lines.append('%s.mean:%s|g' % (key, histogram['mean_ms']))
+        lines.append('%s.max:%s|g' % (key, histogram['max_ms']))
+    for bucket, count in sorted(histogram['buckets'].items()):
+        if count:
+            lines.append('%s.%s:%d|c' % (key, bucket, count))
+    return lines
+
+
+def write_report(filepath=None, format='json'):
+    """Write the metrics to filepath (or log them) either as json or as statsd lines."""
+    if format == 'statsd':
+        content = '\n'.join(to_statsd()) + '\n'
+    else:
+        content = json.dumps(to_json(), indent=2, sort_keys=True)
+
+    if filepath:
+        with open(filepath, 'w') as fd:
+            fd.write(content)
+    else:
+        LOG.info("mozci metrics:\n%s" % content)
+
+
+def report_at_exit(filepath=None, format='json'):
+    """Write the metrics (see write_report) when the process exits."""
+    atexit.register(write_report, filepath, format)
+
+
+if os.environ.get('MOZCI_METRICS'):
+    report_at_exit(os.environ['MOZCI_METRICS'],
+                   'statsd' if os.environ['MOZCI_METRICS'].endswith('.statsd') else 'json')
@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+"""
+This module picks the fastest json decoders available on the system.
+
+* loads() and load() decode whole documents with the first decoder of DECODERS
+  which can be imported: ujson, simplejson (only with its C speedups) and
+  finally the json module of the standard library
+* items() streams documents with the first ijson backend of STREAMING_BACKENDS
+  which can be imported: yajl2_c, yajl2_cffi, yajl2 and finally the pure python one
+
+The decoders raise ValueError (or a subclass of it) on invalid documents.
+
+Setting the MOZCI_JSON_DECODER or MOZCI_JSON_STREAMING environment variables
+(e.g. MOZCI_JSON_DECODER=json) forces a backend; so does calling
+set_decoder() or set_streaming_backend().
+"""
+from __future__ import absolute_import
+
+import importlib
+import json
+import logging
+import os
+
+LOG = logging.getLogger('mozci')
+DECODERS = ('ujson', 'simplejson', 'json')
+STREAMING_BACKENDS = ('yajl2_c', 'yajl2_cffi', 'yajl2', 'python')
+
+DECODER = None
+STREAMING_BACKEND = None
+_decoder = None
+_ijson = None
+
+
+def import_decoder(name):
+    """Return the module of a decoder; raise ImportError if it is not usable."""
+    if name not in DECODERS:
+        raise ValueError("Unknown json decoder %s; use one of %s." % (name, ', '.join(DECODERS)))
+    if name == 'json':
+        return json
+    module = importlib.import_module(name)
+    if name == 'simplejson':
+        # Without its C extension simplejson is slower than the standard library
+        importlib.import_module('simplejson._speedups')
+    return module
+
+
+def import_streaming_backend(name):
+    """Return the ijson module of a backend; raise ImportError if it is not usable."""
+    if name not in STREAMING_BACKENDS:
+        raise ValueError("Unknown ijson backend %s; use one of %s." %
+                         (name, ', '.join(STREAMING_BACKENDS)))
+    # yajl2* backends need the yajl library (and a compiler or cffi) at import time
+    return importlib.import_module('ijson.backends.%s' % name)
+
+
+def available(names, importer):
+    """Return the names which can be imported (in order of preference)."""
+    usable = []
+    for name in names:
+        try:
+            importer(name)
+            usable.append(name)
+        except ImportError:
+            pass
+    return usable
+
+
+def set_decoder(name=None):
+    """Use the decoder called name or the fastest one available if None."""
+    global DECODER, _decoder
+    name = name or available(DECODERS, import_decoder)[0]
+    _decoder = import_decoder(name)
+    DECODER = name
+    LOG.debug("We are going to decode json with %s." % name)
+
+
+def set_streaming_backend(name=None):
+    """Use the ijson backend called name or the fastest one available if None."""
+    global STREAMING_BACKEND, _ijson
+    name = name or available(STREAMING_BACKENDS, import_streaming_backend)[0]
+    _ijson = import_streaming_backend(name)
+    STREAMING_BACKEND = name
+    LOG.debug("We are going to stream json with ijson's %s backend." % name)
+
+
+def loads(data):
+    return _decoder.loads(data)
+
+
+def load(fd):
+    return _decoder.load(fd)
+
+
+def items(stream, prefix):
+    """Yield the items found under prefix of a json stream (see ijson.items())."""
+    return _ijson.items(stream, prefix)
+
+
+set_decoder(os.environ.get('MOZCI_JSON_DECODER'))
+set_streaming_backend(os.environ.get('MOZCI_JSON_STREAMING'))
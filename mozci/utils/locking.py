@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+"""
+This module lets many mozci processes share the files in ~/.mozilla/mozci.
+
+* Downloads are written to a temporary file and published with an atomic rename;
+  readers see either the previous version of a file or the new one, never a
+  half-written one.
+* Only one process (or thread) at a time downloads a given file. The others wait
+  for the lock and, if the file was published while they waited, use it instead
+  of downloading it again (see changed_since()).
+"""
+from __future__ import absolute_import
+
+import errno
+import logging
+import os
+import platform
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+LOG = logging.getLogger('mozci')
+# Seconds between attempts to grab a lock when fcntl is not available
+POLL_INTERVAL = 0.1
+# A lock file older than this (in seconds) is considered abandoned when fcntl is not available
+STALE_LOCK = 30 * 60
+
+
+class FileLock(object):
+    """
+    Exclusive lock on `path` shared between processes and threads.
+
+    Usage::
+
+        with FileLock(filepath):
+            ...
+    """
+
+    # flock() locks belong to the open file, so threads of the same process
+    # need their own lock on top of it
+    _thread_locks = {}
+    _thread_locks_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self._fd = None
+        with FileLock._thread_locks_lock:
+            self._thread_lock = FileLock._thread_locks.setdefault(self.lock_path,
+                                                                  threading.Lock())
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        try:
+            if fcntl is not None:
+                self._fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            else:
+                self._acquire_lock_file()
+        except BaseException:
+            self._thread_lock.release()
+            raise
+
+    def _acquire_lock_file(self):
+        while True:
+            try:
+                self._fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_RDWR)
+                return
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            try:
+                if time.time() - os.stat(self.lock_path).st_mtime > STALE_LOCK:
+                    LOG.debug("Removing the abandoned lock %s" % self.lock_path)
+                    os.remove(self.lock_path)
+                    continue
+            except OSError:
+                continue
+            time.sleep(POLL_INTERVAL)
+
+    def release(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                os.close(self._fd)
+            else:
+                os.close(self._fd)
+                os.remove(self.lock_path)
+        finally:
+            self._fd = None
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def signature(filepath):
+    """Return (mtime, size, inode) of a file or None if it does not exist."""
+    try:
+        statinfo = os.stat(filepath)
+    except OSError:
+        return None
+    return (statinfo.st_mtime, statinfo.st_size, statinfo.st_ino)
+
+
+def changed_since(filepath, previous_signature):
+    """Determine if a file has been published since we took previous_signature."""
+    current = signature(filepath)
+    return current is not None and current != previous_signature
+
+
+def temp_path(filepath):
+    """Return a path, next to filepath, where this process and thread can write to."""
+    return '%s.%d.%d.tmp' % (filepath, os.getpid(), threading.current_thread().ident)
+
+
+def publish(tmp_path, filepath):
+    """Atomically replace filepath with tmp_path."""
+    if platform.system() == 'Windows' and os.path.exists(filepath):
+        # rename() does not replace existing files on Windows
+        os.remove(filepath)
+    os.rename(tmp_path, filepath)
+
+
+def discard(tmp_path):
+    try:
+        os.remove(tmp_path)
+    except OSError:
+        pass
@@ -3,12 +3,28 @@
 from __future__ import absolute_import
 
 import logging
+import time
 
-import requests
-
+from mozci.utils import instrumentation, transport
 from mozci.utils.authentication import get_credentials
+from mozci.utils.concurrency import map_concurrently
 
 LOG = logging.getLogger('mozci')
+# The artifacts of a finished build do not change; we remember for a while whether
+# a URL was reachable instead of checking it again for every job we trigger.
+# url -> (reachable, time of the check)
+REACHABLE_CACHE = {}
+REACHABLE_TTL = 30 * 60
+# An artifact might still be uploading; we check unreachable URLs again sooner
+UNREACHABLE_TTL = 60
+
+
+def buildjson_request_ids(job):
+    """Return the set of request ids of a buildjson job."""
+    # XXX: Issue 104 - We have an unclear source of request ids
+    prop_req_ids = job.get("properties", {}).get("request_ids", [])
+    root_req_ids = job.get("request_ids", [])
+    return set(prop_req_ids + root_req_ids)
 
 
 def _public_url(url):
@@ -30,15 +46,33 @@ def _public_url(url):
     return url
 
 
+def _url_reachable(url, auth):
+    """Determine if a URL is reachable; the result is cached (see REACHABLE_CACHE)."""
+    now = time.time()
+    if url in REACHABLE_CACHE:
+        reachable, checked_at = REACHABLE_CACHE[url]
+        if now - checked_at < (REACHABLE_TTL if reachable else UNREACHABLE_TTL):
+            instrumentation.cache_hit('REACHABLE_CACHE')
+            return reachable
+
+    instrumentation.cache_miss('REACHABLE_CACHE')
+    url_tested = _public_url(url)
+    LOG.debug("We are going to test if we can reach %s" % url_tested)
+    req = transport.head(url_tested, source='artifacts', auth=auth)
+    if not req.ok:
+        LOG.warning("We can't reach %s for this reason %s" %
+                    (url, req.reason))
+
+    REACHABLE_CACHE[url] = (req.ok, now)
+    return req.ok
+
+
 def _all_urls_reachable(urls):
-    """Determine if the URLs are reachable."""
-    for url in urls:
-        url_tested = _public_url(url)
-        LOG.debug("We are going to test if we can reach %s" % url_tested)
-        req = requests.head(url_tested, auth=get_credentials())
-        if not req.ok:
-            LOG.warning("We can't reach %s for this reason %s" %
-                        (url, req.reason))
-            return False
-
-    return True
+    """Determine if the URLs are reachable; they are checked concurrently."""
+    # We ask for the credentials (if needed) before starting the threads
+    auth = get_credentials()
+
+    def _reachable(url):
+        return _url_reachable(url, auth)
+
+    return all(map_concurrently(_reachable, urls))
@@ -0,0 +1,162 @@
+#! /usr/bin/env python
+"""
+This module keeps track of the build jobs requested by every mozci process of this host.
+
+mozci.SCHEDULING_MANAGER prevents a process from requesting the same build job
+twice; processes running in parallel (e.g. pulse workers) each have their own.
+The ledger is a SQLite database (~/.mozilla/mozci/scheduling.db) shared by all of
+them, keyed by (repo_name, revision, buildername):
+
+* claim() records a request unless another session (process) has made it during
+  the last TTL seconds; checking and recording happen in a single transaction
+* release() forgets a request which did not go through
+
+Requests of the current session can be claimed again; a process asking for a
+build job many times (e.g. --times 3) is left alone.
+
+Setting MOZCI_SCHEDULING_LEDGER to a path uses another database; setting it to
+an empty string disables the ledger.
+"""
+from __future__ import absolute_import
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from mozci.utils.transfer import path_to_file
+
+LOG = logging.getLogger('mozci')
+LEDGER_FILE = os.environ.get('MOZCI_SCHEDULING_LEDGER')
+if LEDGER_FILE is None:
+    LEDGER_FILE = path_to_file('scheduling.db')
+# Seconds during which a build request prevents other sessions from requesting it again;
+# by then the build is visible in the scheduling data (or it got lost)
+TTL = 3 * 60 * 60
+# pid -> id of the requests made by this process; forked processes get their own
+_SESSIONS = {}
+# Threads of execute_plan() must agree on a single session id
+_SESSIONS_LOCK = threading.Lock()
+# (pid, ledger file) of the ledgers whose schema this process has created
+_SCHEMA_READY = set()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    repo_name TEXT NOT NULL,
+    revision TEXT NOT NULL,
+    buildername TEXT NOT NULL,
+    session TEXT NOT NULL,
+    requested_at REAL NOT NULL,
+    PRIMARY KEY (repo_name, revision, buildername)
+);
+CREATE INDEX IF NOT EXISTS requests_requested_at ON requests (requested_at);
+"""
+
+
+def session():
+    """Return the id of the requests made by this process."""
+    pid = os.getpid()
+    with _SESSIONS_LOCK:
+        if pid not in _SESSIONS:
+            _SESSIONS.clear()
+            _SESSIONS[pid] = '%d-%s' % (pid, uuid.uuid4().hex)
+        return _SESSIONS[pid]
+
+
+def _connect():
+    """Return a connection to the ledger; the schema is created once per process."""
+    # We manage the transactions ourselves (see claim())
+    conn = sqlite3.connect(LEDGER_FILE, timeout=30, isolation_level=None)
+    key = (os.getpid(), LEDGER_FILE)
+    if key not in _SCHEMA_READY:
+        # Creating the schema while other processes use the database makes their
+        # statements fail ("database schema has changed"); we do it under the write lock
+        conn.execute("BEGIN IMMEDIATE")
+        for statement in SCHEMA.split(';'):
+            if statement.strip():
+                conn.execute(statement)
+        conn.execute("COMMIT")
+        _SCHEMA_READY.add(key)
+    return conn
+
+
+def claim(repo_name, revision, buildername, ttl=None):
+    """
+    Record that we are requesting buildername on revision.
+
+    Returns False if another session has requested it during the last ttl
+    (defaults to TTL) seconds; True otherwise (or if the ledger is not usable).
+    """
+    if not LEDGER_FILE:
+        return True
+
+    ttl = TTL if ttl is None else ttl
+    key = (repo_name, revision[0:12], buildername)
+    now = time.time()
+    try:
+        conn = _connect()
+        try:
+            # Take the write lock before reading so no other process can claim in between
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT session, requested_at FROM requests "
+                "WHERE repo_name = ? AND revision = ? AND buildername = ?", key).fetchone()
+            if row is not None and row[0] != session() and row[1] > now - ttl:
+                conn.execute("ROLLBACK")
+                LOG.info("'%s' was requested on %s %d seconds ago by another process." %
+                         (buildername, revision, now - row[1]))
+                return False
+
+            conn.execute("INSERT OR REPLACE INTO requests VALUES (?, ?, ?, ?, ?)",
+                         key + (session(), now))
+            conn.execute("DELETE FROM requests WHERE requested_at < ?", (now - ttl,))
+            conn.execute("COMMIT")
+            return True
+        finally:
+            conn.close()
+    except sqlite3.Error, e:
+        LOG.warning("We could not use the scheduling ledger %s: %s" % (LEDGER_FILE, e))
+        return True
+
+
+def is_claimed(repo_name, revision, buildername, ttl=None):
+    """Return True if another session has requested buildername on revision recently."""
+    # Nobody has requested anything yet
+    if not LEDGER_FILE or not os.path.exists(LEDGER_FILE):
+        return False
+
+    ttl = TTL if ttl is None else ttl
+    try:
+        conn = _connect()
+        try:
+            # A plain read; it does not wait for (or block) the processes claiming builds
+            row = conn.execute(
+                "SELECT 1 FROM requests WHERE repo_name = ? AND revision = ? AND "
+                "buildername = ? AND session != ? AND requested_at > ?",
+                (repo_name, revision[0:12], buildername, session(),
+                 time.time() - ttl)).fetchone()
+            return row is not None
+        finally:
+            conn.close()
+    except sqlite3.Error, e:
+        LOG.warning("We could not use the scheduling ledger %s: %s" % (LEDGER_FILE, e))
+        return False
+
+
+def release(repo_name, revision, buildername):
+    """Forget our request of buildername on revision (e.g. if it failed)."""
+    if not LEDGER_FILE:
+        return
+
+    try:
+        conn = _connect()
+        try:
+            conn.execute("DELETE FROM requests WHERE repo_name = ? AND revision = ? AND "
+                         "buildername = ? AND session = ?",
+                         (repo_name, revision[0:12], buildername, session()))
+        finally:
+            conn.close()
+    except sqlite3.Error, e:
+        LOG.warning("We could not use the scheduling ledger %s: %s" % (LEDGER_FILE, e))
@@ -1,32 +1,43 @@
 import calendar
-import datetime
 import errno
-import fnmatch
 import gzip
-import json
 import logging
 import os
 import platform
 import shutil
+import struct
 import subprocess
 import time
 
-import requests
-
 from mozci.errors import MozciError
+from mozci.utils import cache_manager, instrumentation, json_backend, locking, transport
 from progressbar import Bar, Timer, FileTransferSpeed, ProgressBar
 
-# yajl2 backend is faster then the default backend, but it requires
-# libyajl2 to be installed in the system
-try:
-    import ijson.backends.yajl2 as ijson
-except:
-    import ijson
-
 LOG = logging.getLogger('mozci')
-MEMORY_SAVING_MODE = False
+# How load_file() loads json files:
+# None  - pick the mode of every file from its size and the memory available (see _load_mode)
+# False - always load the whole file (FULL)
+# True  - always keep only the fields mozci needs (PROJECTED)
+MEMORY_SAVING_MODE = None
 SHOW_PROGRESS_BAR = True
 
+# The loading modes of load_file()
+FULL, PROJECTED = 'full', 'projected'
+# Peak memory used by each mode per byte of uncompressed json (measured on buildjson files)
+MEMORY_PER_BYTE = {FULL: 11, PROJECTED: 5}
+# The fields of the buildjson jobs kept by PROJECTED; mozci only reads these (see
+# mozci.mozci._find_files and BuildApi._is_coalesced). Scripts which need whole jobs
+# (e.g. scripts/misc/find_status_for_jobs.py) set MEMORY_SAVING_MODE to False.
+PROJECTED_PROPERTIES = ('buildername', 'request_ids', 'revision', 'packageUrl',
+                        'testPackagesUrl', 'testsUrl')
+# Fraction of the available memory a single file can use
+MEMORY_BUDGET = 0.5
+# Bounds of the compression ratio of gzipped json. deflate can't do better than ~1032:1
+# and buildjson files compress to much less than a fifth of their size; the lower bound
+# errs on the side of a bigger estimate (i.e. PROJECTED) when the gzip size wrapped.
+GZIP_MAX_RATIO = 1032
+GZIP_MIN_RATIO = 5
+
 
 def path_to_file(filename):
     """Add files to .mozilla/mozci"""
@@ -38,17 +49,12 @@ def path_to_file(filename):
 
 
 def clean_directory():
-    """Clean ./mozilla/mozci directory of buildjson files that are older than 30 days"""
-    path = os.path.expanduser('~/.mozilla/mozci/')
-    filter_build_files = fnmatch.filter(os.listdir(path), "builds-*")
-    permissible_last_date = datetime.date.today() - datetime.timedelta(days=30)
-    permissible_timestamp = int(time.mktime(permissible_last_date.timetuple()))
-    for filename in filter_build_files:
-        full_filepath = os.path.join(path, filename)
-        last_mod_timestamp = int(os.stat(full_filepath).st_mtime)
-        if last_mod_timestamp < permissible_timestamp:
-            LOG.debug("Cleaning up %s" % full_filepath)
-            os.remove(full_filepath)
+    """Evict the least recently used files of ~/.mozilla/mozci if it is over budget.
+
+    See mozci.utils.cache_manager; prefer cache_manager.maybe_evict() which does
+    not block the caller.
+    """
+    cache_manager.evict()
 
 
 def _verify_last_mod(remote_last_mod_date, filename):
@@ -121,7 +127,7 @@ def _load_json_file(filepath):
         fd.close()
 
     try:
-        return json.loads(data)
+        return json_backend.loads(data)
     except ValueError, e:
         LOG.exception(e)
         new_file = filepath + ".corrupted"
@@ -131,32 +137,47 @@ def _load_json_file(filepath):
         exit(1)
 
 
-def _save_file(req, filepath):
+def _save_file(req, filepath, source='transfer'):
     '''
     Helper class to download a file and show a progress bar.
+
+    The file is written to a temporary file which replaces filepath once it is
+    complete, so other processes never read a half-written file.
     '''
     LOG.debug("About to fetch %s from %s" % (filepath, req.url))
     size = int(req.headers['Content-Length'].strip())
     if SHOW_PROGRESS_BAR:
         pbar = DownloadProgressBar(filepath, size).start()
     bytes = 0
-    with open(filepath, 'wb') as fd:
-        for chunk in req.iter_content(10 * 1024):
-            if chunk:  # filter out keep-alive new chunks
-                fd.write(chunk)
-                bytes += len(chunk)
-                if SHOW_PROGRESS_BAR:
-                    pbar.update(bytes)
-    if SHOW_PROGRESS_BAR:
-        pbar.finish()
-    _verify_last_mod(req.headers['last-modified'], filepath)
+    tmp_path = locking.temp_path(filepath)
+    try:
+        with open(tmp_path, 'wb') as fd:
+            for chunk in req.iter_content(10 * 1024):
+                if chunk:  # filter out keep-alive new chunks
+                    fd.write(chunk)
+                    bytes += len(chunk)
+                    instrumentation.record_bytes(source, len(chunk))
+                    if SHOW_PROGRESS_BAR:
+                        pbar.update(bytes)
+        if SHOW_PROGRESS_BAR:
+            pbar.finish()
+        _verify_last_mod(req.headers['last-modified'], tmp_path)
+        locking.publish(tmp_path, filepath)
+    finally:
+        locking.discard(tmp_path)
 
 
-def load_file(filename, url):
+def fetch_file(filename, url, source='transfer'):
     '''
     We download a file without decompressing it so we can keep track of its progress.
-    We save it to disk and return the contents of it.
-    We also check if the file on the server is newer to determine if we should download it again.
+    We check if the file on the server is newer to determine if we should download it again.
+
+    Only one process downloads a given file at a time; if another process has
+    downloaded it while we waited for our turn, we use that copy.
+
+    source is the name under which the requests are recorded (see instrumentation).
+
+    Returns the path to the file on disk.
 
     Raises MozciError if anything goes wrong.
     '''
@@ -166,6 +187,18 @@ def load_file(filename, url):
     else:
         filepath = filename
 
+    previous_signature = locking.signature(filepath)
+    with locking.FileLock(filepath):
+        if locking.changed_since(filepath, previous_signature):
+            LOG.debug("%s has just been downloaded by another process." % filepath)
+        else:
+            _download_if_newer(filename, filepath, url, source)
+
+    cache_manager.touch(filepath)
+    return filepath
+
+
+def _download_if_newer(filename, filepath, url, source):
     headers = {
         'Accept-Encoding': None,
     }
@@ -182,7 +215,7 @@ def load_file(filename, url):
         # The file does not exist in the cache; let's fetch
         LOG.debug("We have not been able to find %s on disk." % filepath)
 
-    req = requests.get(url, stream=True, headers=headers)
+    req = transport.get(url, source=source, stream=True, headers=headers)
 
     if req.status_code == 200:
         if exists:
@@ -191,7 +224,7 @@ def load_file(filename, url):
             LOG.debug("The server's last modified in %s" % req.headers['last-modified'])
             LOG.info("Fetch newer version of %s." % filename)
 
-        _save_file(req, filename)
+        _save_file(req, filepath, source)
 
     elif req.status_code == 304:
         # The file on disk is recent
@@ -200,48 +233,164 @@ def load_file(filename, url):
     else:
         raise MozciError("We received %s which is unexpected." % req.status_code)
 
+
+def _is_gzipped(filepath):
+    with open(filepath, 'rb') as fd:
+        return fd.read(2) == '\037\213'  # gzip magic number
+
+
+def _uncompressed_size(filepath):
+    '''
+    Estimate the uncompressed size of a json file (gzipped or not).
+
+    gzip files end with the size of their uncompressed contents modulo 2^32; when the
+    file is big enough for that size to have wrapped we assume at least GZIP_MIN_RATIO.
+    '''
+    size = os.path.getsize(filepath)
+    with open(filepath, 'rb') as fd:
+        if fd.read(2) != '\037\213':  # gzip magic number
+            return size
+        fd.seek(-4, os.SEEK_END)
+        uncompressed = struct.unpack('<I', fd.read(4))[0]
+
+    # The contents of smaller files can't reach 4GB, so their size can't have wrapped
+    if size * GZIP_MAX_RATIO >= 2 ** 32:
+        while uncompressed < size * GZIP_MIN_RATIO:
+            uncompressed += 2 ** 32
+    return uncompressed
+
+
+def _read_int(path):
     try:
-        if not MEMORY_SAVING_MODE:
-            LOG.debug("Running in *non*-memory saving mode.")
-            return _load_json_file(filepath)
+        with open(path) as fd:
+            return int(fd.read().strip())
+    except (IOError, ValueError):
+        # The file does not exist or it contains 'max' (no limit)
+        return None
+
+
+def available_memory():
+    '''
+    Return how many bytes of memory this process can still use or None if we can't tell.
+
+    The limit of the cgroup (v2 or v1) of the process (e.g. a container) is used
+    if it is lower than the memory available on the machine.
+    '''
+    candidates = []
+
+    for limit_file, usage_file in (
+            ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+            ('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+             '/sys/fs/cgroup/memory/memory.usage_in_bytes')):
+        limit = _read_int(limit_file)
+        usage = _read_int(usage_file)
+        if limit is not None and usage is not None:
+            candidates.append(max(limit - usage, 0))
+            break
+
+    try:
+        with open('/proc/meminfo') as fd:
+            for line in fd:
+                if line.startswith('MemAvailable:'):
+                    candidates.append(int(line.split()[1]) * 1024)
+                    break
+    except IOError:
+        # Not a Linux machine
+        pass
+
+    return min(candidates) if candidates else None
+
 
-        LOG.debug("Running in memory saving mode.")
-        return _lean_load_json_file(filepath)
+def _load_mode(filepath):
+    '''
+    Pick how to load a json file.
+
+    FULL (the fastest) if the file comfortably fits in memory once loaded,
+    PROJECTED otherwise. Only buildjson files (gzipped) are ever projected
+    automatically. The decision is recorded in instrumentation.
+    '''
+    if MEMORY_SAVING_MODE is not None:
+        mode = PROJECTED if MEMORY_SAVING_MODE else FULL
+    else:
+        size = _uncompressed_size(filepath)
+        memory = available_memory()
+        if memory is None or not _is_gzipped(filepath):
+            mode = FULL
+        else:
+            fits = size * MEMORY_PER_BYTE[FULL] <= memory * MEMORY_BUDGET
+            mode = FULL if fits else PROJECTED
+            LOG.debug("%s: %d MB of json and %d MB of memory available; loading mode: %s." %
+                      (os.path.basename(filepath), size / 1024 ** 2, memory / 1024 ** 2, mode))
+
+    instrumentation.record_event('load_file.mode', mode)
+    return mode
+
+
+def load_file(filename, url, source='transfer'):
+    '''
+    We download a file (see fetch_file) and return the contents of it.
+
+    Depending on the size of the file and the memory available (see _load_mode) the
+    file is loaded whole or only the fields mozci needs are kept (PROJECTED_PROPERTIES).
+
+    Raises MozciError if anything goes wrong.
+    '''
+    filepath = fetch_file(filename, url, source)
+
+    try:
+        with instrumentation.timer('parse.%s' % source):
+            mode = _load_mode(filepath)
+            if mode == FULL:
+                return _load_json_file(filepath)
+            return _lean_load_json_file(filepath)
 
     # Issue 213: sometimes we download a corrupted builds-*.js file
     except (IOError, subprocess.CalledProcessError):
         LOG.info("%s is corrupted, we will have to download a new one.", filename)
         os.remove(filepath)
-        return load_file(filename, url)
+        return load_file(filename, url, source)
 
 
-def _lean_load_json_file(filepath):
-    """Helper function to load json contents from a file using ijson."""
-    LOG.debug("About to load %s." % filepath)
+def iter_json_items(filepath, prefix):
+    """
+    Yield one by one the items found under 'prefix' of a json file (gzipped or not).
+
+    Only one item at a time is kept in memory, e.g. iter_json_items(filepath, 'builds.item')
+    """
+    LOG.debug("About to stream %s from %s." % (prefix, filepath))
 
     fd = open(filepath, 'rb')
+    magic = fd.read(2)
+    fd.seek(0)
+
+    if magic == '\037\213':  # gzip magic number
+        stream = gzip.GzipFile(fileobj=fd)
+    else:
+        stream = fd
+
+    try:
+        for item in json_backend.items(stream, prefix):
+            yield item
+    finally:
+        stream.close()
+        fd.close()
+
+
+def _lean_load_json_file(filepath):
+    """Load the jobs of a buildjson file (gzipped or not) keeping only what mozci needs."""
+    LOG.debug("About to load %s." % filepath)
 
-    gzipper = gzip.GzipFile(fileobj=fd)
-    builds = ijson.items(gzipper, 'builds.item')
-    ret = {'builds': []}
     try:
         # We are going to store only the information we need from builds-.js
         # and ignore the rest.
-        ret['builds'] = [{
+        return {'builds': [{
             'properties': {
                 key: value for (key, value) in b["properties"].iteritems()
-                if key in ('buildername', 'request_ids', 'revision', 'packageUrl',
-                           'testPackagesUrl', 'testsUrl')
+                if key in PROJECTED_PROPERTIES
             },
             'request_ids': b['request_ids']
-        } for b in builds]
+        } for b in iter_json_items(filepath, 'builds.item')]}
 
     except IOError, e:
         LOG.warning(str(e))
         raise
-
-    finally:
-        fd.close()
-        gzipper.close()
-
-    return ret
@@ -0,0 +1,171 @@
+#! /usr/bin/env python
+"""
+All outbound HTTP requests of mozci's data sources go through this module.
+
+Every request is recorded by mozci.utils.instrumentation under the name of
+the data source it was made for (e.g. 'pushlog' or 'buildapi').
+
+The requests can also be recorded in a cassette (see mozci.utils.cassette) and
+replayed later without network access, e.g. to compare the latency and number
+of requests of two versions of mozci on the same production session::
+
+    transport.record('~/sessions/backfill')   # or MOZCI_RECORD=~/sessions/backfill
+    ...
+    transport.replay('~/sessions/backfill', latency='recorded')   # or MOZCI_REPLAY=...
+
+Third party clients using a requests.Session (e.g. Treeherder's) go through
+the cassette if the session is passed to mount().
+"""
+from __future__ import absolute_import
+
+import atexit
+import logging
+import os
+import time
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+from mozci.utils import instrumentation
+from mozci.utils.cassette import Cassette
+
+LOG = logging.getLogger('mozci')
+# Set through record() or replay()
+CASSETTE = None
+REPLAYING = False
+
+
+def record(path):
+    """Record every request in a cassette at path; it is written by stop() or at exit."""
+    global CASSETTE, REPLAYING
+    LOG.info("We are recording the requests in %s." % path)
+    CASSETTE = Cassette(path)
+    REPLAYING = False
+    return CASSETTE
+
+
+def replay(path, latency=None):
+    """
+    Answer every request from the cassette at path instead of the network.
+
+    latency is either None, a number of seconds added to every response or
+    'recorded' to wait as long as the original request took.
+    """
+    global CASSETTE, REPLAYING
+    LOG.info("We are replaying the requests from %s." % path)
+    CASSETTE = Cassette(path, latency=latency).load()
+    REPLAYING = True
+    return CASSETTE
+
+
+def stop():
+    """Stop recording (and write the cassette) or replaying."""
+    global CASSETTE, REPLAYING
+    if CASSETTE is not None and not REPLAYING:
+        CASSETTE.save()
+    CASSETTE = None
+    REPLAYING = False
+
+
+def _prepare(method, url, kwargs):
+    """Return the url (with its query) and body of a request as sent by requests."""
+    prepared = requests.Request(method.upper(), url,
+                                params=kwargs.get('params'),
+                                data=kwargs.get('data')).prepare()
+    return prepared.url, prepared.body
+
+
+def _is_conditional(headers):
+    return bool(headers) and headers.get('If-Modified-Since') is not None
+
+
+class CassetteAdapter(HTTPAdapter):
+    """Record or replay the requests made through a requests.Session."""
+
+    def send(self, request, **kwargs):
+        cassette = CASSETTE
+        if cassette is None:
+            return super(CassetteAdapter, self).send(request, **kwargs)
+
+        if REPLAYING:
+            response = cassette.play(request.method, request.url, request.body,
+                                     _is_conditional(request.headers))
+            response.request = request
+            return response
+
+        start = time.time()
+        response = super(CassetteAdapter, self).send(request, **kwargs)
+        cassette.record(request.method, request.url, request.body, response, time.time() - start)
+        return response
+
+
+def mount(session):
+    """Make a requests.Session go through the cassette (if any)."""
+    adapter = CassetteAdapter()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _content_length(response, stream):
+    # We don't consume streamed responses; the caller records the bytes it reads
+    if stream:
+        return 0
+    content = getattr(response, 'content', None)
+    if isinstance(content, basestring):
+        return len(content)
+    return 0
+
+
+def request(method, url, source, **kwargs):
+    """Make an HTTP request with requests.<method> and record it under source."""
+    cassette = CASSETTE
+    start = time.time()
+    try:
+        if cassette is not None and REPLAYING:
+            prepared_url, body = _prepare(method, url, kwargs)
+            response = cassette.play(method, prepared_url, body,
+                                     _is_conditional(kwargs.get('headers')))
+        else:
+            response = getattr(requests, method)(url, **kwargs)
+    except requests.RequestException:
+        instrumentation.record_request(source, time.time() - start, status_code=599)
+        raise
+
+    if cassette is not None and not REPLAYING:
+        prepared_url, body = _prepare(method, url, kwargs)
+        cassette.record(method, prepared_url, body, response, time.time() - start)
+
+    status_code = getattr(response, 'status_code', None)
+    instrumentation.record_request(
+        source,
+        time.time() - start,
+        status_code=status_code if isinstance(status_code, int) else None,
+        nbytes=_content_length(response, kwargs.get('stream', False)))
+    return response
+
+
+def get(url, source, **kwargs):
+    return request('get', url, source, **kwargs)
+
+
+def head(url, source, **kwargs):
+    return request('head', url, source, **kwargs)
+
+
+def post(url, source, **kwargs):
+    return request('post', url, source, **kwargs)
+
+
+def delete(url, source, **kwargs):
+    return request('delete', url, source, **kwargs)
+
+
+if os.environ.get('MOZCI_REPLAY'):
+    _latency = os.environ.get('MOZCI_REPLAY_LATENCY')
+    replay(os.environ['MOZCI_REPLAY'],
+           latency=_latency if _latency in (None, 'recorded') else float(_latency))
+elif os.environ.get('MOZCI_RECORD'):
+    record(os.environ['MOZCI_RECORD'])
+    atexit.register(stop)
@@ -0,0 +1,202 @@
+#! /usr/bin/env python
+"""
+This module provides an in-memory cache for data which stops changing at some point.
+
+The jobs of a revision are a good example: once every job has finished, querying
+them again gives the same answer; while some are pending or running, the answer
+changes every few minutes. StateAwareCache keeps:
+
+* final entries (as decided by the is_final function) until they are evicted
+* other entries for ttl seconds; after that they are still served for max_stale
+  seconds while a background thread fetches them again (stale-while-revalidate)
+
+The cache is bounded: once the total weight of its entries (by default the
+length of the values) goes over max_weight, the least recently used entries
+are evicted.
+
+Entries which we know have changed (e.g. we have just triggered a job on a
+revision whose jobs had all finished) can be dropped with invalidate().
+"""
+from __future__ import absolute_import
+
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+
+from mozci.utils import instrumentation
+from mozci.utils.concurrency import SingleFlight
+
+LOG = logging.getLogger('mozci')
+
+
+def _weight(value):
+    return len(value) + 1
+
+
+class _Entry(object):
+    def __init__(self, value, final, stored, weight):
+        self.value = value
+        self.final = final
+        self.stored = stored
+        self.weight = weight
+
+
+class StateAwareCache(object):
+    """
+    Cache whose non-final entries expire.
+
+    Usage::
+
+        JOBS_CACHE = StateAwareCache('JOBS_CACHE', is_final=_all_finished, ttl=60)
+        jobs = JOBS_CACHE.lookup(key, query_jobs, repo_name, revision)
+
+    It can also be used like a dictionary (get(), [], in, items(), clear()); these
+    do not fetch anything and ignore the age of the entries.
+    """
+
+    def __init__(self, name, is_final, ttl, max_stale, max_weight, weight=_weight,
+                 clock=time.time):
+        self.name = name
+        self.is_final = is_final
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_weight = max_weight
+        self.weight = weight
+        self.clock = clock
+        self.total_weight = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._fetching = SingleFlight(name)
+        # Keys being refreshed by a background thread
+        self._revalidating = set()
+        # Keys being fetched and the ones invalidated meanwhile (their value is outdated)
+        self._in_flight = set()
+        self._outdated = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __getitem__(self, key):
+        return self._entries[key].value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def __repr__(self):
+        return "<StateAwareCache %s: %d entries>" % (self.name, len(self._entries))
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        return default if entry is None else entry.value
+
+    def items(self):
+        with self._lock:
+            return [(key, entry.value) for key, entry in self._entries.iteritems()]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_weight = 0
+
+    def invalidate(self, key):
+        """Drop the entry of key; a fetch of key in progress will not be stored either."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.total_weight -= entry.weight
+            if key in self._in_flight:
+                self._outdated.add(key)
+        instrumentation.record_event('%s.evicted' % self.name, 'invalidated')
+
+    def _store(self, key, value):
+        # The caller holds self._lock
+        entry = _Entry(value, self.is_final(value), self.clock(), self.weight(value))
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.total_weight -= old.weight
+        self._entries[key] = entry
+        self.total_weight += entry.weight
+        self._evict()
+
+    def _evict(self):
+        # The most recent entry is kept even if it weighs more than max_weight
+        while self.total_weight > self.max_weight and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            self.total_weight -= entry.weight
+            instrumentation.record_event('%s.evicted' % self.name, 'lru')
+            LOG.debug("%s is full; we have evicted %s." % (self.name, str(key)))
+
+    def _touch(self, key):
+        """Return the entry of key and mark it as the most recently used."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def lookup(self, key, func, *args):
+        """
+        Return the value of key, calling func(*args) to fetch it if needed.
+
+        Concurrent fetches of the same key are coalesced.
+        """
+        entry = self._touch(key)
+        if entry is not None:
+            age = self.clock() - entry.stored
+            if entry.final or age < self.ttl:
+                instrumentation.cache_hit(self.name)
+                return entry.value
+
+            if age < self.ttl + self.max_stale:
+                instrumentation.cache_hit(self.name)
+                instrumentation.record_event('%s.stale' % self.name, 'served')
+                self._revalidate(key, func, args)
+                return entry.value
+
+        instrumentation.cache_miss(self.name)
+        return self._fetching.do(key, self._fetch, key, func, args)
+
+    def _fetch(self, key, func, args):
+        with self._lock:
+            self._in_flight.add(key)
+        value = None
+        fetched = False
+        try:
+            value = func(*args)
+            fetched = True
+        finally:
+            with self._lock:
+                self._in_flight.discard(key)
+                if key in self._outdated:
+                    self._outdated.discard(key)
+                elif fetched:
+                    self._store(key, value)
+        return value
+
+    def _revalidate(self, key, func, args):
+        """Fetch key again in a background thread unless one is already doing it."""
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def _refresh():
+            try:
+                self._fetching.do(key, self._fetch, key, func, args)
+            except Exception, e:
+                # The stale value is kept; the next lookup will try again
+                LOG.debug("We could not refresh %s in %s: %s" % (str(key), self.name, e))
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        LOG.debug("Refreshing %s of %s in the background." % (str(key), self.name))
+        thread = threading.Thread(target=_refresh)
+        thread.daemon = True
+        thread.start()
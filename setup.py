@@ -8,6 +8,7 @@ setup(
         'console_scripts': [
             'mozci-trigger = mozci.scripts.trigger:main',
             'mozci-triggerbyfilters = mozci.scripts.triggerbyfilters:main',
+            'mozci-daemon = mozci.daemon:main',
         ],
     },
     install_requires=[
@@ -18,7 +19,7 @@ setup(
         'progressbar>=2.3',
         'requests>=2.5.1',
         'taskcluster>=0.0.28',
-        'treeherder-client>=1.4'
+        'treeherder-client>=3.0.0'
     ],
 
     # Meta-data for upload to PyPI
@@ -47,8 +47,9 @@ class TestFetching(unittest.TestCase):
 
     def tearDown(self):
         """Clean up after every test."""
-        if os.path.exists(TMP_FILENAME):
-            os.remove(TMP_FILENAME)
+        for filename in (TMP_FILENAME, TMP_FILENAME + '.lock'):
+            if os.path.exists(filename):
+                os.remove(filename)
         # This will clean in-memory caching
         allthethings.DATA = None
 
@@ -0,0 +1,118 @@
+"""This file contains tests for mozci/sources/buildjson.py."""
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from mozci.sources import buildjson
+
+DAY_1 = 1424649600  # Mon, 23 Feb 2015 00:00:00 UTC
+DAY_2 = DAY_1 + buildjson.DAY
+
+
+def make_job(request_id, buildername, endtime):
+    return {"builder_id": request_id,
+            "starttime": endtime - 100,
+            "endtime": endtime,
+            "result": 0,
+            "request_ids": [request_id],
+            "properties": {"buildername": buildername,
+                           "revision": "4f2decfeb9c552c6323525385ccad4b450237e20"}}
+
+
+class TestQueryJobs(unittest.TestCase):
+
+    """Test the date-range queries over buildjson files."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.files = {
+            "builds-2015-02-23.js": [make_job(1, "Platform repo test", DAY_1 + 100),
+                                     make_job(2, "Platform repo build", DAY_1 + 200)],
+            "builds-2015-02-24.js": [make_job(3, "Platform repo test", DAY_2 + 100)],
+        }
+        for filename, jobs in self.files.iteritems():
+            with gzip.open(os.path.join(self.tmp_dir, filename), 'wb') as fd:
+                fd.write(json.dumps({"builds": jobs}))
+
+        def fetch_file(filepath, url, source):
+            return filepath
+
+        self.patchers = [
+            patch('mozci.sources.buildjson.path_to_file',
+                  side_effect=lambda filename: os.path.join(self.tmp_dir, filename)),
+            patch('mozci.sources.buildjson.fetch_file', side_effect=fetch_file),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_files_for_range(self):
+        """A range is covered by the day files of its UTC days."""
+        self.assertEquals(buildjson.files_for_range(DAY_1 + 10, DAY_2 + 10),
+                          ["builds-2015-02-23.js", "builds-2015-02-24.js"])
+        self.assertEquals(buildjson.files_for_range(DAY_2 - 10, DAY_2 - 5),
+                          ["builds-2015-02-23.js"])
+
+    @patch('mozci.sources.buildjson.time.time', return_value=DAY_1 + 1000)
+    def test_files_for_recent_range(self, time):
+        """The jobs which ended in the last 4 hours are also in builds-4hr.js."""
+        self.assertEquals(buildjson.files_for_range(DAY_1 + 10),
+                          ["builds-2015-02-23.js", buildjson.BUILDS_4HR_FILE])
+
+    def test_query_jobs(self):
+        """Jobs should be filtered by endtime and buildername."""
+        jobs = list(buildjson.query_jobs(DAY_1, DAY_2 + 100, processes=1))
+        self.assertEquals([job["builder_id"] for job in jobs], [1, 2, 3])
+
+        jobs = buildjson.query_jobs(DAY_1 + 150, DAY_2 + 100,
+                                    buildername="Platform repo test", processes=1)
+        self.assertEquals([job["builder_id"] for job in jobs], [3])
+
+    def test_query_jobs_in_processes(self):
+        """The files can be scanned by a pool of processes."""
+        jobs = list(buildjson.query_jobs(DAY_1, DAY_2 + 100, processes=2))
+        self.assertEquals(jobs, self.files["builds-2015-02-23.js"] +
+                          self.files["builds-2015-02-24.js"])
+
+    def test_bounded_results(self):
+        """Only `window` files should be scanned while the caller consumes a result."""
+        held = []
+
+        class Result(object):
+            def __init__(self, value):
+                self.value = value
+
+            def get(self):
+                return self.value
+
+        class Pool(object):
+            def apply_async(self, func, args):
+                held.append(args[0])
+                # The result being consumed and the ones in flight
+                assert len(held) <= 3
+                return Result(func(*args))
+
+        for result in buildjson._imap_bounded(Pool(), lambda arg: arg, range(5), 2):
+            held.remove(result)
+        self.assertEquals(held, [])
+
+    def test_duplicated_recent_jobs(self):
+        """Jobs found both in a day file and in builds-4hr.js are only returned once."""
+        now = DAY_2 + 1000
+        self.files[buildjson.BUILDS_4HR_FILE] = [make_job(3, "Platform repo test", DAY_2 + 100),
+                                                 make_job(4, "Platform repo test", DAY_2 + 900)]
+        with gzip.open(os.path.join(self.tmp_dir, buildjson.BUILDS_4HR_FILE), 'wb') as fd:
+            fd.write(json.dumps({"builds": self.files[buildjson.BUILDS_4HR_FILE]}))
+
+        with patch('mozci.sources.buildjson.time.time', return_value=now):
+            jobs = list(buildjson.query_jobs(DAY_2, processes=1))
+        self.assertEquals([job["builder_id"] for job in jobs], [3, 4])
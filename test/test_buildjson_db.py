@@ -0,0 +1,92 @@
+"""This file contains tests for mozci/sources/buildjson_db.py."""
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from mozci.sources import buildjson, buildjson_db
+
+JOBS = [
+    {"builder_id": 1,
+     "starttime": 1424649700,
+     "endtime": 1424650000,
+     "result": 0,
+     "request_ids": [100],
+     "properties": {"buildername": "Platform repo test",
+                    "revision": "4f2decfeb9c552c6323525385ccad4b450237e20",
+                    "request_ids": [100, 101]}},
+    {"builder_id": 2,
+     "starttime": 1424649800,
+     "endtime": 1424649900,
+     "result": 2,
+     "request_ids": [200],
+     "properties": {"buildername": "Platform repo build",
+                    "revision": "146071751b1e5d16b87786f6e60485222c28c202"}},
+]
+
+
+class TestJobHistory(unittest.TestCase):
+
+    """Test ingesting and querying buildjson files with a temporary database."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_patcher = patch.object(buildjson_db, 'DB_FILE',
+                                       os.path.join(self.tmp_dir, 'buildjson.db'))
+        self.db_patcher.start()
+        self.filepath = os.path.join(self.tmp_dir, 'builds-2015-02-23.js')
+        self._write(JOBS, mtime=1424736000)
+
+    def tearDown(self):
+        self.db_patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, jobs, mtime):
+        with gzip.open(self.filepath, 'wb') as fd:
+            fd.write(json.dumps({"builds": jobs}))
+        os.utime(self.filepath, (mtime, mtime))
+
+    def test_ingest_and_query_by_request_id(self):
+        """Every request id of a job (root and properties) should point to the job."""
+        self.assertEquals(buildjson_db.ingest_file(self.filepath), 2)
+        self.assertEquals(buildjson_db.query_job(101), JOBS[0])
+        self.assertEquals(buildjson_db.query_job(200, 'builds-2015-02-23.js'), JOBS[1])
+        self.assertEquals(buildjson_db.query_job(200, 'builds-4hr.js'), None)
+        self.assertEquals(buildjson_db.query_job(999), None)
+
+    def test_ingest_is_incremental(self):
+        """A file which has not changed should not be ingested again."""
+        buildjson_db.ingest_file(self.filepath)
+        self.assertEquals(buildjson_db.ingest_file(self.filepath), 0)
+
+    def test_ingest_replaces_modified_file(self):
+        """A modified file should replace the jobs previously ingested from it."""
+        buildjson_db.ingest_file(self.filepath)
+        self._write(JOBS[:1], mtime=1424737000)
+        self.assertEquals(buildjson_db.ingest_file(self.filepath), 1)
+        self.assertEquals(buildjson_db.query_job(200), None)
+        self.assertEquals(buildjson_db.ingested_files(), {'builds-2015-02-23.js': 1})
+
+    def test_query_jobs(self):
+        """query_jobs should filter by buildername, revision and endtime."""
+        buildjson_db.ingest_file(self.filepath)
+        self.assertEquals(list(buildjson_db.query_jobs()), [JOBS[1], JOBS[0]])
+        self.assertEquals(
+            list(buildjson_db.query_jobs(buildername="Platform repo test")), [JOBS[0]])
+        self.assertEquals(list(buildjson_db.query_jobs(revision="146071751b1e")), [JOBS[1]])
+        self.assertEquals(list(buildjson_db.query_jobs(start=1424649950)), [JOBS[0]])
+        self.assertEquals(list(buildjson_db.query_jobs(end=1424649950)), [JOBS[1]])
+
+    @patch('mozci.sources.buildjson.fetch_file')
+    def test_query_job_data_from_db(self, fetch_file):
+        """query_job_data should ingest the file it needs and answer from the database."""
+        fetch_file.return_value = self.filepath
+        with patch.object(buildjson, 'USE_DB', True):
+            self.assertEquals(buildjson.query_job_data(1424650000, 100), JOBS[0])
+            self.assertEquals(buildjson.query_job_data(1424650000, 200), JOBS[1])
+        # The second lookup is answered without fetching the file again
+        assert fetch_file.call_count == 1
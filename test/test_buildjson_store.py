@@ -0,0 +1,119 @@
+"""This file contains tests for mozci/sources/buildjson_store.py."""
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mock import patch
+
+from mozci.sources import buildjson_store
+
+JOBS = [
+    {"builder_id": 1,
+     "starttime": 1424649700,
+     "endtime": 1424650000,
+     "result": 0,
+     "request_ids": [100],
+     "properties": {"buildername": "Platform repo test",
+                    "revision": "4f2decfeb9c552c6323525385ccad4b450237e20",
+                    "request_ids": [100, 101]}},
+    {"builder_id": 2,
+     "starttime": 1424649800,
+     "endtime": 1424649900,
+     "result": 2,
+     "request_ids": [200],
+     "properties": {"buildername": "Platform repo build",
+                    "revision": "146071751b1e5d16b87786f6e60485222c28c202"}},
+    {"builder_id": 1,
+     "starttime": 1424651000,
+     "endtime": None,
+     "result": None,
+     "request_ids": [50],
+     "properties": {"buildername": "Platform repo test",
+                    "revision": "146071751b1e5d16b87786f6e60485222c28c202"}},
+]
+
+
+class TestBuildjsonStore(unittest.TestCase):
+
+    """Test compiling buildjson files and querying their stores."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, 'builds-2015-02-23.js')
+        self._write(JOBS, mtime=1424736000)
+        buildjson_store.STORES.clear()
+
+    def tearDown(self):
+        buildjson_store.STORES.clear()
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, jobs, mtime):
+        with gzip.open(self.filepath, 'wb') as fd:
+            fd.write(json.dumps({"builds": jobs}))
+        os.utime(self.filepath, (mtime, mtime))
+
+    def test_find_request(self):
+        """Every request id of a job (root and properties) should point to the job."""
+        store = buildjson_store.open_store(self.filepath)
+        self.assertEquals(len(store), 3)
+        self.assertEquals(store.find_request(100), JOBS[0])
+        self.assertEquals(store.find_request(101), JOBS[0])
+        self.assertEquals(store.find_request(200), JOBS[1])
+        self.assertEquals(store.find_request(50), JOBS[2])
+        self.assertEquals(store.find_request(999), None)
+        self.assertEquals(store.find_request(1), None)
+
+    def test_iter_jobs(self):
+        """Jobs should be filtered by buildername, revision and endtime."""
+        store = buildjson_store.open_store(self.filepath)
+        self.assertEquals(list(store.iter_jobs(buildername="Platform repo test")),
+                          [JOBS[0], JOBS[2]])
+        self.assertEquals(list(store.iter_jobs(revision="146071751b1e")), [JOBS[1], JOBS[2]])
+        self.assertEquals(list(store.iter_jobs(start=1424649950, end=1424650000)), [JOBS[0]])
+        self.assertEquals(list(store.iter_jobs(buildername="Platform repo")), [])
+
+    def test_compiling_does_not_block_other_stores(self):
+        """A store can be opened while another file is being compiled."""
+        other = os.path.join(self.tmp_dir, 'builds-2015-02-24.js')
+        shutil.copy(self.filepath, other)
+        buildjson_store.open_store(other)
+
+        compiling, release = threading.Event(), threading.Event()
+        compile_file = buildjson_store.compile_file
+
+        def _slow_compile(filepath, path=None):
+            compiling.set()
+            release.wait(5)
+            return compile_file(filepath, path)
+
+        with patch('mozci.sources.buildjson_store.compile_file', side_effect=_slow_compile):
+            thread = threading.Thread(target=buildjson_store.open_store, args=(self.filepath,))
+            thread.start()
+            self.assertTrue(compiling.wait(5))
+            self.assertEquals(len(buildjson_store.open_store(other)), 3)
+            self.assertTrue(thread.is_alive())
+            release.set()
+            thread.join()
+
+    def test_store_is_shared_and_refreshed(self):
+        """The store is reused until the buildjson file changes."""
+        store = buildjson_store.open_store(self.filepath)
+        self.assertTrue(buildjson_store.open_store(self.filepath) is store)
+
+        self._write(JOBS[:1], mtime=1424737000)
+        refreshed = buildjson_store.open_store(self.filepath)
+        self.assertEquals(len(refreshed), 1)
+        # The previous store can still be read
+        self.assertEquals(store.find_request(200), JOBS[1])
+
+    def test_store_compiled_by_another_process(self):
+        """An up-to-date store file on disk should be used without compiling it again."""
+        buildjson_store.compile_file(self.filepath)
+        os.utime(buildjson_store.store_path(self.filepath), (1000000, 1000000))
+
+        store = buildjson_store.open_store(self.filepath)
+        self.assertEquals(os.stat(store.path).st_mtime, 1000000)
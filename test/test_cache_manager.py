@@ -0,0 +1,83 @@
+"""This file contains tests for mozci/utils/cache_manager.py."""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from mock import patch
+
+from mozci.utils import cache_manager
+
+
+class TestCacheManager(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        patcher = patch('mozci.utils.cache_manager._cache_dir', return_value=self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.path)
+        cache_manager.ACCESSES.clear()
+        cache_manager._LAST_CHECK = 0
+
+    def _create(self, filename, size, mtime):
+        filepath = os.path.join(self.path, filename)
+        with open(filepath, 'wb') as fd:
+            fd.write('x' * size)
+        os.utime(filepath, (mtime, mtime))
+        return filepath
+
+    def test_evict_least_recently_used(self):
+        """The least recently used files should be evicted until we are under budget."""
+        self._create('builds-2015-10-01.js', 400, 1000)
+        self._create('builds-2015-10-02.js', 400, 2000)
+        recent = self._create('builds-2015-10-03.js', 400, 3000)
+        self._create('credentials.cfg', 400, 0)
+        # The oldest file has been used recently
+        cache_manager.touch(os.path.join(self.path, 'builds-2015-10-01.js'))
+
+        removed = cache_manager.evict(max_size=500)
+        self.assertEquals(removed, ['builds-2015-10-02.js', 'builds-2015-10-03.js'])
+        self.assertFalse(os.path.exists(recent))
+        # Files which are not cached data are never evicted
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'credentials.cfg')))
+
+    def test_under_budget(self):
+        """Nothing should be evicted while we are under budget."""
+        self._create('allthethings.json', 100, 1000)
+        self.assertEquals(cache_manager.evict(max_size=1000), [])
+        metadata = cache_manager.load_metadata()
+        self.assertEquals(metadata['files']['allthethings.json']['size'], 100)
+
+    @patch('mozci.utils.cache_manager.evict')
+    def test_maybe_evict_is_amortized(self, evict):
+        """maybe_evict() should not scan the directory again within EVICTION_INTERVAL."""
+        cache_manager.maybe_evict(background=False)
+        self.assertEquals(evict.call_count, 1)
+
+        # Another process has evicted recently
+        cache_manager._LAST_CHECK = 0
+        cache_manager._save_metadata({'last_eviction': cache_manager.time.time(), 'files': {}})
+        cache_manager.maybe_evict(background=False)
+        self.assertEquals(evict.call_count, 1)
+
+    def test_accesses_of_other_runs(self):
+        """A file read by an earlier run should survive an eviction by a later run."""
+        home = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, home)
+        self.path = os.path.join(home, '.mozilla', 'mozci')
+        os.makedirs(self.path)
+        old = self._create('builds-2015-10-01.js', 400, 1000)
+        self._create('builds-2015-10-02.js', 400, 2000)
+
+        # The first run reads the oldest file and exits without evicting anything
+        subprocess.check_call(
+            [sys.executable, '-c',
+             'from mozci.utils import cache_manager; cache_manager.touch(%r)' % old],
+            env=dict(os.environ, HOME=home))
+
+        with patch('mozci.utils.cache_manager._cache_dir', return_value=self.path):
+            self.assertEquals(cache_manager.evict(max_size=500), ['builds-2015-10-02.js'])
+        self.assertTrue(os.path.exists(old))
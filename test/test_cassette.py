@@ -0,0 +1,94 @@
+"""This file contains tests for mozci/utils/cassette.py and the record/replay of transport.py."""
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+from mock import patch
+
+from mozci.errors import CassetteError
+from mozci.utils import cassette, transport
+
+PUSH_INFO = '{"82366": {"changesets": ["4e030c8cf8c3"], "date": 1, "user": "nobody"}}'
+URL = 'https://hg.mozilla.org/try/json-pushes'
+
+
+def make_response(content, status_code=200, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    response._content_consumed = True
+    response.headers.update(headers or {})
+    return response
+
+
+class TestRecordReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        transport.stop()
+        shutil.rmtree(self.path)
+
+    def _record(self, responses, calls):
+        transport.record(self.path)
+        with patch('requests.get', side_effect=responses):
+            for url, kwargs in calls:
+                transport.get(url, source='pushlog', **kwargs)
+        transport.stop()
+
+    def test_replay(self):
+        """A recorded response should be replayed without reaching the network."""
+        self._record([make_response(PUSH_INFO)], [(URL, {'params': {'changeset': 'abc'}})])
+
+        transport.replay(self.path)
+        with patch('requests.get', side_effect=AssertionError("No network access")):
+            response = transport.get(URL, source='pushlog', params={'changeset': 'abc'})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json()["82366"]["user"], "nobody")
+
+    def test_unknown_request(self):
+        """Replaying a request which was not recorded should raise CassetteError."""
+        self._record([make_response(PUSH_INFO)], [(URL, {})])
+
+        transport.replay(self.path)
+        with self.assertRaises(CassetteError):
+            transport.get(URL + '?changeset=123', source='pushlog')
+
+    def test_large_bodies_are_stored_once(self):
+        """Identical large bodies should be stored once and compressed."""
+        body = '{"builds": [%s]}' % ', '.join(['{"id": 1}'] * cassette.INLINE_LIMIT)
+        self._record([make_response(body), make_response(body)],
+                     [(URL + '/a', {}), (URL + '/b', {})])
+
+        bodies = os.listdir(os.path.join(self.path, cassette.BODIES_DIR))
+        self.assertEquals(len(bodies), 1)
+        self.assertTrue(bodies[0].endswith('.gz'))
+
+        transport.replay(self.path)
+        self.assertEquals(transport.get(URL + '/b', source='buildjson').content, body)
+
+    def test_not_modified(self):
+        """A 304 should only answer conditional requests."""
+        self._record([make_response('', status_code=304), make_response(PUSH_INFO)],
+                     [(URL, {'headers': {'If-Modified-Since': 'Mon, 19 Oct 2015 00:00:00 GMT'}}),
+                      (URL, {})])
+
+        transport.replay(self.path)
+        self.assertEquals(transport.get(URL, source='buildjson').status_code, 200)
+        self.assertEquals(transport.get(
+            URL, source='buildjson',
+            headers={'If-Modified-Since': 'Mon, 19 Oct 2015 00:00:00 GMT'}).status_code, 304)
+
+    @patch('mozci.utils.cassette.time.sleep')
+    def test_recorded_latency(self, sleep):
+        """Replaying with latency='recorded' should wait as long as the original request."""
+        self._record([make_response(PUSH_INFO)], [(URL, {})])
+        elapsed = cassette.Cassette(self.path).load().interactions.values()[0][0]['elapsed']
+
+        transport.replay(self.path, latency='recorded')
+        transport.get(URL, source='pushlog')
+        sleep.assert_called_once_with(elapsed)
@@ -0,0 +1,84 @@
+"""This file contains tests for mozci/ci_manager.py."""
+import unittest
+
+from mock import Mock, patch
+
+from mozci.ci_manager import BuildAPIManager, TaskclusterManager
+
+REVISION = '146071751b1e5d16b87786f6e60485222c28c202'
+JOBS = [
+    # Finished
+    {"build_id": 1, "buildername": "Platform1 repo test", "status": 0,
+     "requests": [{"request_id": 11}]},
+    # Running
+    {"build_id": 2, "buildername": "Platform1 repo test", "status": None,
+     "requests": [{"request_id": 12}]},
+    # Pending
+    {"buildername": "Platform2 repo test", "request_id": 13},
+]
+
+
+def _task(task_id, state):
+    return {"status": {"taskId": task_id, "state": state},
+            "task": {"metadata": {"name": "task %s" % task_id}}}
+
+
+class TestBuildAPICancelAll(unittest.TestCase):
+
+    @patch('mozci.sources.buildapi.make_stop_build_request')
+    @patch('mozci.sources.buildapi.make_cancel_request')
+    @patch('mozci.sources.buildapi.query_jobs_schedule', return_value=JOBS)
+    def test_pending_and_running_jobs(self, query_jobs_schedule, make_cancel_request,
+                                      make_stop_build_request):
+        """Pending requests should be cancelled and running builds stopped."""
+        make_stop_build_request.return_value = Mock(status_code=200)
+        make_cancel_request.return_value = Mock(status_code=200)
+
+        results = BuildAPIManager().cancel_all('repo', REVISION, requests_per_second=1000)
+
+        make_cancel_request.assert_called_once_with('repo', 13, dry_run=False)
+        make_stop_build_request.assert_called_once_with('repo', 2, dry_run=False)
+        self.assertEquals(
+            sorted((r['id'], r['state'], r['result']) for r in results),
+            [(2, 'running', 'cancelled'), (13, 'pending', 'cancelled')])
+
+    @patch('mozci.sources.buildapi.make_stop_build_request')
+    @patch('mozci.sources.buildapi.make_cancel_request')
+    @patch('mozci.sources.buildapi.query_jobs_schedule', return_value=JOBS)
+    def test_failures_are_reported(self, query_jobs_schedule, make_cancel_request,
+                                   make_stop_build_request):
+        """A failed cancellation should not prevent the others."""
+        make_stop_build_request.side_effect = Exception('boom')
+        make_cancel_request.return_value = Mock(status_code=200)
+
+        results = BuildAPIManager().cancel_all('repo', REVISION, requests_per_second=1000)
+        self.assertEquals(
+            sorted((r['id'], r['result'], r['error']) for r in results),
+            [(2, 'failed', 'Exception: boom'), (13, 'cancelled', None)])
+
+
+class TestTaskclusterCancelAll(unittest.TestCase):
+
+    @patch('mozci.sources.tc.cancel_task', return_value=None)
+    @patch('mozci.sources.tc.list_task_group')
+    def test_only_active_tasks(self, list_task_group, cancel_task):
+        """Only the tasks which have not finished should be cancelled."""
+        list_task_group.return_value = [_task('a', 'completed'), _task('b', 'running'),
+                                        _task('c', 'pending'), _task('d', 'failed')]
+
+        results = TaskclusterManager().cancel_all('repo', REVISION, 'group', dry_run=True,
+                                                  requests_per_second=1000)
+
+        list_task_group.assert_called_once_with('group')
+        self.assertEquals(sorted(call[0][0] for call in cancel_task.call_args_list), ['b', 'c'])
+        self.assertEquals(sorted((r['id'], r['name'], r['result']) for r in results),
+                          [('b', 'task b', 'dry-run'), ('c', 'task c', 'dry-run')])
+
+    @patch('mozci.sources.tc.cancel_task')
+    @patch('mozci.sources.tc.list_task_group')
+    @patch('mozci.sources.tc.credentials_available', return_value=False)
+    def test_no_credentials(self, credentials_available, list_task_group, cancel_task):
+        """Without credentials we should not try to cancel every task."""
+        self.assertEquals(TaskclusterManager().cancel_all('repo', REVISION, 'group'), None)
+        assert not list_task_group.called
+        assert not cancel_task.called
@@ -0,0 +1,95 @@
+"""This file contains tests for mozci/utils/concurrency.py."""
+import threading
+import time
+import unittest
+
+from mock import patch
+
+from mozci.sources import buildjson
+from mozci.utils.concurrency import RateLimiter, SingleFlight, map_concurrently
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_are_coalesced(self):
+        """Threads asking for the same key while it is in flight should share one call."""
+        single_flight = SingleFlight('test')
+        calls = []
+
+        def load(key):
+            calls.append(key)
+            time.sleep(0.1)
+            return [key]
+
+        def _load(key):
+            return single_flight.do(key, load, key)
+
+        results = map_concurrently(_load, ['a', 'a', 'a', 'b'])
+        self.assertEquals(sorted(calls), ['a', 'b'])
+        self.assertEquals(results, [['a'], ['a'], ['a'], ['b']])
+        self.assertTrue(results[0] is results[1])
+
+    def test_errors_are_shared(self):
+        """Threads waiting for a call which fails should get its exception."""
+        single_flight = SingleFlight('test')
+        started = threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError("failed")
+
+        def _call():
+            try:
+                single_flight.do('key', fail)
+            except ValueError, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=_call) for _ in range(2)]
+        threads[0].start()
+        started.wait()
+        threads[1].start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(len(errors), 2)
+        self.assertTrue(errors[0] is errors[1])
+
+    def test_later_calls_are_not_coalesced(self):
+        """Once a call is done the next one for the same key runs again."""
+        single_flight = SingleFlight('test')
+        self.assertEquals(single_flight.do('key', lambda: 1), 1)
+        self.assertEquals(single_flight.do('key', lambda: 2), 2)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_calls_are_spread(self):
+        """Calls going over the rate should sleep until their turn."""
+        sleeps = []
+        limiter = RateLimiter(4, clock=lambda: 100.0, sleep=sleeps.append)
+        for _ in range(3):
+            limiter.wait()
+        self.assertEquals(sleeps, [0.25, 0.5])
+
+
+class TestBuildjsonSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        buildjson.BUILDS_CACHE.clear()
+
+    def tearDown(self):
+        buildjson.BUILDS_CACHE.clear()
+
+    def test_file_loaded_once(self):
+        """Threads asking for the same buildjson file should load it once."""
+        def slow_load(filepath, url, source):
+            time.sleep(0.1)
+            return {'builds': [{'request_ids': [1]}]}
+
+        with patch('mozci.sources.buildjson.load_file', side_effect=slow_load) as load_file:
+            results = map_concurrently(buildjson._fetch_data, ['builds-2015-10-19.js'] * 4)
+
+        self.assertEquals(load_file.call_count, 1)
+        self.assertEquals(results, [[{'request_ids': [1]}]] * 4)
@@ -0,0 +1,97 @@
+"""This file contains tests for mozci/daemon.py and mozci/daemon_client.py."""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mock import patch
+
+from mozci import daemon, mozci, query_jobs
+from mozci.daemon_client import DaemonClient, DaemonQueryApi
+from mozci.errors import BuildjsonError, DaemonError
+from mozci.query_jobs import TreeherderApi
+
+
+class TestDaemon(unittest.TestCase):
+
+    """Start a daemon on a temporary Unix socket and talk to it through the client."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        socket_path = os.path.join(self.tmp_dir, 'mozci.sock')
+        self.server = daemon.create_server(socket_path=socket_path)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.client = DaemonClient('unix:%s' % socket_path)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_ping(self):
+        """The daemon should be available."""
+        assert self.client.available()
+
+    @patch('mozci.mozci.query_builders', return_value=['Platform repo test'])
+    def test_query_builders(self, query_builders):
+        """Methods should be called in the daemon with the client's arguments."""
+        self.assertEquals(self.client.query_builders(repo_name='repo'), ['Platform repo test'])
+        query_builders.assert_called_once_with(u'repo')
+
+    @patch('mozci.query_jobs.BuildApi.get_matching_jobs', return_value=[{'status': 0}])
+    @patch('mozci.query_jobs.BuildApi.get_job_status', return_value=0)
+    def test_query_api(self, get_job_status, get_matching_jobs):
+        """DaemonQueryApi should behave like the query source it proxies."""
+        query_api = DaemonQueryApi(self.client)
+        jobs = query_api.get_matching_jobs('repo', 'rev', 'Platform repo test')
+        self.assertEquals(jobs, [{'status': 0}])
+        self.assertEquals(query_api.get_job_status(jobs[0]), 0)
+
+    @patch('mozci.mozci.find_backfill_revlist', return_value=['rev'])
+    def test_find_backfill_revlist(self, find_backfill_revlist):
+        """The daemon should backfill with the query source chosen by the client."""
+        query_api = DaemonQueryApi(self.client, 'treeherder')
+        self.assertEquals(query_api.find_backfill_revlist('Platform repo test', 'rev', 5),
+                          ['rev'])
+        self.assertTrue(isinstance(find_backfill_revlist.call_args[1]['query_api'],
+                                   TreeherderApi))
+
+    @patch('mozci.platforms.determine_upstream_builder', side_effect=ValueError('bad'))
+    def test_error(self, determine_upstream_builder):
+        """Exceptions in the daemon should be raised as DaemonError in the client."""
+        with self.assertRaises(DaemonError):
+            self.client.determine_upstream_builder(buildername='Platform repo test')
+
+    @patch('mozci.query_jobs.BuildApi.get_job_status', side_effect=BuildjsonError('missing'))
+    def test_mozci_error(self, get_job_status):
+        """mozci.errors exceptions should be raised as themselves in the client."""
+        with self.assertRaises(BuildjsonError):
+            DaemonQueryApi(self.client).get_job_status({'request_id': 1})
+
+    @patch('mozci.mozci.query_builders', return_value=['Platform repo test'])
+    def test_valid_builder(self, query_builders):
+        """The builders should be checked in the daemon instead of being sent over."""
+        with patch('mozci.mozci.DAEMON', self.client):
+            self.assertTrue(mozci.valid_builder('Platform repo test'))
+        self.assertFalse(self.client.valid_builder(buildername='Platform repo build'))
+
+    def test_invalidate_jobs(self):
+        """Jobs triggered through a client should be forgotten by the daemon too."""
+        query_jobs.JOBS_CACHE[('repo', 'a' * 12)] = [{'status': 0}]
+        with patch('mozci.query_jobs.DAEMON') as client:
+            query_jobs.invalidate_jobs('repo', 'a' * 12)
+        client.call.assert_called_once_with('invalidate_jobs', repo_name='repo',
+                                            revision='a' * 12)
+
+        # What the daemon does when it is called
+        query_jobs.JOBS_CACHE[('repo', 'a' * 12)] = [{'status': 0}]
+        self.client.invalidate_jobs(repo_name='repo', revision='a' * 12)
+        self.assertFalse(('repo', 'a' * 12) in query_jobs.JOBS_CACHE)
+
+    def test_unreachable(self):
+        """A client pointing to nowhere should not be available."""
+        client = DaemonClient('unix:%s' % os.path.join(self.tmp_dir, 'nowhere.sock'))
+        assert not client.available()
@@ -0,0 +1,68 @@
+"""This file contains tests for mozci/utils/instrumentation.py."""
+import json
+import unittest
+
+from mock import patch, Mock
+
+from mozci.sources import pushlog
+from mozci.utils import instrumentation
+
+GOOD_REVISION = '{"82366": {"changesets": ["4e030c8cf8c3"], "date": 1, "user": "nobody"}}'
+
+
+def mock_response(content, status_code=200):
+    response = Mock()
+    response.content = content
+    response.status_code = status_code
+    response.json = lambda: json.loads(content)
+    return response
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        instrumentation.reset()
+        pushlog.VALID_CACHE = {}
+
+    @patch('requests.get', return_value=mock_response(GOOD_REVISION))
+    def test_requests_and_caches(self, get):
+        """Requests made by the sources and cache lookups should be recorded."""
+        pushlog.valid_revision("https://hg.mozilla.org/try", "4e030c8cf8c3")
+        pushlog.valid_revision("https://hg.mozilla.org/try", "4e030c8cf8c3")
+
+        metrics = instrumentation.to_json()
+        self.assertEquals(metrics['requests']['pushlog']['calls'], 1)
+        self.assertEquals(metrics['requests']['pushlog']['bytes'], len(GOOD_REVISION))
+        self.assertEquals(metrics['requests']['pushlog']['latency']['count'], 1)
+        self.assertEquals(metrics['caches']['VALID_CACHE'],
+                          {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_histogram_buckets(self):
+        """Latencies should be counted in the right bucket."""
+        instrumentation.record_request('buildapi', 0.005)
+        instrumentation.record_request('buildapi', 0.2, status_code=500)
+        instrumentation.record_request('buildapi', 60)
+
+        stats = instrumentation.to_json()['requests']['buildapi']
+        self.assertEquals(stats['errors'], 1)
+        self.assertEquals(stats['latency']['buckets']['le_10'], 1)
+        self.assertEquals(stats['latency']['buckets']['le_250'], 1)
+        self.assertEquals(stats['latency']['buckets']['inf'], 1)
+
+    def test_timed_request_failure(self):
+        """A failing request made through a third party client counts as an error."""
+        with self.assertRaises(ValueError):
+            with instrumentation.timed_request('treeherder'):
+                raise ValueError()
+        self.assertEquals(instrumentation.to_json()['requests']['treeherder']['errors'], 1)
+
+    def test_statsd(self):
+        """The statsd export should contain counters for requests, caches and events."""
+        instrumentation.record_request('buildjson', 0.1, nbytes=10)
+        instrumentation.cache_miss('BUILDS_CACHE')
+        instrumentation.record_event('load_file.mode', 'full')
+        lines = instrumentation.to_statsd()
+        assert 'mozci.requests.buildjson.calls:1|c' in lines
+        assert 'mozci.requests.buildjson.bytes:10|c' in lines
+        assert 'mozci.caches.BUILDS_CACHE.misses:1|c' in lines
+        assert 'mozci.events.load_file.mode.full:1|c' in lines
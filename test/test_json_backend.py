@@ -0,0 +1,42 @@
+"""This file contains tests for mozci/utils/json_backend.py."""
+import unittest
+
+from StringIO import StringIO
+
+from mozci.utils import json_backend
+
+DATA = '{"builds": [{"request_ids": [1]}, {"request_ids": [2]}]}'
+
+
+class TestJsonBackend(unittest.TestCase):
+
+    def tearDown(self):
+        json_backend.set_decoder()
+        json_backend.set_streaming_backend()
+
+    def test_fallback_backends_are_available(self):
+        """The standard library and pure python ijson can always be used."""
+        self.assertEquals(json_backend.available(json_backend.DECODERS,
+                                                 json_backend.import_decoder)[-1], 'json')
+        self.assertEquals(json_backend.available(json_backend.STREAMING_BACKENDS,
+                                                 json_backend.import_streaming_backend)[-1],
+                          'python')
+
+    def test_forced_backends(self):
+        """Every backend should decode the same documents."""
+        json_backend.set_decoder('json')
+        json_backend.set_streaming_backend('python')
+        self.assertEquals(json_backend.DECODER, 'json')
+        self.assertEquals(json_backend.loads(DATA)['builds'][1]['request_ids'], [2])
+        self.assertEquals([b['request_ids'] for b in json_backend.items(StringIO(DATA),
+                                                                        'builds.item')],
+                          [[1], [2]])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            json_backend.set_decoder('yaml')
+
+    def test_invalid_document(self):
+        """All decoders raise ValueError on invalid documents."""
+        with self.assertRaises(ValueError):
+            json_backend.loads('{"builds": [')
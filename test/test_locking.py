@@ -0,0 +1,75 @@
+"""This file contains tests for mozci/utils/locking.py and how downloads use it."""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from mock import patch, Mock
+
+from mozci.utils import transfer
+
+CONTENT = '{"builds": []}'
+LAST_MODIFIED = 'Mon, 19 Oct 2015 00:00:00 GMT'
+
+
+def mock_download(chunks=(CONTENT,)):
+    response = Mock()
+    response.status_code = 200
+    response.url = 'http://builddata/builds-4hr.js.gz'
+    response.headers = {'Content-Length': str(len(CONTENT)), 'last-modified': LAST_MODIFIED}
+
+    def iter_content(chunk_size):
+        for chunk in chunks:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    response.iter_content = iter_content
+    return response
+
+
+@patch('mozci.utils.transfer.SHOW_PROGRESS_BAR', False)
+class TestSharedDownloads(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.path, 'builds-4hr.js')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_single_download(self):
+        """A download should not be repeated by those waiting for it to finish."""
+        downloading = threading.Event()
+        finish = threading.Event()
+
+        def slow_get(url, **kwargs):
+            downloading.set()
+            finish.wait()
+            return mock_download()
+
+        with patch('requests.get', side_effect=slow_get) as get:
+            first = threading.Thread(target=transfer.fetch_file, args=(self.filepath, 'url'))
+            first.start()
+            downloading.wait()
+            second = threading.Thread(target=transfer.fetch_file, args=(self.filepath, 'url'))
+            second.start()
+            # Give the second thread time to wait for the lock
+            time.sleep(0.05)
+            finish.set()
+            first.join()
+            second.join()
+
+        self.assertEquals(get.call_count, 1)
+        with open(self.filepath) as fd:
+            self.assertEquals(fd.read(), CONTENT)
+
+    def test_interrupted_download(self):
+        """An interrupted download should leave neither the file nor a temporary file."""
+        with patch('requests.get', return_value=mock_download(['{"bu', IOError()])):
+            with self.assertRaises(IOError):
+                transfer.fetch_file(self.filepath, 'url')
+
+        self.assertEquals([f for f in os.listdir(self.path) if not f.endswith('.lock')], [])
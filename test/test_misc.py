@@ -0,0 +1,49 @@
+"""This file contains tests for mozci/utils/misc.py."""
+import unittest
+
+from mock import patch, Mock
+
+from mozci.utils import misc
+
+PACKAGE_URL = 'https://queue.taskcluster.net/v1/task/abc/artifacts/public/build/target.tar.bz2'
+TESTS_URL = 'https://queue.taskcluster.net/v1/task/abc/artifacts/public/build/target.tests.zip'
+
+
+def mock_head(ok):
+    response = Mock()
+    response.ok = ok
+    response.reason = 'OK' if ok else 'Not Found'
+    return response
+
+
+@patch('mozci.utils.misc.get_credentials', return_value=None)
+class TestAllUrlsReachable(unittest.TestCase):
+
+    def setUp(self):
+        misc.REACHABLE_CACHE.clear()
+
+    @patch('requests.head', return_value=mock_head(True))
+    def test_reachable_urls_are_cached(self, head, get_credentials):
+        """Checking the artifacts of a build again should not make any request."""
+        self.assertTrue(misc._all_urls_reachable([PACKAGE_URL, TESTS_URL]))
+        self.assertTrue(misc._all_urls_reachable([PACKAGE_URL, TESTS_URL]))
+        self.assertEquals(head.call_count, 2)
+
+    @patch('requests.head', side_effect=lambda url, **kwargs: mock_head(url == PACKAGE_URL))
+    def test_unreachable_url(self, head, get_credentials):
+        """A single unreachable URL makes the build unusable."""
+        self.assertFalse(misc._all_urls_reachable([PACKAGE_URL, TESTS_URL]))
+
+    @patch('mozci.utils.misc.time.time')
+    @patch('requests.head', return_value=mock_head(False))
+    def test_unreachable_urls_expire_sooner(self, head, time, get_credentials):
+        """Unreachable URLs should be checked again after UNREACHABLE_TTL."""
+        time.return_value = 1000
+        misc._all_urls_reachable([PACKAGE_URL])
+        time.return_value = 1000 + misc.UNREACHABLE_TTL - 1
+        misc._all_urls_reachable([PACKAGE_URL])
+        self.assertEquals(head.call_count, 1)
+
+        time.return_value = 1000 + misc.UNREACHABLE_TTL
+        misc._all_urls_reachable([PACKAGE_URL])
+        self.assertEquals(head.call_count, 2)
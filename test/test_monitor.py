@@ -0,0 +1,132 @@
+"""This file contains tests for mozci/monitor.py."""
+import unittest
+
+from mock import patch, Mock
+
+from mozci.monitor import BuildMonitor
+from mozci.query_jobs import SUCCESS, FAILURE
+
+BUILD = "Platform repo build"
+FILES = ["http://server/package.tar.bz2", "http://server/tests.zip"]
+
+
+class FakeClock(object):
+    """A clock which only moves when sleep is called."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def build_job(status=None, endtime=None):
+    job = {"buildername": BUILD,
+           "endtime": endtime,
+           "requests": [{"complete_at": endtime, "request_id": 1, "revision": "rev"}]}
+    if status != "pending":
+        job["status"] = status
+    return job
+
+
+@patch('mozci.monitor._all_urls_reachable', return_value=True)
+@patch('mozci.monitor._find_files', return_value=FILES)
+@patch('mozci.query_jobs.BuildApi._is_coalesced', return_value=SUCCESS)
+class TestBuildMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.trigger = Mock()
+
+    def _monitor(self, schedules):
+        """Every poll of the stub self-serve returns the next schedule (the last one repeats)."""
+        schedules = list(schedules)
+
+        def fetch_jobs(repo_name, revision):
+            if len(schedules) > 1:
+                return schedules.pop(0)
+            return schedules[0]
+
+        return BuildMonitor(min_interval=10, max_interval=40, max_wait=1000,
+                            clock=self.clock.time, sleep=self.clock.sleep,
+                            fetch_jobs=fetch_jobs, trigger=self.trigger)
+
+    def test_trigger_once_build_is_done(self, _is_coalesced, find_files, reachable):
+        """Test jobs should be triggered with the files of the build once it is done."""
+        monitor = self._monitor([[build_job("pending")],
+                                 [build_job(None)],
+                                 [build_job(SUCCESS, 1100)]])
+        monitor.add("repo", "rev", BUILD, "Platform repo test-1", times=2)
+        monitor.add("repo", "rev", BUILD, "Platform repo test-2")
+        monitor.run()
+
+        self.assertEquals(monitor.polls, 3)
+        self.assertEquals(self.trigger.call_count, 2)
+        self.trigger.assert_any_call(revision="rev", buildername="Platform repo test-1",
+                                     times=2, files=FILES, dry_run=False,
+                                     extra_properties=None)
+        self.assertEquals(monitor.outstanding(), 0)
+
+    def test_backoff_while_nothing_changes(self, _is_coalesced, find_files, reachable):
+        """The polling interval should double while the build keeps running."""
+        monitor = self._monitor([[build_job(None)]] * 6 + [[build_job(SUCCESS, 1100)]])
+        monitor.add("repo", "rev", BUILD, "Platform repo test-1")
+        monitor.run()
+
+        # 10 (first poll) + 10 + 20 + 40 + 40 + 40 + 40
+        self.assertEquals(self.clock.now, 1000 + 200)
+        self.assertEquals(monitor.polls, 7)
+
+    def test_one_poll_per_revision(self, _is_coalesced, find_files, reachable):
+        """Many outstanding test jobs on one revision should cost one query per poll."""
+        monitor = self._monitor([[build_job(SUCCESS, 1100)]])
+        for i in range(1000):
+            monitor.add("repo", "rev", BUILD, "Platform repo test-%d" % i)
+        monitor.run()
+
+        self.assertEquals(monitor.polls, 1)
+        self.assertEquals(self.trigger.call_count, 1000)
+
+    def test_failed_build_without_files(self, _is_coalesced, find_files, reachable):
+        """We should stop waiting on a build which finished without files."""
+        find_files.return_value = []
+        monitor = self._monitor([[build_job(FAILURE, 1100)]])
+        monitor.add("repo", "rev", BUILD, "Platform repo test-1")
+        monitor.run()
+
+        self.assertEquals(monitor.polls, 1)
+        assert not self.trigger.called
+
+    def test_give_up(self, _is_coalesced, find_files, reachable):
+        """We should give up on a build which never shows up."""
+        monitor = self._monitor([[]])
+        monitor.add("repo", "rev", BUILD, "Platform repo test-1")
+        monitor.run()
+
+        assert self.clock.now >= 1000 + 1000
+        assert not self.trigger.called
+
+    def test_poll_errors(self, _is_coalesced, find_files, reachable):
+        """A failed poll should be retried later instead of ending the monitoring."""
+        schedules = [IOError('self-serve is down'), [build_job(SUCCESS, 1100)]]
+
+        def fetch_jobs(repo_name, revision):
+            result = schedules.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        monitor = BuildMonitor(min_interval=10, max_interval=40, max_wait=1000,
+                               clock=self.clock.time, sleep=self.clock.sleep,
+                               fetch_jobs=fetch_jobs, trigger=self.trigger)
+        monitor.add("repo", "rev", BUILD, "Platform repo test-1", extra_properties={'a': 1})
+        monitor.run()
+
+        # 10 (first poll) + 20 (backoff)
+        self.assertEquals(self.clock.now, 1000 + 30)
+        self.trigger.assert_called_once_with(revision="rev", buildername="Platform repo test-1",
+                                             times=1, files=FILES, dry_run=False,
+                                             extra_properties={'a': 1})
@@ -1,13 +1,17 @@
 """This file contains tests for mozci/mozci.py."""
 
 import json
+import os
 import pytest
+import shutil
+import tempfile
+import time
 import unittest
 
 import mozci.mozci
 from mozci.query_jobs import SUCCESS, PENDING, RUNNING, COALESCED
 
-from mock import patch
+from mock import patch, Mock
 
 
 MOCK_JSON = '''{
@@ -121,3 +125,220 @@ class TestJobValidation(unittest.TestCase):
     def test_status_summary_coalesced(self, get_status):
         """Test _status_summary with a coalesced state."""
         assert mozci.mozci._status_summary(self.jobs) == (0, 0, 0, 1, 0)
+
+
+class TestCountJobs(unittest.TestCase):
+    """Test that the buildjson-backed statuses are only resolved when they matter."""
+
+    JOBS = [{'status': SUCCESS}, {'status': SUCCESS}, {}, {'status': 2}]
+
+    @patch('mozci.query_jobs.BuildApi._is_coalesced', return_value=SUCCESS)
+    def test_cheap_statuses_first(self, is_coalesced):
+        """Pending and failed jobs are enough without looking at the successful ones."""
+        self.assertEquals(
+            mozci.mozci._count_jobs(self.JOBS, mozci.mozci.POTENTIAL_STATUSES, needed=2), 2)
+        self.assertEquals(is_coalesced.call_count, 0)
+
+    @patch('mozci.query_jobs.BuildApi._is_coalesced', side_effect=[COALESCED, SUCCESS])
+    def test_deferred_statuses(self, is_coalesced):
+        """Successful jobs are resolved one at a time until we have enough jobs."""
+        self.assertEquals(mozci.mozci._count_jobs(self.JOBS, (SUCCESS,), needed=1), 1)
+        self.assertEquals(is_coalesced.call_count, 2)
+
+
+@patch('mozci.mozci.VALIDATE', False)
+@patch('mozci.mozci.query_repo_name_from_buildername', return_value='repo')
+@patch('mozci.sources.buildapi.query_repo_url', return_value='https://hg/repo')
+class TestTriggerMissingJobs(unittest.TestCase):
+    """Test that trigger_missing_jobs_for_revision looks at every build job once."""
+
+    BUILDERS = ['Platform1 repo build', 'Platform1 repo test1', 'Platform1 repo test2',
+                'Platform2 repo build', 'Platform2 repo test1']
+
+    def _upstream_builder(self, buildername):
+        return buildername.replace('test1', 'build').replace('test2', 'build')
+
+    def test_build_jobs_looked_at_once(self, query_repo_url, query_repo_name):
+        """Test jobs sharing a build job should reuse what we found about it."""
+        build = ({'status': SUCCESS}, None, None, ['https://files/build.tar.bz2'])
+        with patch('mozci.mozci.list_builders', return_value=self.BUILDERS), \
+                patch('mozci.mozci.determine_upstream_builder',
+                      side_effect=self._upstream_builder), \
+                patch('mozci.query_jobs.BuildApi.get_matching_jobs', return_value=[]), \
+                patch('mozci.mozci._find_build_jobs', return_value=build) as find_build_jobs, \
+                patch('mozci.mozci.trigger', return_value=None) as trigger, \
+                patch('mozci.mozci.cache_manager.maybe_evict'):
+            mozci.mozci.trigger_missing_jobs_for_revision('repo', 'rev')
+
+        self.assertEquals(sorted(c[0][2] for c in find_build_jobs.call_args_list),
+                          ['Platform1 repo build', 'Platform2 repo build'])
+        self.assertEquals(sorted(c[0][0] for c in trigger.call_args_list), self.BUILDERS)
+
+
+@patch('mozci.mozci.VALIDATE', False)
+@patch('mozci.mozci.query_repo_name_from_buildername', return_value='repo')
+@patch('mozci.sources.buildapi.query_repo_url', return_value='https://hg/repo')
+@patch('mozci.mozci.determine_upstream_builder', return_value='Platform repo build')
+class TestTriggerJobMonitor(unittest.TestCase):
+    """Test that trigger_job only monitors build jobs which are on their way."""
+
+    def _trigger_job(self, build_jobs, **kwargs):
+        monitor = Mock()
+        with patch('mozci.mozci._find_build_jobs', return_value=build_jobs), \
+                patch('mozci.mozci._unique_build_request', return_value=True), \
+                patch('mozci.mozci.trigger', return_value=None):
+            mozci.mozci.trigger_job('rev', 'Platform repo test', monitor=monitor,
+                                    extra_properties={'a': 1}, **kwargs)
+        return monitor
+
+    def test_requested_build(self, upstream_builder, query_repo_url, query_repo_name):
+        """A build job we request should be monitored with the extra properties."""
+        monitor = self._trigger_job((None, None, None, None))
+        monitor.add.assert_called_once_with(
+            repo_name='repo', revision='rev', build_buildername='Platform repo build',
+            buildername='Platform repo test', times=1, extra_properties={'a': 1})
+
+    def test_running_build(self, upstream_builder, query_repo_url, query_repo_name):
+        """A running build job should be monitored."""
+        monitor = self._trigger_job((None, {'status': None}, None, None))
+        self.assertEquals(monitor.add.call_count, 1)
+
+    def test_existing_only(self, upstream_builder, query_repo_url, query_repo_name):
+        """Nothing should be monitored if we did not request a build job."""
+        monitor = self._trigger_job((None, None, None, None), trigger_build_if_missing=False)
+        assert not monitor.add.called
+
+
+@patch('mozci.mozci.VALIDATE', False)
+@patch('mozci.mozci.query_repo_name_from_buildername', return_value='repo')
+class TestPlan(unittest.TestCase):
+    """Test planning and executing triggers."""
+
+    def setUp(self):
+        # Planning looks at the builds requested by other processes
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patcher = patch('mozci.utils.scheduling_ledger.LEDGER_FILE',
+                             os.path.join(self.tmp_dir, 'scheduling.db'))
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def _matching_jobs(self, repo_name, revision, buildername):
+        if (revision, buildername) == ('rev1', 'Platform repo test1'):
+            # A job which was coalesced (see _is_coalesced below)
+            return [{'status': SUCCESS, 'request_id': 10}]
+        return []
+
+    def test_make_plan(self, query_repo_name):
+        """Existing jobs are retriggered and a missing build job is only requested once."""
+        goals = [('Platform repo test1', ['rev1', 'rev2'], 2),
+                 ('Platform repo test2', ['rev2'], 1)]
+        with patch('mozci.query_jobs.BuildApi.get_matching_jobs',
+                   side_effect=self._matching_jobs), \
+                patch('mozci.query_jobs.BuildApi._is_coalesced', return_value=COALESCED), \
+                patch('mozci.mozci.determine_upstream_builder',
+                      return_value='Platform repo build'), \
+                patch('mozci.mozci._find_build_jobs', return_value=(None, None, None, None)), \
+                patch('mozci.mozci.is_downstream', return_value=False):
+            plan = mozci.mozci.make_plan(goals)
+
+        self.assertEquals(json.loads(json.dumps(plan)), [
+            {'type': 'retrigger', 'repo_name': 'repo', 'revision': 'rev1',
+             'buildername': 'Platform repo test1', 'count': 2, 'request_id': 10},
+            {'type': 'trigger_build', 'repo_name': 'repo', 'revision': 'rev2',
+             'buildername': 'Platform repo build', 'count': 1, 'files': None,
+             'properties': None, 'waiting': ['Platform repo test1', 'Platform repo test2']}])
+
+    def test_build_jobs_looked_at_once(self, query_repo_name):
+        """Test jobs planned concurrently should not look at their build job more than once."""
+        def find_build_jobs(repo_name, revision, build_buildername):
+            # Give the other threads time to ask for the same build job
+            time.sleep(0.05)
+            return (None, None, None, None)
+
+        goals = [('Platform repo test%d' % i, ['rev2'], 1) for i in range(8)]
+        with patch('mozci.query_jobs.BuildApi.get_matching_jobs', return_value=[]), \
+                patch('mozci.mozci.determine_upstream_builder',
+                      return_value='Platform repo build'), \
+                patch('mozci.mozci._find_build_jobs',
+                      side_effect=find_build_jobs) as _find_build_jobs, \
+                patch('mozci.mozci.is_downstream', return_value=False):
+            plan = mozci.mozci.make_plan(goals)
+
+        _find_build_jobs.assert_called_once_with('repo', 'rev2', 'Platform repo build')
+        self.assertEquals([(a['type'], len(a['waiting'])) for a in plan], [('trigger_build', 8)])
+
+    def test_jobs_without_request_id(self, query_repo_name):
+        """Jobs we can't retrigger (no request_id) should be triggered instead."""
+        build = ({'status': SUCCESS}, None, None, ['https://files/build.tar.bz2'])
+        with patch('mozci.query_jobs.BuildApi.get_matching_jobs',
+                   side_effect=self._matching_jobs), \
+                patch('mozci.query_jobs.BuildApi._is_coalesced', return_value=COALESCED), \
+                patch('mozci.query_jobs.BuildApi.get_buildapi_request_ids',
+                      return_value=[None]), \
+                patch('mozci.mozci.determine_upstream_builder',
+                      return_value='Platform repo build'), \
+                patch('mozci.mozci._find_build_jobs', return_value=build):
+            plan = mozci.mozci.make_plan([('Platform repo test1', ['rev1'], 2)])
+
+        self.assertEquals(plan, [
+            {'type': 'trigger', 'repo_name': 'repo', 'revision': 'rev1',
+             'buildername': 'Platform repo test1', 'count': 2,
+             'files': ['https://files/build.tar.bz2'], 'properties': None}])
+
+    def test_invalid_builder(self, query_repo_name):
+        """The builders should be validated before planning anything."""
+        with patch('mozci.mozci.VALIDATE', True), \
+                patch('mozci.mozci.valid_builder', return_value=False):
+            with pytest.raises(mozci.mozci.MozciError):
+                mozci.mozci.make_plan([('Platform repo test1', ['rev1'], 1)])
+
+    def test_execute_plan(self, query_repo_name):
+        """Every job of a trigger action needs a request; retriggers need one."""
+        plan = [{'type': 'retrigger', 'repo_name': 'repo', 'revision': 'rev1',
+                 'buildername': 'Platform repo test1', 'count': 2, 'request_id': 10},
+                {'type': 'trigger', 'repo_name': 'repo', 'revision': 'rev2',
+                 'buildername': 'Platform repo test1', 'count': 3, 'files': ['a', 'b'],
+                 'properties': None}]
+        with patch('mozci.sources.buildapi.make_retrigger_request') as retrigger, \
+                patch('mozci.mozci.trigger', return_value=None) as trigger, \
+                patch('mozci.mozci.cache_manager.maybe_evict'):
+            mozci.mozci.execute_plan(plan, dry_run=True, requests_per_second=None)
+
+        retrigger.assert_called_once_with('repo', 10, count=2, dry_run=True)
+        self.assertEquals(trigger.call_count, 3)
+        trigger.assert_called_with('Platform repo test1', 'rev2', ['a', 'b'], True, None)
+
+
+class TestFilterBackfillRevlist(unittest.TestCase):
+    """Test that probing revisions concurrently gives the same results as a linear scan."""
+
+    REVISIONS = ['rev%03d' % i for i in range(50)]
+
+    def _filter(self, good_revisions, max_probes):
+        def good_job_on_revision(repo_name, buildername, revision, only_successful,
+                                 query_api=None):
+            return revision in good_revisions
+
+        with patch('mozci.mozci._good_job_on_revision', side_effect=good_job_on_revision) as m:
+            revlist = mozci.mozci._filter_backfill_revlist(
+                'Platform repo test', self.REVISIONS, max_probes=max_probes)
+        return revlist, m.call_count
+
+    @patch('mozci.mozci.query_repo_name_from_buildername', return_value='repo')
+    def test_same_results_as_linear_scan(self, query_repo_name):
+        """For any position of the good jobs the results should match the linear scan."""
+        for good_revisions in ([], ['rev000'], ['rev001'], ['rev006', 'rev007'],
+                               ['rev030'], ['rev049'], ['rev020', 'rev003']):
+            linear, _ = self._filter(good_revisions, max_probes=1)
+            galloping, _ = self._filter(good_revisions, max_probes=8)
+            self.assertEquals(linear, galloping)
+
+    @patch('mozci.mozci.query_repo_name_from_buildername', return_value='repo')
+    def test_newest_revision_is_good(self, query_repo_name):
+        """If the newest revision has a good job we should only probe once."""
+        revlist, probes = self._filter(['rev000'], max_probes=8)
+        self.assertEquals(revlist, [])
+        self.assertEquals(probes, 1)
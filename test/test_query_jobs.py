@@ -126,7 +126,7 @@ class TestBuildApiGetAllJobs(unittest.TestCase):
     def setUp(self):
         self.query_api = BuildApi()
         buildapi.JOBS_CACHE = {}
-        query_jobs.JOBS_CACHE = {}
+        query_jobs.JOBS_CACHE.clear()
 
     @patch('requests.get', return_value=mock_response(JOBS_SCHEDULE, 200))
     @patch('mozci.sources.pushlog.valid_revision', return_value=True)
@@ -279,3 +279,156 @@ class TestBuildApiGetMatchingJobs(unittest.TestCase):
             self.query_api.get_matching_jobs(
                 "try", "146071751b1e",
                 'Invalid buildername'), [])
+
+
+def mock_artifacts(repo_name, job_id__in, name):
+    return [{"job_id": int(job_id), "name": name, "blob": {"request_id": int(job_id) + 1000}}
+            for job_id in job_id__in.split(',') if job_id != '3']
+
+
+class TestTreeherderApiGetBuildapiRequestIds(unittest.TestCase):
+    """Test resolving the buildapi request_ids of Treeherder jobs in bulk."""
+
+    def setUp(self):
+        query_jobs.REQUEST_ID_CACHE.clear()
+        self.query_api = TreeherderApi()
+        self.query_api.treeherder_client = Mock()
+        self.query_api.treeherder_client.get_artifacts.side_effect = mock_artifacts
+
+    def tearDown(self):
+        query_jobs.REQUEST_ID_CACHE.clear()
+
+    def test_batched_lookup(self):
+        """The artifacts of many jobs should be fetched in one request and cached."""
+        jobs = [{"id": 1}, {"id": 2}, {"id": 3}]
+        self.assertEquals(self.query_api.get_buildapi_request_ids("try", jobs),
+                          [1001, 1002, None])
+        self.assertEquals(self.query_api.get_buildapi_request_id("try", {"id": 2}), 1002)
+        self.assertEquals(self.query_api.treeherder_client.get_artifacts.call_count, 1)
+
+    @patch('mozci.query_jobs.ARTIFACTS_BATCH', 2)
+    def test_batches(self):
+        """Jobs are resolved ARTIFACTS_BATCH at a time."""
+        jobs = [{"id": job_id} for job_id in (4, 5, 6, 7, 8)]
+        self.assertEquals(self.query_api.get_buildapi_request_ids("try", jobs),
+                          [1004, 1005, 1006, 1007, 1008])
+        self.assertEquals(self.query_api.treeherder_client.get_artifacts.call_count, 3)
+
+    def test_missing_artifact(self):
+        """A job without a buildapi artifact has no request_id."""
+        with self.assertRaises(TreeherderError):
+            self.query_api.get_buildapi_request_id("try", {"id": 3})
+
+
+def mock_jobs_pages(total):
+    def get_jobs(repo_name, count, offset, result_set_id, **params):
+        return [{"id": i, "ref_data_name": "Builder %d" % (i % 2), "state": "completed",
+                 "result": "success", "job_coalesced_to_guid": None, "log": "x" * 10}
+                for i in range(offset, min(offset + count, total))]
+    return get_jobs
+
+
+@patch('mozci.query_jobs.JOBS_PAGE_SIZE', 10)
+class TestTreeherderApiIterJobs(unittest.TestCase):
+    """Test fetching the jobs of a push page by page."""
+
+    def setUp(self):
+        self.query_api = TreeherderApi()
+        self.query_api.treeherder_client = Mock()
+        self.query_api.treeherder_client.get_resultsets.return_value = [{"id": 7}]
+
+    def test_all_pages(self):
+        """Pushes with more jobs than a page should not be truncated."""
+        self.query_api.treeherder_client.get_jobs.side_effect = mock_jobs_pages(45)
+        jobs = self.query_api._get_all_jobs("try", "146071751b1e")
+        self.assertEquals([j["id"] for j in jobs], range(45))
+        # One page first and then 3 pages at a time
+        self.assertEquals(self.query_api.treeherder_client.get_jobs.call_count, 7)
+
+    def test_projection_and_early_stop(self):
+        """get_matching_jobs only keeps JOB_FIELDS and can stop after a few jobs."""
+        self.query_api.treeherder_client.get_jobs.side_effect = mock_jobs_pages(45)
+        jobs = self.query_api.get_matching_jobs("try", "146071751b1e", "Builder 1", limit=3)
+        self.assertEquals([j["id"] for j in jobs], [1, 3, 5])
+        self.assertEquals(set(jobs[0]), set(query_jobs.JOB_FIELDS))
+        self.assertEquals(self.query_api.treeherder_client.get_jobs.call_count, 1)
+
+    def test_unknown_revision(self):
+        self.query_api.treeherder_client.get_resultsets.return_value = []
+        self.assertEquals(self.query_api.get_matching_jobs("try", "146071751b1e", "Builder 1"),
+                          [])
+
+
+class TestTreeherderApiPrefetchJobs(unittest.TestCase):
+    """Test fetching the jobs of many revisions at once."""
+
+    def setUp(self):
+        query_jobs.REVISION_JOBS_CACHE.clear()
+        self.query_api = TreeherderApi()
+        self.query_api.treeherder_client = Mock()
+        self.query_api.treeherder_client.get_resultsets.return_value = [
+            {"id": 3, "revision": "cccccccccccc0000"},
+            {"id": 2, "revision": "bbbbbbbbbbbb0000"},
+            {"id": 1, "revision": "aaaaaaaaaaaa0000"}]
+        self.query_api.treeherder_client.get_jobs.return_value = [
+            {"id": 10, "result_set_id": 3, "ref_data_name": "Builder"},
+            {"id": 11, "result_set_id": 1, "ref_data_name": "Builder"},
+            {"id": 12, "result_set_id": 1, "ref_data_name": "Other builder"}]
+
+    def tearDown(self):
+        query_jobs.REVISION_JOBS_CACHE.clear()
+
+    def test_prefetch(self):
+        """The jobs of all revisions should be fetched with two requests."""
+        revisions = ["cccccccccccc", "bbbbbbbbbbbb", "aaaaaaaaaaaa"]
+        self.query_api.prefetch_jobs("try", revisions)
+
+        jobs = [self.query_api.get_matching_jobs("try", rev, "Builder") for rev in revisions]
+        self.assertEquals([[j["id"] for j in js] for js in jobs], [[10], [], [11]])
+        self.assertEquals(self.query_api.treeherder_client.get_resultsets.call_count, 1)
+        self.assertEquals(self.query_api.treeherder_client.get_jobs.call_count, 1)
+        self.query_api.treeherder_client.get_jobs.assert_called_once_with(
+            "try", count=query_jobs.JOBS_PAGE_SIZE, offset=0, result_set_id__in='1,2,3')
+
+    @patch('mozci.query_jobs.RESULTSETS_PAGE_SIZE', 2)
+    def test_prefetch_sparse_revisions(self):
+        """Revisions far apart in a range should be found on the following pages."""
+        pages = [[{"id": 3, "revision": "cccccccccccc0000"}, {"id": 2, "revision": "bbbbbbbbbbbb"}],
+                 [{"id": 1, "revision": "aaaaaaaaaaaa0000"}]]
+        self.query_api.treeherder_client.get_resultsets.side_effect = \
+            lambda repo_name, **params: pages[params['offset'] // 2]
+        self.query_api.prefetch_jobs("try", ["cccccccccccc", "aaaaaaaaaaaa"])
+
+        self.assertEquals(sorted(query_jobs.REVISION_JOBS_CACHE),
+                          [("try", "aaaaaaaaaaaa"), ("try", "cccccccccccc")])
+        self.assertEquals(self.query_api.treeherder_client.get_resultsets.call_count, 2)
+
+    @patch('mozci.query_jobs.time.time')
+    def test_expired_prefetches_are_removed(self, time):
+        """Expired prefetched jobs should not be kept around."""
+        time.return_value = 1000
+        query_jobs.REVISION_JOBS_CACHE[("try", "dddddddddddd")] = (0, [])
+        self.query_api.prefetch_jobs("try", ["cccccccccccc", "aaaaaaaaaaaa"])
+        self.assertFalse(("try", "dddddddddddd") in query_jobs.REVISION_JOBS_CACHE)
+
+    @patch('mozci.query_jobs.time.time')
+    def test_prefetched_jobs_expire(self, time):
+        """Prefetched jobs are only used for PREFETCH_TTL seconds."""
+        time.return_value = 1000
+        self.query_api.prefetch_jobs("try", ["cccccccccccc", "aaaaaaaaaaaa"])
+        time.return_value = 1000 + query_jobs.PREFETCH_TTL
+        self.query_api.get_matching_jobs("try", "cccccccccccc", "Builder")
+        self.assertEquals(self.query_api.treeherder_client.get_resultsets.call_count, 2)
+
+
+class TestInvalidateJobs(unittest.TestCase):
+
+    def test_invalidate(self):
+        """Triggering on a revision should drop its jobs, whatever their state."""
+        query_jobs.JOBS_CACHE[("try", "b" * 12)] = [{"status": 0, "request_id": 1}]
+        query_jobs.JOBS_CACHE[("try", "a" * 40)] = [{"status": 0, "requests": [{"request_id": 2}]}]
+        query_jobs.invalidate_jobs("try", "b" * 40)
+        self.assertFalse(("try", "b" * 12) in query_jobs.JOBS_CACHE)
+
+        query_jobs.invalidate_request("try", 2)
+        self.assertFalse(("try", "a" * 40) in query_jobs.JOBS_CACHE)
@@ -0,0 +1,90 @@
+"""This file contains tests for mozci/utils/scheduling_ledger.py."""
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+
+from mock import patch
+
+from mozci.utils import scheduling_ledger
+
+KEY = ('repo', '146071751b1e5d16b87786f6e60485222c28c202', 'Platform repo build')
+
+
+def _claim(_):
+    return os.getpid(), scheduling_ledger.claim(*KEY)
+
+
+class TestSchedulingLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patcher = patch('mozci.utils.scheduling_ledger.LEDGER_FILE',
+                             os.path.join(self.tmp_dir, 'scheduling.db'))
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_one_session_per_process(self):
+        """Threads asking for the session at once should all get the same one."""
+        scheduling_ledger._SESSIONS.clear()
+        sessions = []
+        threads = [threading.Thread(target=lambda: sessions.append(scheduling_ledger.session()))
+                   for _ in range(20)]
+        with patch('mozci.utils.scheduling_ledger.uuid.uuid4',
+                   side_effect=lambda: time.sleep(0.01) or uuid.uuid1()):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEquals(len(set(sessions)), 1)
+
+    def test_other_sessions_are_refused(self):
+        """A build requested by another session should not be requested again."""
+        self.assertTrue(scheduling_ledger.claim(*KEY))
+        # Our own session can request it again
+        self.assertTrue(scheduling_ledger.claim(*KEY))
+        self.assertFalse(scheduling_ledger.is_claimed(*KEY))
+
+        with patch('mozci.utils.scheduling_ledger.session', return_value='other'):
+            self.assertTrue(scheduling_ledger.is_claimed(*KEY))
+            self.assertFalse(scheduling_ledger.claim(*KEY))
+            # Once the request has expired it can be requested again
+            self.assertTrue(scheduling_ledger.claim(*KEY, ttl=0))
+
+    def test_release(self):
+        """A released request can be made by other sessions."""
+        scheduling_ledger.claim(*KEY)
+        scheduling_ledger.release(*KEY)
+        with patch('mozci.utils.scheduling_ledger.session', return_value='other'):
+            self.assertTrue(scheduling_ledger.claim(*KEY))
+
+    def test_lookups_do_not_wait_for_writers(self):
+        """is_claimed() should not wait for a process holding the write lock."""
+        scheduling_ledger.claim(*KEY)
+        writer = sqlite3.connect(scheduling_ledger.LEDGER_FILE, isolation_level=None)
+        writer.execute("BEGIN IMMEDIATE")
+        try:
+            start = time.time()
+            self.assertFalse(scheduling_ledger.is_claimed(*KEY))
+            self.assertTrue(time.time() - start < 5)
+        finally:
+            writer.execute("ROLLBACK")
+            writer.close()
+
+    def test_concurrent_processes(self):
+        """Only one of many processes claiming the same build at once should get it."""
+        pool = multiprocessing.Pool(4)
+        try:
+            results = pool.map(_claim, range(8))
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEquals(len(set(pid for pid, claimed in results if claimed)), 1)
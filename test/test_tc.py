@@ -0,0 +1,72 @@
+"""This file contains tests for mozci/sources/tc.py."""
+import unittest
+
+from mock import Mock, patch
+from taskcluster.exceptions import TaskclusterAuthFailure, TaskclusterRestFailure
+
+from mozci.sources import tc
+from mozci.utils import transport
+
+
+def _get_task(task_id):
+    if task_id == 'missing':
+        raise TaskclusterRestFailure('Task not found', None)
+    return {'taskGroupId': 'group', 'payload': {},
+            'metadata': {'name': task_id, 'description': task_id,
+                         'owner': 'nobody@mozilla.com', 'source': 'https://hg.mozilla.org'}}
+
+
+@patch('mozci.sources.tc.credentials_available', return_value=True)
+@patch('mozci.sources.tc.get_task', side_effect=_get_task)
+@patch('mozci.sources.tc.schedule_graph', return_value={'status': {}})
+class TestRetriggerTasks(unittest.TestCase):
+
+    def test_single_graph(self, schedule_graph, get_task, credentials_available):
+        """Every task should be fetched once and scheduled in a single graph."""
+        results = tc.retrigger_tasks(['a', 'b', 'a', 'missing'])
+
+        self.assertEquals(sorted(call[0][0] for call in get_task.call_args_list),
+                          ['a', 'b', 'missing'])
+        self.assertEquals(schedule_graph.call_count, 1)
+        tasks = schedule_graph.call_args[0][0]['tasks']
+        self.assertEquals([task['metadata']['name'] for task in tasks], ['a', 'b'])
+        self.assertEquals(results, {'a': tasks[0]['taskId'], 'b': tasks[1]['taskId'],
+                                    'missing': None})
+
+    def test_graph_per_task(self, schedule_graph, get_task, credentials_available):
+        """Without single_graph every task should get its own graph."""
+        results = tc.retrigger_tasks(['a', 'b'], single_graph=False)
+
+        self.assertEquals(schedule_graph.call_count, 2)
+        self.assertTrue(all(len(call[0][0]['tasks']) == 1
+                            for call in schedule_graph.call_args_list))
+        self.assertTrue(results['a'] and results['b'] and results['a'] != results['b'])
+
+    def test_dry_run(self, schedule_graph, get_task, credentials_available):
+        """Nothing is retriggered on dry_run."""
+        schedule_graph.return_value = None
+        self.assertEquals(tc.retrigger_tasks(['a', 'b'], dry_run=True), {'a': None, 'b': None})
+        self.assertEquals(schedule_graph.call_args[1], {'dry_run': True})
+
+    def test_auth_failures(self, schedule_graph, get_task, credentials_available):
+        """Authentication failures should be reported per task instead of aborting."""
+        get_task.side_effect = TaskclusterAuthFailure('Authentication Error')
+        with patch('mozci.sources.tc.handle_auth_failure') as handle_auth_failure:
+            self.assertEquals(tc.retrigger_tasks(['a', 'b']), {'a': None, 'b': None})
+        self.assertEquals(handle_auth_failure.call_count, 2)
+        assert not schedule_graph.called
+
+
+class TestClients(unittest.TestCase):
+
+    def test_requests_use_the_session(self):
+        """The clients' requests should go through their session and so through cassettes."""
+        queue = tc._create_client(tc._Queue, {'baseUrl': 'http://localhost/v1'})
+        self.assertTrue(isinstance(queue.session.get_adapter('https://localhost'),
+                                   transport.CassetteAdapter))
+
+        response = Mock(status_code=200)
+        response.json.return_value = {'status': {'taskId': 'a'}}
+        with patch.object(queue.session, 'request', return_value=response) as request:
+            self.assertEquals(queue.status('a'), {'status': {'taskId': 'a'}})
+        self.assertEquals(request.call_args[0][:2], ('GET', 'http://localhost/v1/task/a/status'))
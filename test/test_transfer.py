@@ -0,0 +1,100 @@
+"""This file contains tests for mozci/utils/transfer.py."""
+import gzip
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from mock import patch
+
+from mozci import mozci
+from mozci.utils import instrumentation, transfer
+
+BUILDS = {"builds": [{"request_ids": [1],
+                      "reason": "scheduler",
+                      "properties": {"buildername": "Platform repo test", "request_ids": [1]}}]}
+
+
+class TestLoadMode(unittest.TestCase):
+
+    """Test how load_file() picks the loading mode of a file."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, 'builds-2015-02-23.js')
+        with gzip.open(self.filepath, 'wb') as fd:
+            fd.write(json.dumps(BUILDS))
+        self.size = len(json.dumps(BUILDS))
+        instrumentation.reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        instrumentation.reset()
+
+    def test_uncompressed_size(self):
+        """The uncompressed size of a gzip file comes from its trailer."""
+        self.assertEquals(transfer._uncompressed_size(self.filepath), self.size)
+
+    def test_uncompressed_size_wrapped(self):
+        """The size of big files wraps around 4GB; 5GB compressed to 500MB reads as 1GB."""
+        compressed = 500 * 1024 ** 2
+        with open(self.filepath, 'r+b') as fd:
+            fd.seek(-4, os.SEEK_END)
+            fd.write(struct.pack('<I', 5 * 1024 ** 3 % 2 ** 32))
+        with patch('os.path.getsize', return_value=compressed):
+            self.assertEquals(transfer._uncompressed_size(self.filepath), 5 * 1024 ** 3)
+
+    def test_modes(self):
+        """The whole file should be loaded if it fits in the memory budget."""
+        per_byte = transfer.MEMORY_PER_BYTE
+        for memory, mode in ((self.size * per_byte['full'] * 2, 'full'),
+                             (self.size, 'projected')):
+            with patch('mozci.utils.transfer.available_memory', return_value=memory):
+                self.assertEquals(transfer._load_mode(self.filepath), mode)
+
+        self.assertEquals(instrumentation.to_json()['events']['load_file.mode'],
+                          {'full': 1, 'projected': 1})
+
+    @patch('mozci.utils.transfer.available_memory', return_value=1)
+    def test_plain_json_is_loaded_whole(self, available_memory):
+        """Only buildjson (gzip) files should be projected automatically."""
+        filepath = os.path.join(self.tmp_dir, 'data.json')
+        with open(filepath, 'w') as fd:
+            fd.write(json.dumps(BUILDS))
+        self.assertEquals(transfer._load_mode(filepath), 'full')
+
+    @patch('mozci.utils.transfer.available_memory', return_value=1)
+    def test_forced_mode(self, available_memory):
+        """Setting MEMORY_SAVING_MODE overrides the adaptive policy."""
+        with patch('mozci.utils.transfer.MEMORY_SAVING_MODE', False):
+            self.assertEquals(transfer._load_mode(self.filepath), 'full')
+
+    @patch('mozci.utils.transfer.available_memory', return_value=1)
+    @patch('mozci.utils.transfer.fetch_file')
+    def test_projected_load(self, fetch_file, available_memory):
+        """Only the fields mozci needs are kept when memory is short."""
+        fetch_file.return_value = self.filepath
+        builds = transfer.load_file(self.filepath, 'url')['builds']
+        self.assertEquals(builds, [{"request_ids": [1],
+                                    "properties": {"buildername": "Platform repo test",
+                                                   "request_ids": [1]}}])
+
+    @patch('mozci.utils.transfer.MEMORY_SAVING_MODE', True)
+    def test_projected_jobs_are_enough(self):
+        """What mozci reads from buildjson jobs should survive the projection."""
+        properties = {"buildername": "Platform repo build", "request_ids": [1],
+                      "revision": "146071751b1e", "packageUrl": "http://server/package.zip",
+                      "testPackagesUrl": "http://server/tests.json", "log_url": "http://log"}
+        filepath = os.path.join(self.tmp_dir, 'builds-2015-02-24.js')
+        with gzip.open(filepath, 'wb') as fd:
+            fd.write(json.dumps({"builds": [{"request_ids": [1], "result": 0,
+                                             "properties": properties}]}))
+
+        with patch('mozci.utils.transfer.fetch_file', return_value=filepath):
+            job = transfer.load_file(filepath, 'url')['builds'][0]
+        with patch('mozci.mozci._status_info', return_value=job):
+            self.assertEquals(mozci._find_files({}),
+                              ["http://server/package.zip", "http://server/tests.json"])
+        self.assertEquals(job["properties"]["revision"], "146071751b1e")
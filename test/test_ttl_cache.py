@@ -0,0 +1,86 @@
+"""This file contains tests for mozci/utils/ttl_cache.py."""
+import threading
+import time
+import unittest
+
+from mozci.query_jobs import _all_finished
+from mozci.utils.ttl_cache import StateAwareCache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000
+
+    def __call__(self):
+        return self.now
+
+
+class TestStateAwareCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = StateAwareCache('test', is_final=_all_finished, ttl=60, max_stale=600,
+                                     max_weight=10, clock=self.clock)
+        self.fetched = threading.Event()
+        self.calls = []
+
+    def _fetch(self, jobs):
+        self.calls.append(jobs)
+        self.fetched.set()
+        return jobs
+
+    def test_final_entries_do_not_expire(self):
+        """Jobs which have all finished should be served from the cache forever."""
+        finished = [{"status": 0}, {"status": 2}]
+        self.cache['rev'] = finished
+        self.clock.now += 100000
+        self.assertEquals(self.cache.lookup('rev', self._fetch, []), finished)
+        self.assertEquals(self.calls, [])
+
+    def test_stale_entries_are_revalidated(self):
+        """Unfinished jobs are served while they are refreshed in the background."""
+        pending = [{"status": 0}, {"request_id": 1}]
+        finished = [{"status": 0}, {"status": 0}]
+        self.cache['rev'] = pending
+        self.assertEquals(self.cache.lookup('rev', self._fetch, finished), pending)
+
+        self.clock.now += 61
+        self.assertEquals(self.cache.lookup('rev', self._fetch, finished), pending)
+        self.assertTrue(self.fetched.wait(5))
+        # Wait for the background thread to store the new value
+        while self.cache._revalidating:
+            time.sleep(0.01)
+        self.assertEquals(self.cache['rev'], finished)
+
+    def test_expired_entries_are_fetched(self):
+        """Unfinished jobs older than ttl + max_stale are fetched again before returning."""
+        self.cache['rev'] = [{"status": None}]
+        self.clock.now += 661
+        self.assertEquals(self.cache.lookup('rev', self._fetch, [{"status": 0}]), [{"status": 0}])
+        self.assertEquals(len(self.calls), 1)
+
+    def test_lru_eviction(self):
+        """The least recently used entries go away once max_weight is reached."""
+        for key in ('a', 'b', 'c'):
+            self.cache[key] = [{"status": 0}] * 2
+        self.cache.lookup('a', self._fetch, None)
+        self.cache['d'] = [{"status": 0}] * 2
+        self.assertEquals(sorted(self.cache._entries), ['a', 'c', 'd'])
+        self.assertEquals(self.cache.total_weight, 9)
+
+    def test_invalidate(self):
+        """Invalidated entries are fetched again, even the final ones."""
+        self.cache['rev'] = [{"status": 0}]
+        self.cache.invalidate('rev')
+        self.assertEquals(self.cache.lookup('rev', self._fetch, [{"request_id": 1}]),
+                          [{"request_id": 1}])
+        self.assertEquals(self.cache.total_weight, 2)
+
+    def test_invalidate_during_fetch(self):
+        """A value fetched before the entry was invalidated should not be stored."""
+        def _fetch():
+            self.cache.invalidate('rev')
+            return [{"status": 0}]
+
+        self.assertEquals(self.cache.lookup('rev', _fetch), [{"status": 0}])
+        self.assertFalse('rev' in self.cache)